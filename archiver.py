@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Single-pass streaming backup archiver shared by deploy.py and
+# backup.py
+#
+# BACKUP_CODEC picks the compression: gzip (in-process, one core), pigz
+# (parallel gzip), zstd (multi-threaded) or none. Restores detect the
+# codec from the archive itself.
+#
+# Walks the app folder once, skips excluded paths, and streams each
+# file straight into the compressed archive. No staging copy and only
+# one read buffer in memory at a time. The archive is written next to
+# its final name and renamed into place, so a failed backup never
+# leaves a truncated file behind.
+# ----------------------------------------------------------------
+
+import fnmatch
+import gzip
+import os
+import shutil
+import subprocess
+import tarfile
+
+DEFAULT_EXCLUDES = ["node_modules", ".next/cache", ".git"]
+CODECS = ["gzip", "pigz", "zstd", "none"]
+EXTENSIONS = {"gzip": ".tar.gz", "pigz": ".tar.gz", "zstd": ".tar.zst", "none": ".tar"}
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+# BACKUP_EXCLUDES="node_modules,.next/cache,.git" in app.conf. By
+# default a standalone server's node_modules is kept: it is small, and
+# without a full package.json install it can't be recreated on rollback.
+def excludes_for(config, source_root=None):
+    value = config.get("BACKUP_EXCLUDES")
+    if value is None:
+        if source_root and os.path.isfile(os.path.join(source_root, "server.js")):
+            return [pattern for pattern in DEFAULT_EXCLUDES if pattern != "node_modules"]
+        return list(DEFAULT_EXCLUDES)
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+# BACKUP_CODEC / BACKUP_LEVEL / BACKUP_THREADS in app.conf, as keyword
+# arguments for create_archive. BACKUP_THREADS=0 uses every core.
+def codec_options(config):
+    level = config.get("BACKUP_LEVEL")
+    return {
+        "codec": config.get("BACKUP_CODEC", "gzip"),
+        "level": int(level) if level else None,
+        "threads": int(config.get("BACKUP_THREADS", "0")),
+    }
+
+
+def extension_for(codec):
+    return EXTENSIONS.get(codec, ".tar")
+
+
+# Patterns without a slash match a name at any depth (like rsync
+# --exclude=node_modules); patterns with a slash match the end of the
+# path relative to the app folder
+def is_excluded(rel_path, excludes):
+    name = os.path.basename(rel_path)
+    for pattern in excludes:
+        if "/" in pattern:
+            pattern = pattern.strip("/")
+            if fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(rel_path, f"*/{pattern}"):
+                return True
+        elif fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+# Yield (absolute path, path relative to source_root) for everything
+# that belongs in the backup, in a stable order
+def walk(source_root, excludes):
+    for root, dirs, files in os.walk(source_root):
+        rel_root = os.path.relpath(root, source_root)
+        rel_root = "" if rel_root == "." else rel_root
+        dirs.sort()
+        kept_dirs = []
+        for name in dirs:
+            rel_path = os.path.join(rel_root, name)
+            if is_excluded(rel_path, excludes):
+                continue
+            kept_dirs.append(name)
+            yield os.path.join(root, name), rel_path
+        dirs[:] = kept_dirs
+        for name in sorted(files):
+            rel_path = os.path.join(rel_root, name)
+            if not is_excluded(rel_path, excludes):
+                yield os.path.join(root, name), rel_path
+
+
+# Compressed stream for a codec. gzip runs in-process; pigz and zstd
+# run as child processes so compression uses every core.
+class _Compressor:
+    def __init__(self, out_file, codec, level, threads):
+        self.process = None
+        self.gzip_file = None
+        threads = threads or os.cpu_count() or 1
+        if codec == "none":
+            self.stream = out_file
+        elif codec == "gzip":
+            self.gzip_file = gzip.GzipFile(fileobj=out_file, mode="wb", compresslevel=level or 6)
+            self.stream = self.gzip_file
+        elif codec in ("pigz", "zstd"):
+            if codec == "pigz":
+                command = ["pigz", "-c", f"-{level or 6}", "-p", str(threads)]
+            else:
+                command = ["zstd", "-q", "-c", f"-{level or 3}", f"-T{threads}"]
+            if shutil.which(command[0]) is None:
+                raise OSError(f"BACKUP_CODEC={codec} needs '{command[0]}' on the PATH")
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=out_file)
+            self.stream = self.process.stdin
+        else:
+            raise ValueError(f"Unknown BACKUP_CODEC: {codec}")
+
+    def close(self):
+        if self.gzip_file is not None:
+            self.gzip_file.close()
+        if self.process is not None:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise subprocess.CalledProcessError(self.process.returncode, self.process.args)
+
+    def abort(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+
+
+# Stream source_root into a tar archive compressed with codec. Entries
+# are stored under arcname (the app folder name by default). Returns
+# file and byte counts for the log.
+def create_archive(source_root, archive_path, excludes=None, arcname=None, codec="gzip", level=None, threads=0):
+    excludes = DEFAULT_EXCLUDES if excludes is None else excludes
+    arcname = arcname or os.path.basename(os.path.normpath(source_root))
+    tmp_path = archive_path + ".part"
+    stats = {"files": 0, "bytes": 0}
+
+    try:
+        with open(tmp_path, "wb") as out_file:
+            compressor = _Compressor(out_file, codec, level, threads)
+            try:
+                with tarfile.open(fileobj=compressor.stream, mode="w|") as archive:
+                    archive.add(source_root, arcname=arcname, recursive=False)
+                    for abs_path, rel_path in walk(source_root, excludes):
+                        info = archive.gettarinfo(abs_path, arcname=os.path.join(arcname, rel_path))
+                        if info is None:
+                            # Sockets and other special files can't be archived
+                            continue
+                        if info.isreg():
+                            with open(abs_path, "rb") as member:
+                                archive.addfile(info, member)
+                            stats["files"] += 1
+                            stats["bytes"] += info.size
+                        else:
+                            archive.addfile(info)
+            except BaseException:
+                compressor.abort()
+                raise
+            compressor.close()
+        os.replace(tmp_path, archive_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    stats["archive_bytes"] = os.path.getsize(archive_path)
+    return stats
+
+
+# Codec of an existing archive, from its magic bytes
+def detect_codec(archive_path):
+    with open(archive_path, "rb") as archive_file:
+        magic = archive_file.read(4)
+    if magic[:2] == GZIP_MAGIC:
+        return "gzip"
+    if magic == ZSTD_MAGIC:
+        return "zstd"
+    return "none"
+
+
+# Unpack any backup into dest_dir, whatever codec wrote it
+def extract_archive(archive_path, dest_dir):
+    codec = detect_codec(archive_path)
+    os.makedirs(dest_dir, exist_ok=True)
+    if codec == "zstd":
+        process = subprocess.Popen(["zstd", "-q", "-d", "-c", archive_path], stdout=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=process.stdout, mode="r|") as archive:
+                _extract_all(archive, dest_dir)
+        finally:
+            process.stdout.close()
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, process.args)
+    else:
+        mode = "r|gz" if codec == "gzip" else "r|"
+        with tarfile.open(archive_path, mode) as archive:
+            _extract_all(archive, dest_dir)
+    return codec
+
+
+def _extract_all(archive, dest_dir):
+    # Reject absolute paths and `..` members where the filter API exists
+    if hasattr(tarfile, "data_filter"):
+        archive.extractall(dest_dir, filter="tar")
+    else:
+        archive.extractall(dest_dir)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Build-once artifacts shared between hosts (ARTIFACTS in app.conf)
+#
+#   off       every host clones, installs and builds (default)
+#   publish   build as usual, then publish the result
+#   fetch     unpack a published artifact instead of clone + install +
+#             build when one exists for the commit; build otherwise
+#   auto      fetch when possible, build and publish when not
+#
+# An artifact is the built app folder (.next, node_modules, public,
+# package.json, ...) without .git, .next/cache and .env.local, packed
+# with archiver.create_archive. Its key is
+#   <app>/<commit sha>-<node version>-<lockfile hash>
+# and a manifest next to it records the archive's sha256, which is
+# checked before anything is unpacked. A fetching host only needs the
+# commit SHA (git ls-remote) and its own node version to find it.
+#
+# ARTIFACT_STORE is a folder (shared mount, rsync target) or
+# object://<folder> for the bucket stand-in, which keeps flat object
+# keys with an ETag per object the way S3-style stores do. Both write
+# the archive first and the manifest last, so a half-published artifact
+# is never found. ARTIFACT_KEEP (default 10) artifacts are kept per app.
+# ----------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import quote, unquote
+
+import archiver
+import npm_cache
+
+MODES = ("off", "publish", "fetch", "auto")
+EXCLUDES = [".git", ".next/cache", ".env.local"]
+ARCNAME = "app"
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def mode_of(config):
+    mode = config.get("ARTIFACTS", "off")
+    if mode not in MODES:
+        raise ValueError(f"Unknown ARTIFACTS mode '{mode}' (expected one of {', '.join(MODES)})")
+    return mode
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as artifact_file:
+        for block in iter(lambda: artifact_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _tmp_name(path):
+    return f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+
+# A plain folder: <root>/<app>/<key>.tar.gz and <key>.json
+class DirectoryStore:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def put(self, name, source_path):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = _tmp_name(path)
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def get(self, name, dest_path):
+        shutil.copyfile(self._path(name), dest_path)
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        folder, _, start = prefix.rpartition("/")
+        try:
+            entries = os.listdir(self._path(folder))
+        except FileNotFoundError:
+            return []
+        return sorted(f"{folder}/{entry}" for entry in entries if entry.startswith(start) and not entry.endswith(".tmp"))
+
+
+# Local stand-in for an object store: one flat file per object key plus
+# a .meta with its size and ETag (md5), checked on every get
+class ObjectStore:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, quote(name, safe=""))
+
+    def put(self, name, source_path):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(name)
+        etag = hashlib.md5()
+        tmp_path = _tmp_name(path)
+        with open(source_path, "rb") as source, open(tmp_path, "wb") as target:
+            for block in iter(lambda: source.read(1 << 20), b""):
+                etag.update(block)
+                target.write(block)
+        meta_tmp = _tmp_name(path + ".meta")
+        with open(meta_tmp, "w") as meta_file:
+            json.dump({"size": os.path.getsize(tmp_path), "etag": etag.hexdigest()}, meta_file)
+        os.replace(tmp_path, path)
+        os.replace(meta_tmp, path + ".meta")
+
+    def get(self, name, dest_path):
+        path = self._path(name)
+        with open(path + ".meta", "r") as meta_file:
+            meta = json.load(meta_file)
+        etag = hashlib.md5()
+        with open(path, "rb") as source, open(dest_path, "wb") as target:
+            for block in iter(lambda: source.read(1 << 20), b""):
+                etag.update(block)
+                target.write(block)
+        if etag.hexdigest() != meta["etag"]:
+            raise ArtifactError(f"object {name} does not match its ETag")
+
+    def delete(self, name):
+        for path in (self._path(name), self._path(name) + ".meta"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def list(self, prefix):
+        try:
+            entries = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        names = [unquote(entry[:-len(".meta")]) for entry in entries if entry.endswith(".meta")]
+        return sorted(name for name in names if name.startswith(prefix))
+
+
+def store_for(config):
+    location = config.get("ARTIFACT_STORE")
+    if not location:
+        raise ValueError("ARTIFACTS is on but ARTIFACT_STORE is not set")
+    if location.startswith("object://"):
+        return ObjectStore(location[len("object://"):])
+    return DirectoryStore(location)
+
+
+def _read_manifest(store, name):
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, "manifest.json")
+        store.get(name, path)
+        with open(path, "r") as manifest_file:
+            return json.load(manifest_file)
+
+
+def _prefix(config, commit_sha, node):
+    return f"{config['APP_NAME_PM2']}/{commit_sha}-{node}-"
+
+
+# Manifest of the artifact for this commit and node version, or None
+def find(config, store, commit_sha, node):
+    for name in store.list(_prefix(config, commit_sha, node)):
+        if name.endswith(".json"):
+            return _read_manifest(store, name)
+    return None
+
+
+# Download, verify and unpack the artifact into dest (which must not
+# exist yet). Returns the manifest.
+def fetch(config, store, manifest, dest):
+    work_dir = f"{dest}.unpack"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    try:
+        archive_path = os.path.join(work_dir, os.path.basename(manifest["archive"]))
+        store.get(manifest["archive"], archive_path)
+        digest = sha256_of(archive_path)
+        if digest != manifest["sha256"]:
+            raise ArtifactError(f"{manifest['archive']} checksum mismatch (expected {manifest['sha256']}, got {digest})")
+        archiver.extract_archive(archive_path, work_dir)
+        unpacked = os.path.join(work_dir, ARCNAME)
+        # The lockfile inside must be the one the key was made from
+        if npm_cache.store_key(unpacked, manifest["node"]) != manifest["lockfile"]:
+            raise ArtifactError(f"{manifest['archive']} does not contain the lockfile it was keyed on")
+        os.rename(unpacked, dest)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return manifest
+
+
+# Pack app_root and publish it under its commit / node / lockfile key.
+# Returns the manifest.
+def publish(config, store, app_root, commit_sha):
+    node = npm_cache.node_version()
+    lock_key = npm_cache.store_key(app_root, node)
+    if lock_key is None:
+        raise ArtifactError("no package-lock.json to key the artifact on")
+    key = f"{_prefix(config, commit_sha, node)}{lock_key[:16]}"
+    codec = config.get("ARTIFACT_CODEC", "gzip")
+    archive_name = f"{key}{archiver.extension_for(codec)}"
+
+    archive_path = _tmp_name(os.path.join(os.path.dirname(os.path.normpath(app_root)), "artifact"))
+    try:
+        stats = archiver.create_archive(app_root, archive_path, EXCLUDES, ARCNAME, codec=codec)
+        manifest = {
+            "key": key, "archive": archive_name, "sha256": sha256_of(archive_path),
+            "commit": commit_sha, "node": node, "lockfile": lock_key, "codec": codec,
+            "files": stats["files"], "bytes": stats["bytes"], "archive_bytes": stats["archive_bytes"],
+            "host": socket.gethostname(), "created": time.time(),
+        }
+        store.put(archive_name, archive_path)
+    finally:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        manifest_path = os.path.join(work_dir, "manifest.json")
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        store.put(f"{key}.json", manifest_path)
+    manifest["pruned"] = prune(config, store)
+    return manifest
+
+
+# Keep the newest ARTIFACT_KEEP artifacts of this app
+def prune(config, store):
+    keep = int(config.get("ARTIFACT_KEEP", "10"))
+    prefix = f"{config['APP_NAME_PM2']}/"
+    names = store.list(prefix)
+    manifests = [name for name in names if name.endswith(".json")]
+    removed = []
+    if len(manifests) <= keep:
+        return removed
+    created = {}
+    for name in manifests:
+        try:
+            created[name] = _read_manifest(store, name).get("created", 0)
+        except (OSError, ValueError, ArtifactError):
+            created[name] = 0
+    for name in sorted(manifests, key=lambda name: created[name])[:-keep]:
+        key = name[:-len(".json")]
+        # Manifest first, so nobody finds an artifact whose archive is gone
+        store.delete(name)
+        for archive_name in names:
+            if archive_name.startswith(key) and archive_name != name:
+                store.delete(archive_name)
+        removed.append(key)
+    return removed
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Backup codec benchmark
+#
+# Archives a sample tree with every available codec and prints
+# throughput (MB/s of source data) and compression ratio, so
+# BACKUP_CODEC / BACKUP_LEVEL / BACKUP_THREADS can be picked from
+# measurements.
+#
+#   python3 backup-bench.py ../my-app
+#   python3 backup-bench.py ../my-app --level 6 --threads 4
+# ----------------------------------------------------------------
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import archiver
+
+parser = argparse.ArgumentParser(description="Benchmark backup codecs on a sample tree.")
+parser.add_argument("source", help="Folder to archive, e.g. a deployed app")
+parser.add_argument("--codecs", default=",".join(archiver.CODECS), help="Comma separated codecs to try")
+parser.add_argument("--level", type=int, default=None, help="Compression level (codec default if omitted)")
+parser.add_argument("--threads", type=int, default=0, help="Threads for pigz/zstd (0 = all cores)")
+args = parser.parse_args()
+
+if not os.path.isdir(args.source):
+    print(f"Error: '{args.source}' is not a folder.")
+    sys.exit(1)
+
+excludes = archiver.DEFAULT_EXCLUDES
+work_dir = tempfile.mkdtemp(prefix="backup-bench-")
+results = []
+try:
+    for codec in [name.strip() for name in args.codecs.split(",") if name.strip()]:
+        archive_path = os.path.join(work_dir, f"bench{archiver.extension_for(codec)}")
+        started = time.monotonic()
+        try:
+            stats = archiver.create_archive(
+                args.source, archive_path, excludes, codec=codec, level=args.level, threads=args.threads
+            )
+        except (OSError, ValueError) as e:
+            print(f"{codec:<6}: skipped ({e})")
+            continue
+        seconds = max(time.monotonic() - started, 1e-6)
+        results.append((
+            codec,
+            seconds,
+            stats["bytes"] / (1024 * 1024) / seconds,
+            stats["bytes"] / max(stats["archive_bytes"], 1),
+            stats["archive_bytes"],
+        ))
+        os.remove(archive_path)
+finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+print(f"\n{'CODEC':<6}  {'SECONDS':>8}  {'MB/S':>8}  {'RATIO':>6}  {'ARCHIVE MB':>10}")
+for codec, seconds, throughput, ratio, archive_bytes in results:
+    print(f"{codec:<6}  {seconds:>8.2f}  {throughput:>8.1f}  {ratio:>6.2f}  {archive_bytes / (1024 * 1024):>10.1f}")
@@ -5,6 +5,10 @@ import subprocess
 from datetime import datetime
 import sys
 
+import archiver
+import backup_store
+import events
+
 # Define paths
 config_path = "../app.conf"
 timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
@@ -26,7 +30,14 @@ with open(config_path, "r") as conf_file:
 # Define paths based on configuration
 app_folder = os.path.join("..", config["APP_NAME_GITHUB"])
 backup_folder = "../backup"
-backup_file = f"{backup_folder}/BK-{config['APP_NAME_GITHUB']}-{timestamp}.tar.gz"
+backup_options = archiver.codec_options(config)
+backup_file = f"{backup_folder}/BK-{config['APP_NAME_GITHUB']}-{timestamp}{archiver.extension_for(backup_options['codec'])}"
+
+# Plain log lines plus structured records in a .jsonl next to the log
+event_log = events.EventLog(
+    events.events_path_for(log_file), text_path=log_file,
+    run=f"backup-{timestamp}", app=config["APP_NAME_GITHUB"], echo=False
+)
 
 # Verify that the app folder exists
 if not os.path.isdir(app_folder):
@@ -38,23 +49,39 @@ with open(log_file, "w") as log:
     log.write(f"Backup log - {timestamp}\n")
     log.write(f"Backing up '{app_folder}' to '{backup_file}'\n")
 
-# Remove node_modules to save space
-node_modules_path = os.path.join(app_folder, "node_modules")
-if os.path.isdir(node_modules_path):
-    print(f"Removing 'node_modules' from '{app_folder}' to reduce backup size.")
-    subprocess.run(["rm", "-rf", node_modules_path], check=True)
-
-# Create a compressed archive of the app folder
+# Back up the app folder in a single streaming pass. node_modules,
+# .next/cache and .git are skipped rather than deleted from the live app.
 try:
-    print(f"Creating backup '{backup_file}'...")
-    subprocess.run(["tar", "-czf", backup_file, "-C", "..", config["APP_NAME_GITHUB"]], check=True)
-    with open(log_file, "a") as log:
-        log.write(f"Backup created successfully at '{backup_file}'.\n")
-    print(f"Backup created successfully: {backup_file}")
-except subprocess.CalledProcessError as e:
+    with events.bind(event_log, "backup"), event_log.phase("backup"):
+        if config.get("BACKUP_MODE", "archive") == "repository":
+            backup_repo = config.get("BACKUP_REPO_DIR", os.path.join(backup_folder, "repo"))
+            print(f"Adding backup to repository '{backup_repo}'...")
+            backup_name, backup_stats = backup_store.backup(
+                backup_repo, config["APP_NAME_GITHUB"], app_folder, archiver.excludes_for(config, app_folder), timestamp
+            )
+            gc_stats = backup_store.gc(backup_repo, int(config.get("BACKUP_KEEP", "10")))
+            event_log.message(
+                f"Backup '{backup_name}' added to '{backup_repo}' "
+                f"({backup_stats['files']} files, {backup_stats['reused_files']} unchanged, "
+                f"{backup_stats['new_chunks']} new chunks, {backup_stats['written_bytes']} bytes written; "
+                f"gc removed {len(gc_stats['manifests'])} old backups and {gc_stats['chunks']} chunks)."
+            )
+            print(f"Backup created successfully: {backup_name}")
+        else:
+            print(f"Creating backup '{backup_file}'...")
+            backup_stats = archiver.create_archive(
+                app_folder, backup_file, archiver.excludes_for(config, app_folder), config["APP_NAME_GITHUB"],
+                **backup_options
+            )
+            event_log.message(
+                f"Backup created successfully at '{backup_file}' "
+                f"({backup_stats['files']} files, {backup_stats['bytes']} bytes in, "
+                f"{backup_stats['archive_bytes']} bytes out)."
+            )
+            print(f"Backup created successfully: {backup_file}")
+except (OSError, ValueError, subprocess.SubprocessError) as e:
     error_message = f"Error creating backup: {e}"
-    with open(log_file, "a") as log:
-        log.write(f"{error_message}\n")
+    event_log.message(error_message)
     print(error_message)
     sys.exit(1)
 
@@ -63,7 +90,6 @@ print("\nCurrent backups:")
 subprocess.run(["ls", "-ltr", backup_folder])
 
 # Log completion
-with open(log_file, "a") as log:
-    log.write("Backup operation completed successfully.\n")
+event_log.message("Backup operation completed successfully.")
 
 print(f"\nBackup operation logged to: {log_file}")
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Content-addressed, deduplicating backup repository
+# (BACKUP_MODE=repository)
+#
+# Layout under BACKUP_REPO_DIR (default BACKUP_DIR/repo):
+#   chunks/ab/<sha256>        zlib-compressed 1 MiB file chunks, stored once
+#   manifests/<name>.json     one small manifest per backup
+#   index/<app>.json          path -> (size, mtime, ctime, inode, chunks)
+#                             of the last backup
+#
+# Files whose size, mtime, ctime and inode all match the index (and
+# whose chunks still exist) are not read again. ctime can't be set from
+# user space and a rewrite-and-rename changes the inode, so a same-size
+# edit that kept its mtime is still caught. Backing up an unchanged tree
+# only writes a manifest. gc() keeps the newest BACKUP_KEEP manifests per
+# app and deletes chunks no remaining manifest refers to.
+# ----------------------------------------------------------------
+
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import archiver
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def repo_dir_for(config):
+    return config.get("BACKUP_REPO_DIR", os.path.join(config["BACKUP_DIR"], "repo"))
+
+
+# Backups share the repository (LOCK_SH); gc needs it to itself
+# (LOCK_EX) so it never sweeps chunks a running backup is about to
+# reference
+@contextmanager
+def repo_lock(repo, exclusive):
+    os.makedirs(repo, exist_ok=True)
+    with open(os.path.join(repo, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _chunk_path(repo, digest):
+    return os.path.join(repo, "chunks", digest[:2], digest)
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as json_file:
+        json.dump(data, json_file)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return default
+
+
+# Store one chunk unless it is already there. Returns bytes written.
+def _put_chunk(repo, digest, data):
+    path = _chunk_path(repo, digest)
+    if os.path.exists(path):
+        return 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    packed = zlib.compress(data, 6)
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as chunk_file:
+        chunk_file.write(packed)
+    os.replace(tmp_path, path)
+    return len(packed)
+
+
+def _store_file(repo, abs_path, stats):
+    chunks = []
+    with open(abs_path, "rb") as source:
+        for data in iter(lambda: source.read(CHUNK_SIZE), b""):
+            digest = hashlib.sha256(data).hexdigest()
+            written = _put_chunk(repo, digest, data)
+            stats["new_chunks"] += 1 if written else 0
+            stats["written_bytes"] += written
+            chunks.append(digest)
+    return chunks
+
+
+# Back up source_root as a new manifest. Returns the manifest name and
+# counters for the log.
+def backup(repo, app, source_root, excludes=None, timestamp=None):
+    with repo_lock(repo, exclusive=False):
+        return _backup(repo, app, source_root, excludes, timestamp)
+
+
+def _backup(repo, app, source_root, excludes, timestamp):
+    excludes = archiver.DEFAULT_EXCLUDES if excludes is None else excludes
+    timestamp = timestamp or time.strftime("%Y%m%d-%H%M%S")
+    index_path = os.path.join(repo, "index", f"{app}.json")
+    index = _read_json(index_path, {})
+    new_index = {}
+    entries = []
+    stats = {"files": 0, "bytes": 0, "reused_files": 0, "new_chunks": 0, "written_bytes": 0}
+
+    for abs_path, rel_path in archiver.walk(source_root, excludes):
+        info = os.lstat(abs_path)
+        entry = {"path": rel_path, "mode": stat.S_IMODE(info.st_mode), "mtime": info.st_mtime}
+        if stat.S_ISLNK(info.st_mode):
+            entry.update(type="symlink", target=os.readlink(abs_path))
+        elif stat.S_ISDIR(info.st_mode):
+            entry["type"] = "dir"
+        elif stat.S_ISREG(info.st_mode):
+            signature = {"size": info.st_size, "mtime_ns": info.st_mtime_ns,
+                         "ctime_ns": info.st_ctime_ns, "ino": info.st_ino}
+            known = index.get(rel_path)
+            if (known and all(known.get(key) == value for key, value in signature.items())
+                    and all(os.path.exists(_chunk_path(repo, digest)) for digest in known["chunks"])):
+                chunks = known["chunks"]
+                stats["reused_files"] += 1
+            else:
+                chunks = _store_file(repo, abs_path, stats)
+            new_index[rel_path] = dict(signature, chunks=chunks)
+            entry.update(type="file", size=info.st_size, chunks=chunks)
+            stats["files"] += 1
+            stats["bytes"] += info.st_size
+        else:
+            continue
+        entries.append(entry)
+
+    name = f"{app}-{timestamp}"
+    _write_json(os.path.join(repo, "manifests", f"{name}.json"), {
+        "app": app,
+        "created": timestamp,
+        "source": os.path.abspath(source_root),
+        "entries": entries,
+    })
+    _write_json(index_path, new_index)
+    return name, stats
+
+
+# Manifest names for an app (or every app), oldest first
+def list_backups(repo, app=None):
+    manifests_dir = os.path.join(repo, "manifests")
+    if not os.path.isdir(manifests_dir):
+        return []
+    names = [name[:-len(".json")] for name in os.listdir(manifests_dir) if name.endswith(".json")]
+    if app is not None:
+        # Names are <app>-<date>-<time>; a prefix match would also take
+        # 'shop-admin' backups for 'shop'
+        names = [name for name in names if name.rsplit("-", 2)[0] == app]
+    return sorted(names, key=lambda name: name.rsplit("-", 2)[-2:])
+
+
+def load_manifest(repo, name):
+    manifest = _read_json(os.path.join(repo, "manifests", f"{name}.json"))
+    if manifest is None:
+        raise FileNotFoundError(f"No backup named '{name}' in {repo}")
+    return manifest
+
+
+# Rebuild a backup into dest_dir
+def restore(repo, name, dest_dir):
+    manifest = load_manifest(repo, name)
+    os.makedirs(dest_dir, exist_ok=True)
+    dirs = []
+    for entry in manifest["entries"]:
+        target = os.path.join(dest_dir, entry["path"])
+        if entry["type"] == "dir":
+            os.makedirs(target, exist_ok=True)
+            dirs.append((target, entry))
+        elif entry["type"] == "symlink":
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.symlink(entry["target"], target)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as out_file:
+                for digest in entry["chunks"]:
+                    with open(_chunk_path(repo, digest), "rb") as chunk_file:
+                        out_file.write(zlib.decompress(chunk_file.read()))
+            os.chmod(target, entry["mode"])
+            os.utime(target, (entry["mtime"], entry["mtime"]))
+    # Directory modes and times last, after their contents are written
+    for target, entry in reversed(dirs):
+        os.chmod(target, entry["mode"])
+        os.utime(target, (entry["mtime"], entry["mtime"]))
+    return manifest
+
+
+# Keep the newest `keep` backups per app, then sweep unreferenced chunks
+def gc(repo, keep):
+    with repo_lock(repo, exclusive=True):
+        return _gc(repo, keep)
+
+
+def _gc(repo, keep):
+    removed_manifests = []
+    by_app = {}
+    for name in list_backups(repo):
+        by_app.setdefault(name.rsplit("-", 2)[0], []).append(name)
+    for names in by_app.values():
+        for name in names[:-keep] if keep > 0 else []:
+            os.remove(os.path.join(repo, "manifests", f"{name}.json"))
+            removed_manifests.append(name)
+
+    live = set()
+    for name in list_backups(repo):
+        for entry in load_manifest(repo, name)["entries"]:
+            live.update(entry.get("chunks", ()))
+
+    removed_chunks = 0
+    freed_bytes = 0
+    chunks_dir = os.path.join(repo, "chunks")
+    if os.path.isdir(chunks_dir):
+        for prefix in os.listdir(chunks_dir):
+            for digest in os.listdir(os.path.join(chunks_dir, prefix)):
+                # In-flight .tmp files belong to a running backup
+                if digest not in live and not digest.endswith(".tmp"):
+                    path = os.path.join(chunks_dir, prefix, digest)
+                    freed_bytes += os.path.getsize(path)
+                    os.remove(path)
+                    removed_chunks += 1
+    return {"manifests": removed_manifests, "chunks": removed_chunks, "freed_bytes": freed_bytes}
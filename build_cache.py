@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Next.js .next/cache preservation across deploys
+#
+# The outgoing release's .next/cache is copied into
+# BUILD_CACHE_DIR/<app>-<branch>-<lockfile key>, and copied from there
+# into the new checkout before `npm run build`. Copies (reflinks where
+# the filesystem has them), not moves: the live app keeps using its
+# .next/cache (image optimizer, ISR and fetch cache) while it serves,
+# and the store entry survives a failed build. The store is capped at
+# BUILD_CACHE_MAX_MB (least recently used scopes go first) and the last
+# BUILD_CACHE_STATS_KEEP builds are recorded in stats.jsonl so the
+# deploy log can show what the cache saves.
+# ----------------------------------------------------------------
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+import npm_cache
+import runner
+
+
+def cache_dir_for(config):
+    return config.get("BUILD_CACHE_DIR", os.path.join(config["DEPLOYMENT_ROOT"], ".build-cache"))
+
+
+def _looks_like_sha(ref):
+    return re.fullmatch(r"[0-9a-f]{7,40}", ref or "") is not None
+
+
+def branch_of(config, app_root):
+    result = runner.run(
+        ["git", "-C", app_root, "symbolic-ref", "--short", "-q", "HEAD"],
+        capture_output=True, text=True
+    )
+    if result.returncode == 0 and result.stdout.strip():
+        return result.stdout.strip()
+    ref = config.get("GIT_REF")
+    if ref and not _looks_like_sha(ref):
+        return ref
+    return "default"
+
+
+# Cache scope for an app folder, or None if it has no lockfile
+def scope_for(config, app_root):
+    key = npm_cache.store_key(app_root, npm_cache.node_version())
+    if key is None:
+        return None
+    branch = re.sub(r"[^A-Za-z0-9._-]", "_", branch_of(config, app_root))
+    return f"{config['APP_NAME_PM2']}-{branch}-{key[:16]}"
+
+
+# Copy app_root/.next/cache from the outgoing release into the store
+def save(config, app_root):
+    source = os.path.join(app_root, ".next", "cache")
+    if not os.path.isdir(source):
+        return {"saved": False, "reason": "no .next/cache"}
+    scope = scope_for(config, app_root)
+    if scope is None:
+        return {"saved": False, "reason": "no package-lock.json"}
+
+    max_bytes = int(config.get("BUILD_CACHE_MAX_MB", "2048")) * 1024 * 1024
+    size = npm_cache.tree_size(source)
+    if size > max_bytes:
+        return {"saved": False, "reason": f"cache is {size // (1024 * 1024)} MB, over BUILD_CACHE_MAX_MB"}
+
+    store_dir = cache_dir_for(config)
+    entry = os.path.join(store_dir, scope)
+    # Built in a .tmp- folder, which evict() leaves alone, and renamed
+    # into place under the exclusive lock, so neither another app's
+    # eviction nor a concurrent save of this scope sees it half-written
+    staging = os.path.join(store_dir, f".tmp-{scope}-{os.getpid()}-{threading.get_ident()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        npm_cache.copy_tree(source, os.path.join(staging, "cache"))
+        npm_cache.write_meta(staging, {"size": size, "last_used": time.time()})
+
+        with npm_cache.store_lock(store_dir, exclusive=True):
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(staging, entry)
+            npm_cache.evict(store_dir, max_bytes, keep_key=scope)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return {"saved": True, "scope": scope, "size": size}
+
+
+# Copy a matching cache into the new checkout before the build. The
+# entry stays in the store, so a failed build doesn't lose it.
+def restore(config, app_root):
+    scope = scope_for(config, app_root)
+    if scope is None:
+        return {"hit": False, "scope": None, "size": 0}
+    store_dir = cache_dir_for(config)
+    entry = os.path.join(store_dir, scope)
+    cached = os.path.join(entry, "cache")
+    with npm_cache.store_lock(store_dir, exclusive=False):
+        meta = npm_cache.read_meta(entry)
+        if meta is None or not os.path.isdir(cached):
+            return {"hit": False, "scope": scope, "size": 0}
+
+        target = os.path.join(app_root, ".next", "cache")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.rmtree(target, ignore_errors=True)
+        npm_cache.copy_tree(cached, target)
+        meta["last_used"] = time.time()
+        npm_cache.write_meta(entry, meta)
+    return {"hit": True, "scope": scope, "size": meta.get("size", 0)}
+
+
+# Append this build to stats.jsonl (keeping the newest
+# BUILD_CACHE_STATS_KEEP records) and summarize hit vs miss build times
+def record_build(config, restored, build_seconds):
+    store_dir = cache_dir_for(config)
+    stats_path = os.path.join(store_dir, "stats.jsonl")
+    keep = int(config.get("BUILD_CACHE_STATS_KEEP", "500"))
+    line = json.dumps({
+        "time": time.time(),
+        "app": config["APP_NAME_PM2"],
+        "scope": restored["scope"],
+        "hit": restored["hit"],
+        "size": restored["size"],
+        "build_seconds": round(build_seconds, 2),
+    }) + "\n"
+    # Exclusive, so concurrent fleet deploys don't lose each other's
+    # records while the file is trimmed
+    with npm_cache.store_lock(store_dir, exclusive=True):
+        try:
+            with open(stats_path, "r") as stats_file:
+                lines = stats_file.readlines()
+        except FileNotFoundError:
+            lines = []
+        lines = (lines + [line])[-keep:] if keep > 0 else [line]
+        tmp_path = f"{stats_path}.tmp"
+        with open(tmp_path, "w") as stats_file:
+            stats_file.writelines(lines)
+        os.replace(tmp_path, stats_path)
+
+    hits, misses = [], []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record["app"] == config["APP_NAME_PM2"]:
+            (hits if record["hit"] else misses).append(record["build_seconds"])
+
+    summary = (
+        f"build cache {'hit' if restored['hit'] else 'miss'}"
+        f" ({restored['size'] / (1024 * 1024):.1f} MB restored), build took {build_seconds:.1f}s;"
+        f" {len(hits)} hits / {len(misses)} misses so far"
+    )
+    if hits and misses:
+        saved = sum(misses) / len(misses) - sum(hits) / len(hits)
+        summary += f", a cache hit saves about {saved:.1f}s per build"
+    return summary
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Certificate inventory and batched renewals
+#
+# Lists every certificate in CERT_LIVE_DIR with its expiry, SANs and the
+# nginx vhosts that use it, plus server names no certificate covers.
+# Then prints the certbot commands that would renew or issue what is
+# needed, in as few runs as possible. --renew runs them and reloads
+# nginx once at the end; each certbot run may take CERT_RENEW_TIMEOUT
+# seconds (no limit by default). Ctrl-C stops the running command.
+#
+#   python3 cert-inventory.py
+#   python3 cert-inventory.py --days 21 --renew
+# ----------------------------------------------------------------
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+from datetime import datetime
+
+import certs
+import deploy
+import events
+import runner
+
+parser = argparse.ArgumentParser(description="Scan certificates, show expiry and vhost usage, batch renewals.")
+parser.add_argument("--config", default="../conf/app.conf", help="app.conf with NGINX_ENABLED_DIR / CERT_* keys")
+parser.add_argument("--days", type=int, default=None, help="Renew certificates with fewer days left (CERT_RENEW_DAYS, default 30)")
+parser.add_argument("--renew", action="store_true", help="Run the certbot commands instead of only printing them")
+args = parser.parse_args()
+
+config = deploy.load_config(args.config)
+
+renew_days = args.days if args.days is not None else int(config.get("CERT_RENEW_DAYS", "30"))
+logs_dir = "../logs"
+timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+log_file = f"{logs_dir}/cert-inventory-{timestamp}.log"
+os.makedirs(logs_dir, exist_ok=True)
+with open(log_file, "w") as log:
+    log.write(f"Certificate inventory log - {timestamp}\n")
+
+event_log = events.for_log_file(log_file, app=config.get("APP_NAME_PM2"))
+log_message = event_log.message
+
+
+try:
+    inventory, uncovered = certs.inventory(config)
+except FileNotFoundError as e:
+    print(f"Error: {e.filename} not found.")
+    sys.exit(1)
+
+width = max([len("LINEAGE")] + [len(cert["lineage"]) for cert in inventory])
+log_message(f"{'LINEAGE':<{width}}  {'EXPIRES':<10}  {'DAYS':>6}  VHOSTS / SANS")
+for cert in sorted(inventory, key=lambda cert: (cert["days_left"] is None, cert["days_left"] or 0)):
+    if cert["error"]:
+        log_message(f"{cert['lineage']:<{width}}  {'?':<10}  {'?':>6}  unreadable: {cert['error']}")
+        continue
+    flag = " <- renew" if cert["days_left"] < renew_days else ""
+    log_message(
+        f"{cert['lineage']:<{width}}  {cert['not_after']:%Y-%m-%d}  {cert['days_left']:>6.1f}"
+        f"  {', '.join(cert['vhosts']) or '(no vhost)'}{flag}"
+    )
+    log_message(f"{'':<{width}}  {'':<10}  {'':>6}  {' '.join(cert['sans'])}")
+
+if uncovered:
+    log_message(f"\nServer names without a certificate: {' '.join(uncovered)}")
+
+plan = certs.renewal_plan(inventory, uncovered, renew_days, int(config.get("CERT_BATCH_SIZE", "100")))
+if not plan:
+    log_message(f"\nNothing to renew: every certificate has at least {renew_days} days left.")
+    sys.exit(0)
+
+log_message(f"\nRenewal plan ({len(plan)} certbot run(s)):")
+for command in plan:
+    log_message(f"  sudo {shlex.join(command)}")
+if not args.renew:
+    log_message("\nRun again with --renew to execute the plan.")
+    sys.exit(0)
+
+renew_timeout = float(config["CERT_RENEW_TIMEOUT"]) if config.get("CERT_RENEW_TIMEOUT") else None
+failed = 0
+runner.handle_interrupts()
+try:
+    # certbot's output is streamed into the log under the "renew" phase
+    with events.bind(event_log, "renew"), event_log.phase("renew"):
+        for command in plan:
+            log_message(f"\nRunning: {shlex.join(command)}")
+            try:
+                ok = runner.run(command, timeout=renew_timeout).returncode == 0
+            except (OSError, runner.ProcessTimedOut) as e:
+                log_message(str(e))
+                ok = False
+            if not ok:
+                failed += 1
+                log_message("certbot failed; continuing with the rest of the plan.")
+
+    with events.bind(event_log, "reload"), event_log.phase("reload"):
+        runner.run(["nginx", "-t"], check=True, capture_output=True, text=True)
+        runner.run(["systemctl", "reload", "nginx"], check=True)
+    log_message("nginx reloaded once after all renewals.")
+except KeyboardInterrupt:
+    log_message("\nRenewal interrupted; running commands were stopped and nginx was not reloaded.")
+    event_log.flush()
+    sys.exit(130)
+except (OSError, subprocess.SubprocessError) as e:
+    log_message(f"Error: nginx was not reloaded: {getattr(e, 'stderr', None) or e}")
+    event_log.flush()
+    sys.exit(1)
+event_log.flush()
+sys.exit(1 if failed else 0)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Certificate inventory for cert-inventory.py
+#
+# Every certificate under CERT_LIVE_DIR (default /etc/letsencrypt/live,
+# one folder per certbot lineage) is parsed with `openssl x509` on a
+# thread pool. Each one is matched with the nginx vhosts in
+# NGINX_ENABLED_DIR that point at it. Server names that no certificate
+# covers are reported too. The renewal plan is then as few certbot
+# invocations as possible:
+# - a single `certbot renew` for every lineage that is due (plus a
+#   forced renewal for any lineage CERT_RENEW_DAYS calls due but
+#   certbot's own 30-day window does not);
+# - new certificates for uncovered names, batched per parent domain up
+#   to CERT_BATCH_SIZE names each.
+# ----------------------------------------------------------------
+
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import runner
+
+CERT_FILES = ("fullchain.pem", "cert.pem")
+
+
+def live_dir_for(config):
+    return config.get("CERT_LIVE_DIR", "/etc/letsencrypt/live")
+
+
+# Parse one PEM certificate. Returns {"path", "subject", "not_after",
+# "sans"}; raises CalledProcessError for files openssl can't read.
+def read_cert(path):
+    result = runner.run(
+        ["openssl", "x509", "-in", path, "-noout", "-subject", "-enddate", "-ext", "subjectAltName"],
+        check=True, capture_output=True, text=True
+    )
+    subject = ""
+    not_after = None
+    sans = []
+    for line in result.stdout.splitlines():
+        line = line.strip()
+        if line.startswith("subject="):
+            match = re.search(r"CN\s*=\s*([^,/]+)", line)
+            subject = match.group(1).strip() if match else line[len("subject="):]
+        elif line.startswith("notAfter="):
+            not_after = datetime.strptime(line[len("notAfter="):], "%b %d %H:%M:%S %Y %Z").replace(tzinfo=timezone.utc)
+        elif line.startswith("DNS:"):
+            sans += [name.strip()[len("DNS:"):] for name in line.split(",") if name.strip().startswith("DNS:")]
+    return {"path": path, "subject": subject, "not_after": not_after, "sans": sans or [subject]}
+
+
+# One certificate per lineage folder, parsed in parallel
+def scan(live_dir, workers=8):
+    paths = {}
+    for lineage in sorted(os.listdir(live_dir)):
+        for name in CERT_FILES:
+            candidate = os.path.join(live_dir, lineage, name)
+            if os.path.isfile(candidate):
+                paths[lineage] = candidate
+                break
+
+    def parse(item):
+        lineage, path = item
+        try:
+            cert = read_cert(path)
+            cert["error"] = None
+        except subprocess.CalledProcessError as e:
+            cert = {"path": path, "subject": "", "not_after": None, "sans": [], "error": " ".join(e.stderr.split()) or str(e)}
+        cert["lineage"] = lineage
+        return cert
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(parse, paths.items()))
+
+
+# server_name and ssl_certificate directives of every enabled site
+def vhosts(enabled_dir):
+    sites = []
+    for name in sorted(os.listdir(enabled_dir)):
+        path = os.path.join(enabled_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "r", errors="replace") as site_file:
+            text = re.sub(r"#[^\n]*", "", site_file.read())
+        server_names = []
+        for match in re.finditer(r"\bserver_name\s+([^;]+);", text):
+            server_names += [host for host in match.group(1).split() if host != "_"]
+        certificates = [match.group(1).strip("\"'") for match in re.finditer(r"\bssl_certificate\s+([^;\s]+)\s*;", text)]
+        sites.append({"file": name, "server_names": list(dict.fromkeys(server_names)), "certificates": certificates})
+    return sites
+
+
+def covers(sans, host):
+    for san in sans:
+        if san == host:
+            return True
+        if san.startswith("*.") and host.count(".") == san.count(".") and host.endswith(san[1:]):
+            return True
+    return False
+
+
+# Sites point at live/<lineage>/fullchain.pem (a symlink into archive/),
+# so certificates are matched by the folder they sit in
+def _lineage_of(path):
+    return os.path.realpath(os.path.dirname(path))
+
+
+# Certificates with days left and the vhosts using them, plus the server
+# names no certificate covers
+def inventory(config, now=None):
+    now = now or datetime.now(timezone.utc)
+    certs = scan(live_dir_for(config), int(config.get("CERT_SCAN_WORKERS", "8")))
+    sites = vhosts(config["NGINX_ENABLED_DIR"])
+
+    for cert in certs:
+        lineage_dir = _lineage_of(cert["path"])
+        cert["days_left"] = None if cert["not_after"] is None else (cert["not_after"] - now).total_seconds() / 86400
+        cert["vhosts"] = [
+            site["file"] for site in sites
+            if any(_lineage_of(path) == lineage_dir for path in site["certificates"])
+        ]
+
+    uncovered = []
+    for site in sites:
+        for host in site["server_names"]:
+            if not any(covers(cert["sans"], host) for cert in certs if cert["error"] is None):
+                uncovered.append(host)
+    return certs, list(dict.fromkeys(uncovered))
+
+
+def parent_domain(host):
+    return ".".join(host.split(".")[-2:])
+
+
+# The fewest certbot invocations that renew every due lineage and cover
+# every uncovered name
+def renewal_plan(certs, uncovered, renew_days=30, batch_size=100):
+    commands = []
+    due = [cert for cert in certs if cert["days_left"] is not None and cert["days_left"] < renew_days]
+    if due:
+        # certbot renews every lineage inside its own window in one run;
+        # lineages due by our threshold but not certbot's are forced
+        commands.append(["certbot", "renew", "--no-random-sleep-on-renew"])
+        early = [cert["lineage"] for cert in due if cert["days_left"] >= 30]
+        for lineage in early:
+            commands.append(["certbot", "renew", "--cert-name", lineage, "--force-renewal"])
+
+    groups = {}
+    for host in uncovered:
+        groups.setdefault(parent_domain(host), []).append(host)
+    for hosts in groups.values():
+        for start in range(0, len(hosts), batch_size):
+            batch = hosts[start:start + batch_size]
+            command = ["certbot", "--nginx", "--cert-name", batch[0]]
+            for host in batch:
+                command += ["-d", host]
+            commands.append(command)
+    return commands
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Summarize and compare runs from the .jsonl event logs
+#
+#   python3 deploy-stats.py                      list recorded runs
+#   python3 deploy-stats.py next-deploy-20250101-120000
+#   python3 deploy-stats.py OLD NEW --threshold 20
+#
+# A run is named by its log file without the extension (or given as a
+# path to the .jsonl). One run prints its phases and the subprocesses
+# behind them, with CPU time and peak RSS. Two runs print phase
+# durations side by side and exit 1 if any phase got slower by more
+# than --threshold percent (and at least --min-seconds).
+# ----------------------------------------------------------------
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+parser = argparse.ArgumentParser(description="Summarize or compare deploy runs from their event logs.")
+parser.add_argument("runs", nargs="*", help="Run names or .jsonl paths; none lists runs, two compares them")
+parser.add_argument("--logs", default="../logs", help="Folder holding the .jsonl event logs")
+parser.add_argument("--app", help="Only list runs of this app")
+parser.add_argument("--threshold", type=float, default=20.0, help="Regression threshold in percent")
+parser.add_argument("--min-seconds", type=float, default=1.0, help="Ignore slowdowns smaller than this")
+args = parser.parse_args()
+
+
+def load(run):
+    path = run if run.endswith(".jsonl") else os.path.join(args.logs, f"{run}.jsonl")
+    if not os.path.exists(path):
+        print(f"Error: no event log at {path}")
+        sys.exit(1)
+    records = []
+    with open(path, "r") as events_file:
+        for line in events_file:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return os.path.basename(path)[:-len(".jsonl")], records
+
+
+# Phase durations; a resumed run appends to a new file, so each phase
+# appears once per file and the last record wins
+def phases_of(records):
+    return {record["phase"]: record for record in records if record["type"] == "phase"}
+
+
+def list_runs():
+    rows = []
+    for path in sorted(glob.glob(os.path.join(args.logs, "*.jsonl"))):
+        name, records = load(path)
+        apps = {record.get("app") for record in records if record.get("app")}
+        if args.app and args.app not in apps:
+            continue
+        summary = next((record for record in records if record["type"] == "run"), None)
+        phases = phases_of(records)
+        duration = summary["duration"] if summary else sum(phase["duration"] for phase in phases.values())
+        status = summary["status"] if summary else ("failed" if any(p["status"] == "failed" for p in phases.values()) else "-")
+        rows.append((name, ",".join(sorted(apps)) or "-", status, duration))
+    if not rows:
+        print(f"No event logs in {args.logs}.")
+        return
+    width = max(len(row[0]) for row in rows)
+    print(f"{'RUN':<{width}}  {'APP':<16}  {'STATUS':<7}  {'SECONDS':>8}")
+    for name, app, status, duration in rows:
+        print(f"{name:<{width}}  {app:<16}  {status:<7}  {duration:>8.1f}")
+
+
+def summarize(run):
+    name, records = load(run)
+    phases = phases_of(records)
+    processes = [record for record in records if record["type"] == "process"]
+    origin = min([phase["start"] for phase in phases.values()] or [0])
+
+    print(f"Run {name}\n")
+    width = max([len("PHASE")] + [len(phase) for phase in phases])
+    print(f"{'PHASE':<{width}}  {'STATUS':<7}  {'START':>7}  {'SECONDS':>8}")
+    for phase in sorted(phases.values(), key=lambda phase: phase["start"]):
+        print(f"{phase['phase']:<{width}}  {phase['status']:<7}  {phase['start'] - origin:>7.1f}  {phase['duration']:>8.1f}")
+
+    if processes:
+        print(f"\n{'PHASE':<{width}}  {'EXIT':>4}  {'SECONDS':>8}  {'CPU USER':>8}  {'CPU SYS':>8}  {'PEAK RSS':>9}  COMMAND")
+        for process in sorted(processes, key=lambda process: -process["duration"]):
+            print(
+                f"{(process.get('phase') or '-'):<{width}}  {process['exit_code']:>4}  {process['duration']:>8.1f}"
+                f"  {process['cpu_user']:>8.1f}  {process['cpu_sys']:>8.1f}  {process['max_rss_kb'] / 1024:>7.0f}MB"
+                f"  {process['cmd'][:60]}"
+            )
+
+
+def compare(old_run, new_run):
+    old_name, old_records = load(old_run)
+    new_name, new_records = load(new_run)
+    old_phases = phases_of(old_records)
+    new_phases = phases_of(new_records)
+    names = list(dict.fromkeys(list(old_phases) + list(new_phases)))
+
+    width = max([len("PHASE")] + [len(name) for name in names])
+    print(f"{old_name} -> {new_name}\n")
+    print(f"{'PHASE':<{width}}  {'OLD':>8}  {'NEW':>8}  {'DELTA':>8}  {'CHANGE':>7}")
+    regressions = []
+    for name in names:
+        old = old_phases.get(name, {}).get("duration")
+        new = new_phases.get(name, {}).get("duration")
+        if old is None or new is None:
+            print(f"{name:<{width}}  {old if old is not None else '-':>8}  {new if new is not None else '-':>8}")
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ""
+        if change > args.threshold and new - old >= args.min_seconds:
+            flag = "  <- slower"
+            regressions.append(name)
+        print(f"{name:<{width}}  {old:>8.1f}  {new:>8.1f}  {new - old:>+8.1f}  {change:>+6.0f}%{flag}")
+
+    if regressions:
+        print(f"\nRegressions over {args.threshold:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if not args.runs:
+    list_runs()
+elif len(args.runs) == 1:
+    summarize(args.runs[0])
+elif len(args.runs) == 2:
+    compare(*args.runs)
+else:
+    print("Give no run to list, one to summarize, or two to compare.")
+    sys.exit(2)
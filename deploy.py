@@ -1,277 +1,675 @@
 #!/usr/bin/env python3
 
+# ----------------------------------------------------------------
+# Next.js deploy: Parts 1-6 as a step graph
+#
+#   python3 deploy.py            ask every question up front, then run
+#   python3 deploy.py --yes      unattended (or DEPLOY_ASSUME_YES="yes")
+#   python3 deploy.py --resume   continue the last failed deploy
+#
+# Independent steps run at the same time. For example, the old tree is
+# backed up while the new one is cloned and installed. Every step's
+# wall-clock time is written to the deploy log.
+# ----------------------------------------------------------------
+
+import argparse
+import json
 import os
 from datetime import datetime
+import shutil
 import subprocess
 import sys
+import time
+
+import archiver
+import artifacts
+import backup_store
+import build_cache
+import events
+import git_cache
+import instances
+import npm_cache
+import pipeline
+import planner
+import pm2
+import preflight
+import probe
+import releases
+import runner
+import standalone
+import warmup
 
 # Define paths
 config_path = "../conf/app.conf"
 logs_dir = "../logs"
-timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-log_file = f"{logs_dir}/next-deploy-{timestamp}.log"
-
-# ----------------------------------------------------------------
-# Part 1: Configuration and .env.local check
-# ----------------------------------------------------------------
-
-ready = input("Do you have your .env.local ready? (y/n): ")
-if ready.lower() != "y":
-    print("Please prepare your .env.local file before deployment.")
-    sys.exit(0)
-
-config = {}
-with open(config_path, "r") as conf_file:
-    for line in conf_file:
-        line = line.strip()
-        if line and not line.startswith("#"):
-            try:
-                key, value = line.split("=", 1)
-                config[key.strip()] = value.strip().strip('"')
-            except ValueError:
-                print(f"Invalid line in config file: {line}")
-                sys.exit(1)
-
-config["TIMESTAMP"] = timestamp
-config["APP_ROOT"] = os.path.join(config["DEPLOYMENT_ROOT"], config["APP_NAME_PM2"], config["APP_NAME_GITHUB"])
-
-print("\nLoaded Configuration:")
-max_label_length = max(len(key) for key in config.keys())
-for key, value in config.items():
-    print(f"{key.upper():<{max_label_length}}: {value}")
-
-verify = input("\nIs this configuration correct? (y/n): ")
-if verify.lower() != "y":
-    print("Please update your configuration in app.conf.")
-    sys.exit(0)
-
-os.makedirs(logs_dir, exist_ok=True)
-with open(log_file, "w") as log:
-    log.write(f"Deployment log - {timestamp}\n")
-    log.write("Configuration Loaded:\n")
-    for key, value in config.items():
-        log.write(f"{key}: {value}\n")
-    log.write("Deployment process initialized.\n")
+env_path = "../.env.local"
 
-print(f"\nConfiguration logged to: {log_file}")
-print("Script completed Part 1 successfully.")
 
-# ----------------------------------------------------------------
-# Part 2: Shutting down if a previous app is running
-# ----------------------------------------------------------------
-shutdown_confirm = input("\nA previous instance of the app may be running. Proceed with shutdown and removal? (y/n): ")
-if shutdown_confirm.lower() != "y":
-    print("Shutdown and removal process skipped by user.")
-else:
-    try:
-        # Check if the PM2 process is running
-        check_process = subprocess.run(["pm2", "list"], capture_output=True, text=True)
-        if config["APP_NAME_PM2"] in check_process.stdout:
-            print(f"PM2 process '{config['APP_NAME_PM2']}' is currently running. Stopping and removing it.")
-            
-            # Stop the process if found
-            stop_process = subprocess.run(["pm2", "stop", config["APP_NAME_PM2"]], capture_output=True, text=True)
-            if stop_process.returncode == 0:
-                print(f"PM2 process '{config['APP_NAME_PM2']}' stopped successfully.")
+def load_config(path):
+    config = {}
+    with open(path, "r") as conf_file:
+        for line in conf_file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                try:
+                    key, value = line.split("=", 1)
+                    config[key.strip()] = value.strip().strip('"')
+                except ValueError:
+                    print(f"Invalid line in config file: {line}")
+                    sys.exit(1)
+    return config
+
+
+# Where a failed run records its progress for --resume
+def state_file_for(config):
+    return os.path.join(logs_dir, f"deploy-state-{config['APP_NAME_PM2']}.json")
+
+
+class Deployment:
+    # echo=False keeps step messages out of the console (fleet mode
+    # deploys many apps at once); they still go to the log file
+    def __init__(self, config, log_file, echo=True):
+        self.config = config
+        self.log_file = log_file
+        self.echo = echo
+        self.events = events.for_log_file(log_file, app=config["APP_NAME_PM2"], echo=echo)
+        self.env_path = config.get("ENV_FILE", env_path)
+
+        config["APP_ROOT"] = os.path.join(config["DEPLOYMENT_ROOT"], config["APP_NAME_PM2"], config["APP_NAME_GITHUB"])
+
+        # DEPLOY_MODE=release builds into a fresh release folder while the
+        # live process keeps serving, then switches traffic over in start()
+        self.release_mode = config.get("DEPLOY_MODE", "inplace") == "release"
+        self.live_root = config["APP_ROOT"]
+        self.release_state = None
+        if self.release_mode:
+            self.release_state = releases.load_state(config)
+            self.live_root = self.release_state["release"] or config["APP_ROOT"]
+            config["APP_ROOT"] = releases.new_release_root(config)
+
+        # In place, the new tree is cloned and installed next to the live
+        # one and only swapped in once the old process is stopped
+        self.incoming_root = config["APP_ROOT"] if self.release_mode else f"{config['APP_ROOT']}.incoming"
+        self.build_cache_enabled = config.get("BUILD_CACHE", "off") == "keep"
+
+        # ARTIFACTS: unpack a build another host published for this
+        # commit instead of clone + install + build, and/or publish ours
+        self.artifact_mode = artifacts.mode_of(config)
+        self.artifact = None
+        self.commit_sha = None
+        # PLAN=incremental: skip install / build when the diff allows it
+        self.change_plan = None
+
+    def log(self, message):
+        self.events.message(message)
+
+    def fail(self, message):
+        self.log(message)
+        raise pipeline.StepFailed(message)
+
+    # ----------------------------------------------------------------
+    # Part 2: Shutting down if a previous app is running
+    # ----------------------------------------------------------------
+    def shutdown(self):
+        config = self.config
+        if self.release_mode:
+            # The old process is only retired in start(), after the new one is healthy
+            self.log("Release mode: the running instance keeps serving until the new release is healthy.")
+            return
+
+        name = config["APP_NAME_PM2"]
+        try:
+            # One `pm2 jlist` and an exact name match, so 'shop' never
+            # matches 'shop-admin'
+            if not pm2.exists(name):
+                self.log(f"PM2 process '{name}' not found in the PM2 list; skipping stop and removal.")
+                return
+            print(f"PM2 process '{name}' is currently running. Stopping and removing it.")
+
+            if pm2.stop([name]):
+                print(f"PM2 process '{name}' stopped successfully.")
             else:
-                print(f"Warning: PM2 process '{config['APP_NAME_PM2']}' not running or already stopped.")
-            
-            # Delete the process
-            delete_process = subprocess.run(["pm2", "delete", config["APP_NAME_PM2"]], capture_output=True, text=True)
-            if delete_process.returncode == 0:
-                print(f"PM2 process '{config['APP_NAME_PM2']}' removed successfully.")
+                print(f"Warning: PM2 process '{name}' not running or already stopped.")
+            if pm2.delete([name]):
+                print(f"PM2 process '{name}' removed successfully.")
             else:
-                print(f"Warning: PM2 process '{config['APP_NAME_PM2']}' could not be found or was already removed.")
-            
-            with open(log_file, "a") as log:
-                log.write(f"PM2 process '{config['APP_NAME_PM2']}' stopped and removed successfully if running.\n")
+                print(f"Warning: PM2 process '{name}' could not be found or was already removed.")
 
-        else:
-            print(f"PM2 process '{config['APP_NAME_PM2']}' not found in the PM2 list; skipping stop and removal.")
-            with open(log_file, "a") as log:
-                log.write(f"PM2 process '{config['APP_NAME_PM2']}' not found; no action taken.\n")
-
-    except subprocess.CalledProcessError as e:
-        error_message = f"Error during PM2 shutdown process: {e}"
-        with open(log_file, "a") as log:
-            log.write(f"{error_message}\n")
-        print(error_message)
-        sys.exit(1)
+            self.log(f"PM2 process '{name}' stopped and removed successfully if running.")
 
-# ----------------------------------------------------------------
-# Part 3: Backing up the previously deployed code
-# ----------------------------------------------------------------
+        except (subprocess.SubprocessError, ValueError) as e:
+            self.fail(f"Error during PM2 shutdown process: {e}")
+
+    # ----------------------------------------------------------------
+    # Part 3: Backing up the previously deployed code
+    # ----------------------------------------------------------------
+    def backup(self):
+        config = self.config
+        # Check if the application folder exists to back up
+        if not os.path.exists(self.live_root):
+            self.log("No application folder found for backup; skipping backup.")
+            return
 
-# Confirm before proceeding with the backup
-backup_confirm = input("\nProceed with creating a backup of the existing deployment? (y/n): ")
-if backup_confirm.lower() != "y":
-    print("Backup process skipped by user.")
-else:
-    # Check if the application folder exists to back up
-    if os.path.exists(config["APP_ROOT"]):
         # Define backup file name with timestamp
-        backup_filename = f"BK-{config['APP_NAME_GITHUB']}-{config['TIMESTAMP']}.tar.gz"
+        backup_options = archiver.codec_options(config)
+        backup_filename = f"BK-{config['APP_NAME_GITHUB']}-{config['TIMESTAMP']}{archiver.extension_for(backup_options['codec'])}"
         backup_filepath = os.path.join(config["BACKUP_DIR"], backup_filename)
-        staging_dir = os.path.join(config["DEPLOYMENT_ROOT"], "backup_staging")
 
         try:
-            # Create a staging directory for the backup
-            if not os.path.exists(staging_dir):
-                os.makedirs(staging_dir)
-
-            # Copy the app folder to the staging area without node_modules
-            print("Copying application to staging directory without node_modules...")
-            subprocess.run(["rsync", "-a", "--exclude=node_modules", config["APP_ROOT"] + "/", staging_dir], check=True)
-
-            # Create the compressed backup from the staging directory
-            print("Creating backup file...")
-            subprocess.run(["tar", "-czf", backup_filepath, "-C", config["DEPLOYMENT_ROOT"], "backup_staging"], check=True)
-
-            # Remove the staging directory after backup
-            subprocess.run(["rm", "-rf", staging_dir], check=True)
-
-            # Log and print confirmation of backup completion
-            with open(log_file, "a") as log:
-                log.write(f"Backup created successfully: {backup_filepath}\n")
-            print(f"Backup created successfully: {backup_filepath}")
-
-            # Display contents of backup directory for verification
-            print("Current backup files in the backup directory:")
-            subprocess.run(["ls", "-ltr", config["BACKUP_DIR"]])
-
-        except subprocess.CalledProcessError as e:
-            error_message = f"Error during backup: {e}"
-            with open(log_file, "a") as log:
-                log.write(f"{error_message}\n")
-            print(error_message)
-            sys.exit(1)
-
-    else:
-        print(f"No application folder found for backup; skipping backup.")
-        with open(log_file, "a") as log:
-            log.write("No application folder found for backup; skipping backup.\n")
+            if config.get("BACKUP_MODE", "archive") == "repository":
+                # Only new content is chunked and stored; unchanged files
+                # are referenced from the previous backup's index
+                backup_repo = backup_store.repo_dir_for(config)
+                print(f"Adding backup to repository {backup_repo}...")
+                backup_name, backup_stats = backup_store.backup(
+                    backup_repo, config["APP_NAME_GITHUB"], self.live_root, archiver.excludes_for(config, self.live_root), config["TIMESTAMP"]
+                )
+                gc_stats = backup_store.gc(backup_repo, int(config.get("BACKUP_KEEP", "10")))
+                self.log(
+                    f"Backup created successfully: {backup_name} in {backup_repo} "
+                    f"({backup_stats['files']} files, {backup_stats['reused_files']} unchanged, "
+                    f"{backup_stats['new_chunks']} new chunks, {backup_stats['written_bytes'] / (1024 * 1024):.1f} MB written; "
+                    f"gc removed {len(gc_stats['manifests'])} old backups and {gc_stats['chunks']} chunks)"
+                )
+            else:
+                # Stream the app folder straight into the archive in one pass,
+                # skipping node_modules, .next/cache and .git
+                print(f"Creating backup file ({backup_options['codec']})...")
+                backup_stats = archiver.create_archive(
+                    self.live_root, backup_filepath, archiver.excludes_for(config, self.live_root), config["APP_NAME_GITHUB"],
+                    **backup_options
+                )
+                self.log(
+                    f"Backup created successfully: {backup_filepath} "
+                    f"({backup_stats['files']} files, {backup_stats['bytes'] / (1024 * 1024):.1f} MB "
+                    f"-> {backup_stats['archive_bytes'] / (1024 * 1024):.1f} MB)"
+                )
+
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            self.fail(f"Error during backup: {e}")
+
+    # Keep the outgoing release's .next/cache before its folder is replaced
+    def save_build_cache(self):
+        if not self.build_cache_enabled or not os.path.isdir(self.live_root):
+            return
+        saved_cache = build_cache.save(self.config, self.live_root)
+        if saved_cache["saved"]:
+            self.log(
+                f"Saved .next/cache from {self.live_root} "
+                f"({saved_cache['size'] / (1024 * 1024):.1f} MB, scope {saved_cache['scope']})."
+            )
+        else:
+            self.log(f"Build cache not saved: {saved_cache['reason']}.")
+
+    # ----------------------------------------------------------------
+    # Part 4: Clone Repository
+    # ----------------------------------------------------------------
+    def clone(self):
+        config = self.config
+        if self.artifact:
+            self.log(f"Clone skipped: unpacked artifact {self.artifact['key']}.")
+            return
+        if os.path.exists(self.incoming_root):
+            # Left over from an interrupted run; it was never live
+            print(f"Removing unfinished checkout at {self.incoming_root}.")
+            shutil.rmtree(self.incoming_root)
+
+        print(f"Cloning repository from {config['REPO_URL']} into {self.incoming_root} (GIT_CHECKOUT={config.get('GIT_CHECKOUT', 'clone')}).")
+        clone_started = time.monotonic()
+        try:
+            self.commit_sha = git_cache.checkout(config, self.incoming_root)
+            self.log(f"Repository cloned successfully at {self.commit_sha} in {time.monotonic() - clone_started:.1f}s.")
+        except (subprocess.SubprocessError, ValueError) as e:
+            self.fail(f"Error cloning repository: {e}")
+
+    # ----------------------------------------------------------------
+    # Part 5: npm install, .env.local copy and npm build
+    # ----------------------------------------------------------------
+    def install(self):
+        config = self.config
+        if self.artifact:
+            self.log("npm install skipped: node_modules came with the artifact.")
+            return
+        if self.change_plan and not self.change_plan["install"]:
+            self.log("npm install skipped: package-lock.json unchanged, live node_modules reused.")
+            return
+        try:
+            install_started = time.monotonic()
+            if config.get("NPM_INSTALL", "install") == "store":
+                # Reuse node_modules from the lockfile-keyed store when possible
+                store_result = npm_cache.install(config, self.incoming_root)
+                install_detail = f"node_modules store {store_result['result']}"
+                if store_result.get("evicted"):
+                    install_detail += f", evicted {len(store_result['evicted'])} old entries"
+            else:
+                runner.run(["npm", "install"], cwd=self.incoming_root, check=True)
+                install_detail = "npm install"
+            self.log(f"npm install completed successfully ({install_detail}) in {time.monotonic() - install_started:.1f}s.")
+        except subprocess.SubprocessError as e:
+            self.fail(f"Error during npm install: {e}")
+
+    # In place only: replace the old app folder with the new checkout
+    def swap(self):
+        config = self.config
+        try:
+            if os.path.exists(config["APP_ROOT"]):
+                print(f"Removing existing directory at {config['APP_ROOT']}.")
+                shutil.rmtree(config["APP_ROOT"])
+            os.rename(self.incoming_root, config["APP_ROOT"])
+            if config.get("GIT_CHECKOUT") == "worktree" and os.path.exists(os.path.join(config["APP_ROOT"], ".git")):
+                # The mirror records the worktree's path; point it at the new one
+                runner.run(["git", "-C", config["APP_ROOT"], "worktree", "repair"], check=True, capture_output=True)
+            self.log(f"New checkout moved into {config['APP_ROOT']}.")
+        except (OSError, subprocess.SubprocessError) as e:
+            self.fail(f"Error moving new checkout into place: {e}")
+
+    def copy_env(self):
+        config = self.config
+        if not os.path.exists(self.env_path):
+            self.fail(f".env.local file not found at {self.env_path}.")
+        try:
+            shutil.copyfile(self.env_path, os.path.join(self.incoming_root, ".env.local"))
+            self.log(".env.local copied to app root.")
+        except OSError as e:
+            self.fail(f"Error copying .env.local: {e}")
+
+    def build(self):
+        config = self.config
+        if self.artifact:
+            self.log(f"npm build skipped: artifact built on {self.artifact['host']} at {self.artifact['commit'][:12]}.")
+            return
+        if self.change_plan and not self.change_plan["build"]:
+            self.log("npm build skipped: no build inputs changed, live .next reused.")
+            return
+        try:
+            restored_cache = build_cache.restore(config, self.incoming_root) if self.build_cache_enabled else None
+            build_started = time.monotonic()
+            runner.run(["npm", "run", "build"], cwd=self.incoming_root, check=True)
+            build_seconds = time.monotonic() - build_started
+            self.log(f"npm build completed successfully in {build_seconds:.1f}s.")
+            if restored_cache is not None:
+                self.log(build_cache.record_build(config, restored_cache, build_seconds))
+        except subprocess.SubprocessError as e:
+            self.fail(f"Error during npm build: {e}")
+
+        if standalone.enabled(config):
+            # Keep only the standalone server: no sources, no dev dependencies
+            try:
+                sizes = standalone.assemble(self.incoming_root)
+                self.log(
+                    f"Standalone server assembled in {self.incoming_root} "
+                    f"({sizes['before'] / (1024 * 1024):.1f} MB checkout -> {sizes['after'] / (1024 * 1024):.1f} MB)."
+                )
+            except (OSError, standalone.StandaloneError) as e:
+                self.fail(f"Error assembling standalone server: {e}")
+            if config.get("GIT_CHECKOUT") == "worktree":
+                try:
+                    git_cache.prune_worktrees(config)
+                except subprocess.SubprocessError as e:
+                    self.log(f"Warning: could not prune the deleted worktree from the git mirror: {e}")
+
+    # ----------------------------------------------------------------
+    # Part 4b: Incremental plan (PLAN=incremental). Runs while the live
+    # tree is still there, so what it reuses can be linked over.
+    # ----------------------------------------------------------------
+    def plan(self):
+        config = self.config
+        if self.artifact:
+            self.log("Plan not needed: the release was unpacked from an artifact.")
+            return
+        try:
+            commit_sha = self.commit_sha or self.head_commit()
+            self.change_plan = planner.plan(
+                config, self.incoming_root, commit_sha, self.live_root, self.env_path, npm_cache.node_version()
+            )
+            self.log(planner.report(self.change_plan))
+            reused = planner.reuse(self.change_plan, self.live_root, self.incoming_root)
+            if reused:
+                self.log(f"Reused from the live tree: {', '.join(reused)}.")
+        except (OSError, subprocess.SubprocessError) as e:
+            # Whatever was linked is rebuilt by a full install and build
+            self.change_plan = None
+            self.log(f"Warning: incremental plan failed ({e}); doing a full deploy.")
+
+    # On --resume self.commit_sha is unset; a standalone tree has no .git
+    # left, so the SHA checkout() wrote next to it comes first
+    def head_commit(self):
+        app_root = self.incoming_root if os.path.exists(self.incoming_root) else self.config["APP_ROOT"]
+        return git_cache.read_commit(app_root) or runner.run(
+            ["git", "-C", app_root, "rev-parse", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+
+    # ----------------------------------------------------------------
+    # Part 5b: Build artifacts (ARTIFACTS=fetch/auto/publish)
+    # ----------------------------------------------------------------
+    def fetch_artifact(self):
+        config = self.config
+        fetch_started = time.monotonic()
+        try:
+            store = artifacts.store_for(config)
+            commit_sha = git_cache.remote_sha(config)
+            manifest = artifacts.find(config, store, commit_sha, npm_cache.node_version())
+            if manifest is None:
+                self.log(f"No artifact for {commit_sha[:12]} in {config['ARTIFACT_STORE']}; building here.")
+                return
+            if os.path.exists(self.incoming_root):
+                shutil.rmtree(self.incoming_root)
+            self.artifact = artifacts.fetch(config, store, manifest, self.incoming_root)
+            self.commit_sha = commit_sha
+            self.log(
+                f"Artifact {manifest['key']} fetched and verified ({manifest['archive_bytes'] / (1024 * 1024):.1f} MB,"
+                f" {manifest['files']} files) in {time.monotonic() - fetch_started:.1f}s; skipping clone, install and build."
+            )
+        except (OSError, ValueError, KeyError, artifacts.ArtifactError, subprocess.SubprocessError) as e:
+            # A bad or unreachable artifact only costs the build it would have saved
+            self.log(f"Warning: artifact not used ({e}); building here.")
+
+    def publish_artifact(self):
+        config = self.config
+        if self.artifact:
+            self.log("Artifact not published: this release was unpacked from one.")
+            return
+        publish_started = time.monotonic()
+        try:
+            commit_sha = self.commit_sha or self.head_commit()
+            manifest = artifacts.publish(config, artifacts.store_for(config), config["APP_ROOT"], commit_sha)
+            self.log(
+                f"Artifact {manifest['key']} published to {config['ARTIFACT_STORE']} "
+                f"({manifest['archive_bytes'] / (1024 * 1024):.1f} MB) in {time.monotonic() - publish_started:.1f}s"
+                + (f"; pruned {len(manifest['pruned'])} old artifacts." if manifest["pruned"] else ".")
+            )
+        except (OSError, ValueError, artifacts.ArtifactError, subprocess.SubprocessError) as e:
+            self.fail(f"Error publishing build artifact: {e}")
+
+    # ----------------------------------------------------------------
+    # Part 6: Starting the app as a pm2 process
+    # ----------------------------------------------------------------
+    def start(self):
+        config = self.config
+        if self.release_mode:
+            # Blue/green: the old release keeps serving unless the new one
+            # is healthy and nginx accepted the switch
+            try:
+                new_state = releases.activate(config, self.release_state, config["APP_ROOT"], self.log)
+                self.log(f"Release {new_state['release']} live as '{new_state['pm2_name']}' on port {new_state['port']}.")
+                print("Release switched over with no downtime.")
+            except (releases.ReleaseError, subprocess.SubprocessError) as e:
+                self.fail(f"Error during release switch-over: {e}")
+            self.record_deployed()
+            return
 
-# ----------------------------------------------------------------
-# Part 4: Clone Repository
-# ----------------------------------------------------------------
-clone_confirm = input("\nReady to clone the repository? (y/n): ")
-if clone_confirm.lower() != "y":
-    print("Repository cloning aborted by the user.")
-    sys.exit(0)
-
-if os.path.exists(config["APP_ROOT"]):
-    overwrite_confirm = input(f"Directory {config['APP_ROOT']} already exists. Delete and re-clone? (y/n): ")
-    if overwrite_confirm.lower() == "y":
-        print(f"Removing existing directory at {config['APP_ROOT']}.")
-        subprocess.run(["rm", "-rf", config["APP_ROOT"]], check=True)
-    else:
-        print("Cloning skipped because directory exists and user opted not to delete.")
+        try:
+            # Start the app with PM2 (one process, a cluster, or one per port)
+            ports = instances.start(config, config["APP_NAME_PM2"], config["PORT"], config["APP_ROOT"])
+            self.log(f"PM2 start executed successfully ({instances.mode_of(config)} mode, port(s) {', '.join(ports)}).")
+        except subprocess.SubprocessError as e:
+            self.fail(f"Error during PM2 deployment process: {e}")
+        self.record_deployed()
+
+    # What is live now, for the next deploy's plan (kept even when PLAN
+    # is off, so turning it on doesn't start with a full deploy)
+    def record_deployed(self):
+        try:
+            planner.record(self.config, self.commit_sha or self.head_commit(), self.env_path, npm_cache.node_version())
+        except (OSError, subprocess.SubprocessError) as e:
+            self.log(f"Warning: could not record the deployed commit: {e}")
+
+    # ----------------------------------------------------------------
+    # Part 6b: Cache warm-up (WARMUP=on). In release mode this already
+    # ran inside start(), before traffic was switched.
+    # ----------------------------------------------------------------
+    def warmup(self):
+        config = self.config
+        warmup.run(config, instances.ports_for(config, config["PORT"]), report=self.log)
+
+    # ----------------------------------------------------------------
+    # Part 7: Readiness probe and latency smoke test (PROBE=on)
+    # ----------------------------------------------------------------
+    def probe(self):
+        config = self.config
+        # Read back what start() put live, so this also works on --resume
+        port = releases.load_state(config)["port"] if self.release_mode else config["PORT"]
+        try:
+            probe.run(config, instances.ports_for(config, port), report=self.log)
+            self.log("Readiness probe passed.")
+        except probe.ProbeError as e:
+            self.fail(f"Readiness probe failed: {e}")
+
+    # The step graph. In place, the new tree is built in incoming_root and
+    # the old process is only stopped once that build is done, so the site
+    # is down for the swap and start alone. In release mode nothing waits
+    # on the old tree except the final switch.
+    def steps(self):
+        Step = pipeline.Step
+        # A fetched artifact replaces the checkout, so clone waits for it
+        clone_deps = ["fetch_artifact"] if self.artifact_mode in ("fetch", "auto") else []
+        # The plan links the live node_modules / .next in before install
+        install_deps = ["plan"] if planner.enabled(self.config) else ["clone"]
+        if self.release_mode:
+            steps = [
+                Step("shutdown", self.shutdown),
+                Step("backup", self.backup,
+                     prompt="Proceed with creating a backup of the existing deployment?"),
+                Step("save_build_cache", self.save_build_cache, deps=["backup"]),
+                Step("clone", self.clone, deps=clone_deps, prompt="Ready to clone the repository?", required=True,
+                     resource="network"),
+                Step("install", self.install, deps=install_deps, prompt="Proceed with npm install?",
+                     resource="network"),
+                Step("copy_env", self.copy_env, deps=["install"],
+                     prompt="Proceed with copying .env.local to app root?"),
+                Step("build", self.build, deps=["copy_env", "save_build_cache"],
+                     prompt="Proceed with npm run build?", resource="cpu"),
+                Step("start", self.start, deps=["build", "backup", "shutdown"],
+                     prompt="Proceed with PM2 deployment (start only) directly?"),
+            ]
+        else:
+            steps = [
+                Step("backup", self.backup,
+                     prompt="Proceed with creating a backup of the existing deployment?"),
+                Step("save_build_cache", self.save_build_cache, deps=["backup"]),
+                Step("clone", self.clone, deps=clone_deps, prompt="Ready to clone the repository?", required=True,
+                     resource="network"),
+                Step("install", self.install, deps=install_deps, prompt="Proceed with npm install?",
+                     resource="network"),
+                Step("copy_env", self.copy_env, deps=["install"],
+                     prompt="Proceed with copying .env.local to app root?"),
+                Step("build", self.build, deps=["copy_env", "save_build_cache"],
+                     prompt="Proceed with npm run build?", resource="cpu"),
+                Step("shutdown", self.shutdown, deps=["build"],
+                     prompt="A previous instance of the app may be running. Proceed with shutdown and removal?"),
+                Step("swap", self.swap, deps=["build", "shutdown", "backup"]),
+                Step("start", self.start, deps=["swap"],
+                     prompt="Proceed with PM2 deployment (start only) directly?"),
+            ]
+        if planner.enabled(self.config):
+            steps.append(Step("plan", self.plan, deps=["clone"]))
+        if self.artifact_mode in ("fetch", "auto"):
+            steps.insert(0, Step("fetch_artifact", self.fetch_artifact, resource="network"))
+        if self.artifact_mode in ("publish", "auto"):
+            # Packs APP_ROOT, which in place only holds the new build after the swap
+            publish_deps = ["build"] if self.release_mode else ["swap"]
+            steps.append(Step("publish_artifact", self.publish_artifact, deps=publish_deps, resource="network"))
+        last = "start"
+        if self.config.get("WARMUP", "off") == "on" and not self.release_mode:
+            steps.append(Step("warmup", self.warmup, deps=["start"]))
+            last = "warmup"
+        if self.config.get("PROBE", "off") == "on":
+            steps.append(Step("probe", self.probe, deps=[last]))
+        return steps
+
+
+def write_log_header(deployment, timestamp, resumed=None):
+    config = deployment.config
+    os.makedirs(logs_dir, exist_ok=True)
+    with open(deployment.log_file, "w") as log:
+        log.write(f"Deployment log - {timestamp}\n")
+        log.write("Configuration Loaded:\n")
+        for key, value in config.items():
+            log.write(f"{key}: {value}\n")
+        if resumed:
+            log.write(f"Resuming deploy {config['TIMESTAMP']}; already done: {', '.join(sorted(resumed))}\n")
+        log.write("Deployment process initialized.\n")
+
+
+# Run a deployment's step graph, keeping the --resume state file current
+# and logging the step timings. limits are shared across deployments in
+# fleet mode.
+def run_steps(deployment, steps, skip=None, workers=4, limits=None):
+    config = deployment.config
+    state_file = state_file_for(config)
+    run_results = dict(skip or {})
+
+    def record(name, result):
+        run_results[name] = result["status"]
+        with open(state_file, "w") as progress_file:
+            json.dump({"timestamp": config["TIMESTAMP"], "results": run_results}, progress_file, indent=2)
+
+    # Each step runs as a phase, so its messages and subprocesses are
+    # filed under its name in the event log,
+    # and its commands are stopped once it has run for longer than
+    # STEP_TIMEOUT_<STEP> (or DEPLOY_STEP_TIMEOUT) seconds
+    def as_phase(step):
+        timeout = config.get(f"STEP_TIMEOUT_{step.name.upper()}", config.get("DEPLOY_STEP_TIMEOUT"))
+
+        def run():
+            with events.bind(deployment.events, step.name), deployment.events.phase(step.name), \
+                    runner.step_timeout(float(timeout) if timeout else None):
+                step.run()
+        return pipeline.Step(step.name, run, step.deps, step.prompt, step.required, step.resource)
+
+    started = time.monotonic()
+    started_at = time.time()
+    results = pipeline.run(
+        [as_phase(step) for step in steps], workers=workers, skip=skip, on_done=record,
+        report=deployment.log, limits=limits
+    )
+    total_seconds = time.monotonic() - started
+    deployment.log("\nStep timings:\n" + pipeline.format_timings(steps, results, total_seconds))
+    deployment.events.record(
+        "run", start=round(started_at, 3), end=round(started_at + total_seconds, 3), duration=round(total_seconds, 3),
+        status="failed" if any(result["status"] == "failed" for result in results.values()) else "ok",
+        steps={name: result["status"] for name, result in results.items()},
+    )
+    deployment.events.flush()
+
+    if all(result["status"] != "failed" for result in results.values()) and os.path.exists(state_file):
+        os.remove(state_file)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deploy a Next.js app with PM2.")
+    parser.add_argument("--yes", action="store_true", help="Answer yes to every question (unattended)")
+    parser.add_argument("--resume", action="store_true", help="Continue the last failed deploy of this app")
+    parser.add_argument("--config", default=config_path, help="Path to app.conf")
+    parser.add_argument("--workers", type=int, default=None, help="Steps allowed to run at once")
+    parser.add_argument("--plan", action="store_true", help="Show what an incremental deploy would skip, then exit")
+    parser.add_argument("--timestamp", help="Name this run (log, release folder, backup) YYYYmmdd-HHMMSS instead of now")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.plan:
+        try:
+            print(planner.dry_run(config, config.get("ENV_FILE", env_path)))
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
         sys.exit(0)
-
-print(f"Cloning repository from {config['REPO_URL']} into {config['APP_ROOT']}.")
-clone_command = ["git", "clone", config["REPO_URL"], config["APP_ROOT"]]
-try:
-    subprocess.run(clone_command, check=True)
-    with open(log_file, "a") as log:
-        log.write("Repository cloned successfully.\n")
-    print("Repository cloned successfully.")
-except subprocess.CalledProcessError as e:
-    error_message = f"Error cloning repository: {e}"
-    with open(log_file, "a") as log:
-        log.write(f"{error_message}\n")
-    print(error_message)
-    sys.exit(1)
-
-print("\nRepository clone step completed and logged.")
-
-# ----------------------------------------------------------------
-# Part 5: npm install, .env.local copy and npm build
-# ----------------------------------------------------------------
-# npm install
-install_confirm = input("\nProceed with npm install? (y/n): ")
-if install_confirm.lower() != "y":
-    print("npm install skipped by user.")
-else:
-    try:
-        subprocess.run(["npm", "install"], cwd=config["APP_ROOT"], check=True)
-        with open(log_file, "a") as log:
-            log.write("npm install completed successfully.\n")
-        print("npm install completed.")
-    except subprocess.CalledProcessError as e:
-        error_message = f"Error during npm install: {e}"
-        with open(log_file, "a") as log:
-            log.write(f"{error_message}\n")
-        print(error_message)
-        sys.exit(1)
-
-# Copy .env.local
-env_path = "../.env.local"
-copy_confirm = input("\nProceed with copying .env.local to app root? (y/n): ")
-if copy_confirm.lower() != "y":
-    print(".env.local copy skipped by user.")
-elif not os.path.exists(env_path):
-    error_message = f".env.local file not found at {env_path}."
-    with open(log_file, "a") as log:
-        log.write(f"{error_message}\n")
-    print(error_message)
-    sys.exit(1)
-else:
-    try:
-        subprocess.run(["cp", env_path, os.path.join(config["APP_ROOT"], ".env.local")], check=True)
-        with open(log_file, "a") as log:
-            log.write(".env.local copied to app root.\n")
-        print(".env.local copied to app root.")
-    except subprocess.CalledProcessError as e:
-        error_message = f"Error copying .env.local: {e}"
-        with open(log_file, "a") as log:
-            log.write(f"{error_message}\n")
-        print(error_message)
+    assume_yes = args.yes or config.get("DEPLOY_ASSUME_YES", "no") == "yes"
+    workers = args.workers or int(config.get("DEPLOY_WORKERS", "4"))
+
+    # ----------------------------------------------------------------
+    # Part 1: Configuration and preflight checks (.env.local, tools,
+    # port, disk, nginx, DNS), before any clone or build work
+    # ----------------------------------------------------------------
+    preflight_report = None
+    if config.get("PREFLIGHT", "on") == "on":
+        preflight_started = time.monotonic()
+        preflight_results = preflight.run(config, "deploy", config.get("ENV_FILE", env_path))
+        preflight_report = preflight.report(preflight_results, time.monotonic() - preflight_started)
+        print(preflight_report)
+        if preflight.failed(preflight_results):
+            print("Fix the failed checks and run the deploy again (PREFLIGHT=off skips them).")
+            sys.exit(1)
+    elif not assume_yes:
+        ready = input("Do you have your .env.local ready? (y/n): ")
+        if ready.lower() != "y":
+            print("Please prepare your .env.local file before deployment.")
+            sys.exit(0)
+    elif not os.path.exists(config.get("ENV_FILE", env_path)):
+        print(f".env.local file not found at {config.get('ENV_FILE', env_path)}. Please prepare it before deployment.")
         sys.exit(1)
 
-# npm run build
-build_confirm = input("\nProceed with npm run build? (y/n): ")
-if build_confirm.lower() != "y":
-    print("npm build skipped by user.")
-else:
+    # rollout.py passes its own timestamp, so it knows which backup holds
+    # the tree this run replaces
+    timestamp = args.timestamp or datetime.now().strftime("%Y%m%d-%H%M%S")
+    log_file = f"{logs_dir}/next-deploy-{timestamp}.log"
+    state_file = state_file_for(config)
+    # A resumed run reuses the failed run's timestamp, and so its release
+    # folder, and skips the steps that already finished
+    resumed = {}
+    config["TIMESTAMP"] = timestamp
+    if args.resume:
+        if not os.path.exists(state_file):
+            print(f"No failed deploy to resume for '{config['APP_NAME_PM2']}'.")
+            sys.exit(1)
+        with open(state_file, "r") as resume_file:
+            previous_run = json.load(resume_file)
+        config["TIMESTAMP"] = previous_run["timestamp"]
+        resumed = {
+            name: "resumed" for name, status in previous_run["results"].items()
+            if status in ("ok", "skipped", "resumed")
+        }
+
+    deployment = Deployment(config, log_file)
+
+    print("\nLoaded Configuration:")
+    max_label_length = max(len(key) for key in config.keys())
+    for key, value in config.items():
+        print(f"{key.upper():<{max_label_length}}: {value}")
+
+    if not assume_yes:
+        verify = input("\nIs this configuration correct? (y/n): ")
+        if verify.lower() != "y":
+            print("Please update your configuration in app.conf.")
+            sys.exit(0)
+
+    write_log_header(deployment, timestamp, resumed)
+    if preflight_report:
+        deployment.log(preflight_report)
+    print(f"\nConfiguration logged to: {log_file}")
+    print("Script completed Part 1 successfully.")
+
+    # Every question is asked before anything runs, so the steps can
+    # then run side by side without waiting on the keyboard
+    steps = deployment.steps()
+    skip = dict(resumed)
+    if not assume_yes:
+        for name in pipeline.check_graph(steps):
+            step = next(step for step in steps if step.name == name)
+            if step.prompt is None or name in skip:
+                continue
+            if input(f"\n{step.prompt} (y/n): ").lower() != "y":
+                if step.required:
+                    print(f"Step '{name}' declined by the user. Deployment aborted.")
+                    sys.exit(0)
+                print(f"Step '{name}' will be skipped.")
+                skip[name] = "skipped"
+
+    runner.handle_interrupts()
     try:
-        subprocess.run(["npm", "run", "build"], cwd=config["APP_ROOT"], check=True)
-        with open(log_file, "a") as log:
-            log.write("npm build completed successfully.\n")
-        print("npm build completed.")
-    except subprocess.CalledProcessError as e:
-        error_message = f"Error during npm build: {e}"
-        with open(log_file, "a") as log:
-            log.write(f"{error_message}\n")
-        print(error_message)
+        results = run_steps(deployment, steps, skip, workers)
+    except KeyboardInterrupt:
+        deployment.log("\nDeployment interrupted; running commands were stopped. Run deploy.py --resume to continue.")
+        deployment.events.flush()
+        sys.exit(130)
+    failed = [name for name, result in results.items() if result["status"] == "failed"]
+    if failed:
+        deployment.log(f"Deployment failed at: {', '.join(failed)}. Fix the problem and run deploy.py --resume.")
         sys.exit(1)
 
-# ----------------------------------------------------------------
-# Part 6: Starting the app as a pm2 process
-# ----------------------------------------------------------------        
-
-# Confirm before proceeding with PM2 start
-start_confirm = input("\nProceed with PM2 deployment (start only) directly? (y/n): ")
-if start_confirm.lower() != "y":
-    print("PM2 deployment skipped by user.")
-else:
-    try:
-        # Start the app with PM2
-        subprocess.run(
-            ["pm2", "start", "npm", "--name", config["APP_NAME_PM2"], "--", "start", "--", "-p", config["PORT"]],
-            cwd=config["APP_ROOT"],
-            check=True
-        )
-        
-        with open(log_file, "a") as log:
-            log.write("PM2 start executed successfully.\n")
-        print("PM2 deployment executed successfully.")
-
-    except subprocess.CalledProcessError as e:
-        error_message = f"Error during PM2 deployment process: {e}"
-        with open(log_file, "a") as log:
-            log.write(f"{error_message}\n")
-        print(error_message)
-        sys.exit(1)
+    print("\nDeployment process completed and logged.")
 
 
-print("\nDeployment process completed and logged.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Buffered structured event log shared by the deploy scripts
+#
+# An EventLog writes JSON Lines records next to the human-readable log.
+# The .log file keeps getting the same plain lines, and both files are
+# appended in batches instead of being reopened for every line:
+#
+#   {"type": "message", "phase": "build", "time": ..., "text": "..."}
+#   {"type": "phase", "phase": "build", "start": ..., "end": ...,
+#    "duration": 41.2, "status": "ok"}
+#   {"type": "process", "phase": "build", "cmd": "npm run build", ...,
+#    "exit_code": 0, "cpu_user": 80.1, "cpu_sys": 6.3, "max_rss_kb": 912345}
+#
+# Each record also carries "run" and "app". bind() says which log and
+# phase the current thread works for, so runner.run() can file a process
+# record without being handed the log. deploy-stats.py reads the files.
+# ----------------------------------------------------------------
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_context = threading.local()
+_open_logs = []
+
+
+class EventLog:
+    # flush_every: seconds between writes; flush_records: buffered
+    # records that force a write sooner
+    def __init__(self, path, text_path=None, run=None, app=None, echo=True, flush_every=1.0, flush_records=200):
+        self.path = path
+        self.text_path = text_path
+        self.run = run
+        self.app = app
+        self.echo = echo
+        self.flush_every = flush_every
+        self.flush_records = flush_records
+        self._records = []
+        self._lines = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        _open_logs.append(self)
+
+    def record(self, record_type, **fields):
+        record = {"type": record_type, "run": self.run, "app": self.app, "time": round(time.time(), 3)}
+        record.update(fields)
+        with self._lock:
+            self._records.append(record)
+            self._maybe_flush()
+
+    def message(self, text, phase=None):
+        if self.echo:
+            print(text)
+        with self._lock:
+            self._lines.append(text)
+        self.record("message", phase=phase or current_phase(), text=text)
+
+    # Time a block as a phase record; an exception marks it failed
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        status = "failed"
+        try:
+            yield
+            status = "ok"
+        finally:
+            end = time.time()
+            self.record("phase", phase=name, start=round(start, 3), end=round(end, 3),
+                        duration=round(end - start, 3), status=status)
+
+    def _maybe_flush(self):
+        if len(self._records) >= self.flush_records or time.monotonic() - self._last_flush >= self.flush_every:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._records:
+            with open(self.path, "a") as events_file:
+                events_file.write("".join(json.dumps(record) + "\n" for record in self._records))
+            self._records = []
+        if self._lines and self.text_path:
+            with open(self.text_path, "a") as log:
+                log.write("".join(f"{line}\n" for line in self._lines))
+        self._lines = []
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+
+@atexit.register
+def _flush_all():
+    for event_log in _open_logs:
+        event_log.flush()
+
+
+# Make `event_log` and `phase` current for this thread
+@contextmanager
+def bind(event_log, phase=None):
+    previous = getattr(_context, "binding", None)
+    _context.binding = (event_log, phase)
+    try:
+        yield
+    finally:
+        _context.binding = previous
+
+
+def current():
+    binding = getattr(_context, "binding", None)
+    return binding[0] if binding else None
+
+
+def current_phase():
+    binding = getattr(_context, "binding", None)
+    return binding[1] if binding else None
+
+
+def events_path_for(log_file):
+    return (log_file[:-len(".log")] if log_file.endswith(".log") else log_file) + ".jsonl"
+
+
+# The EventLog for a script's run: plain lines go to log_file, structured
+# records to a .jsonl next to it, and the run is named after log_file
+def for_log_file(log_file, app=None, echo=True):
+    run = os.path.basename(log_file)
+    if run.endswith(".log"):
+        run = run[:-len(".log")]
+    return EventLog(events_path_for(log_file), text_path=log_file, run=run, app=app, echo=echo)
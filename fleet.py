@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Fleet deploy: many apps from one run
+#
+#   python3 fleet.py ../conf/apps                 every *.conf in the folder
+#   python3 fleet.py a.conf b.conf --yes
+#   python3 fleet.py ../conf/apps --defaults ../conf/fleet.conf --cpu 2
+#
+# Each app file is an app.conf. Keys in --defaults apply to every app
+# unless the app sets them itself. Apps run through a worker pool. Clone
+# and install share --network slots, and npm build shares --cpu slots,
+# so a box full of builds doesn't run out of memory. Every app gets its
+# own deploy log, and a summary table shows per-app timings and
+# outcomes.
+# ----------------------------------------------------------------
+
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import deploy
+import preflight
+import runner
+
+
+# Build slots default to what the box can carry: half the cores, and
+# roughly 2 GB of RAM per concurrent Next.js build
+def default_cpu_slots():
+    cores = os.cpu_count() or 1
+    try:
+        memory_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 ** 3)
+    except (ValueError, OSError):
+        memory_gb = 2 * cores
+    return max(1, min(cores // 2, int(memory_gb // 2)))
+
+
+def app_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.conf"))))
+        else:
+            files.append(path)
+    return files
+
+
+def deploy_app(conf_file, defaults, timestamp, limits):
+    config = dict(defaults)
+    config.update(deploy.load_config(conf_file))
+    config["TIMESTAMP"] = timestamp
+    log_file = f"{deploy.logs_dir}/next-deploy-{config['APP_NAME_PM2']}-{timestamp}.log"
+
+    deployment = deploy.Deployment(config, log_file, echo=False)
+    deploy.write_log_header(deployment, timestamp)
+    started = time.monotonic()
+    if config.get("PREFLIGHT", "on") == "on":
+        # A broken app is caught here, before it holds network or build slots
+        preflight_results = preflight.run(config, "deploy", deployment.env_path)
+        deployment.log(preflight.report(preflight_results, time.monotonic() - started))
+        if preflight.failed(preflight_results):
+            deployment.events.flush()
+            return {
+                "app": config["APP_NAME_PM2"],
+                "failed": ["preflight"],
+                "seconds": time.monotonic() - started,
+                "steps": {},
+                "log": log_file,
+            }
+    results = deploy.run_steps(
+        deployment, deployment.steps(), workers=int(config.get("DEPLOY_WORKERS", "4")), limits=limits
+    )
+    return {
+        "app": config["APP_NAME_PM2"],
+        "failed": [name for name, result in results.items() if result["status"] == "failed"],
+        "seconds": time.monotonic() - started,
+        "steps": results,
+        "log": log_file,
+    }
+
+
+def print_summary(outcomes):
+    columns = ["clone", "install", "build", "start"]
+    width = max([len("APP")] + [len(outcome["app"]) for outcome in outcomes])
+    header = f"{'APP':<{width}}  {'RESULT':<16}  {'TOTAL':>7}" + "".join(f"  {name.upper():>7}" for name in columns)
+    print("\n" + header)
+    print("-" * len(header))
+    for outcome in sorted(outcomes, key=lambda outcome: outcome["app"]):
+        result = "ok" if not outcome["failed"] else f"failed: {','.join(outcome['failed'])}"
+        line = f"{outcome['app']:<{width}}  {result:<16}  {outcome['seconds']:>7.1f}"
+        for name in columns:
+            step = outcome["steps"].get(name)
+            line += f"  {step['seconds']:>7.1f}" if step else f"  {'-':>7}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deploy many Next.js apps through a worker pool.")
+    parser.add_argument("paths", nargs="+", help="App .conf files or folders of them")
+    parser.add_argument("--defaults", help="app.conf-style file with keys shared by every app")
+    parser.add_argument("--yes", action="store_true", help="Don't ask for confirmation")
+    parser.add_argument("--apps", type=int, default=8, help="Apps deployed at once")
+    parser.add_argument("--network", type=int, default=8, help="Concurrent clone/install steps")
+    parser.add_argument("--cpu", type=int, default=None, help="Concurrent npm builds (default from cores and RAM)")
+    args = parser.parse_args()
+
+    files = app_files(args.paths)
+    if not files:
+        print("No app .conf files found.")
+        sys.exit(1)
+    defaults = deploy.load_config(args.defaults) if args.defaults else {}
+    cpu_slots = args.cpu or default_cpu_slots()
+
+    print(f"Deploying {len(files)} apps: {args.apps} at a time, {args.network} network slots, {cpu_slots} build slots.")
+    for conf_file in files:
+        print(f"  {conf_file}")
+    if not args.yes and input("\nProceed with fleet deploy? (y/n): ").lower() != "y":
+        print("Fleet deploy aborted by user.")
+        sys.exit(0)
+
+    os.makedirs(deploy.logs_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    limits = {"network": threading.Semaphore(args.network), "cpu": threading.Semaphore(cpu_slots)}
+    outcomes = []
+    interrupted = False
+    started = time.monotonic()
+
+    runner.handle_interrupts()
+    with ThreadPoolExecutor(max_workers=max(1, args.apps)) as pool:
+        futures = {pool.submit(deploy_app, conf_file, defaults, timestamp, limits): conf_file for conf_file in files}
+        try:
+            for number, future in enumerate(as_completed(futures), start=1):
+                conf_file = futures[future]
+                try:
+                    outcome = future.result()
+                except (OSError, KeyError, ValueError) as e:
+                    # Broken app definition; the rest of the fleet carries on
+                    outcome = {"app": os.path.basename(conf_file), "failed": [f"config ({e})"],
+                               "seconds": 0.0, "steps": {}, "log": None}
+                outcomes.append(outcome)
+                status = "ok" if not outcome["failed"] else f"FAILED at {', '.join(outcome['failed'])}"
+                print(f"[{number}/{len(files)}] {outcome['app']}: {status} in {outcome['seconds']:.1f}s"
+                      + (f" (log: {outcome['log']})" if outcome["log"] else ""))
+        except KeyboardInterrupt:
+            # Apps not started yet never start; running ones fail fast
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("\nFleet deploy interrupted; running commands were stopped.")
+            interrupted = True
+
+    print_summary(outcomes)
+    failed = [outcome for outcome in outcomes if outcome["failed"]]
+    print(f"\n{len(outcomes) - len(failed)} of {len(outcomes)} apps deployed in {time.monotonic() - started:.1f}s.")
+    if interrupted:
+        sys.exit(130)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Persistent git mirror cache for Part 4 of deploy.py
+#
+# One bare mirror per REPO_URL lives under GIT_CACHE_DIR and is kept
+# current with an incremental fetch. Checkouts come from the mirror:
+#   GIT_CHECKOUT=shallow   depth-1 fetch of the ref into a fresh folder
+#   GIT_CHECKOUT=worktree  `git worktree add` straight off the mirror
+#   GIT_CHECKOUT=clone     plain full clone (the original behaviour)
+# GIT_REF optionally pins a branch, tag or commit SHA.
+# ----------------------------------------------------------------
+
+import fcntl
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+
+import runner
+
+
+def cache_dir_for(config):
+    return config.get("GIT_CACHE_DIR", os.path.join(config["DEPLOYMENT_ROOT"], ".git-cache"))
+
+
+# Readable, collision-free folder name for a repository URL
+def mirror_path(cache_dir, repo_url):
+    name = re.sub(r"\.git$", "", repo_url.rstrip("/").split("/")[-1].split(":")[-1]) or "repo"
+    digest = hashlib.sha1(repo_url.encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{name}-{digest}.git")
+
+
+# Serialize mirror updates so two deploys of the same repo don't race
+@contextmanager
+def mirror_lock(mirror):
+    os.makedirs(os.path.dirname(mirror), exist_ok=True)
+    with open(mirror + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Create the mirror on first use, otherwise fetch only what changed
+def update_mirror(repo_url, cache_dir):
+    mirror = mirror_path(cache_dir, repo_url)
+    with mirror_lock(mirror):
+        if os.path.isdir(mirror):
+            runner.run(["git", "-C", mirror, "remote", "set-url", "origin", repo_url], check=True)
+            runner.run(["git", "-C", mirror, "fetch", "--prune", "--quiet", "origin"], check=True)
+        else:
+            runner.run(["git", "clone", "--mirror", "--quiet", repo_url, mirror], check=True)
+            # Allow depth-1 fetches of a pinned SHA out of the mirror
+            runner.run(["git", "-C", mirror, "config", "uploadpack.allowAnySHA1InWant", "true"], check=True)
+    return mirror
+
+
+def shallow_checkout(mirror, repo_url, dest, ref=None):
+    runner.run(["git", "init", "--quiet", dest], check=True)
+    runner.run(
+        ["git", "-C", dest, "fetch", "--quiet", "--depth", "1", f"file://{os.path.abspath(mirror)}", ref or "HEAD"],
+        check=True
+    )
+    runner.run(["git", "-C", dest, "checkout", "--quiet", "--detach", "FETCH_HEAD"], check=True)
+    runner.run(["git", "-C", dest, "remote", "add", "origin", repo_url], check=True)
+
+
+def worktree_checkout(mirror, dest, ref=None):
+    with mirror_lock(mirror):
+        # Drop bookkeeping for worktrees whose folders were deleted
+        runner.run(["git", "-C", mirror, "worktree", "prune"], check=True)
+        runner.run(
+            ["git", "-C", mirror, "worktree", "add", "--quiet", "--detach", "--force",
+             os.path.abspath(dest), ref or "HEAD"],
+            check=True
+        )
+
+
+def full_clone(repo_url, dest, ref=None):
+    runner.run(["git", "clone", repo_url, dest], check=True)
+    if ref:
+        runner.run(["git", "-C", dest, "checkout", "--quiet", ref], check=True)
+
+
+# The checked-out commit, written into the tree by checkout() so it is
+# still known after standalone.assemble() has deleted .git
+COMMIT_FILE = ".deploy-commit"
+
+
+def read_commit(app_root):
+    try:
+        with open(os.path.join(app_root, COMMIT_FILE)) as commit_file:
+            return commit_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# Drop the mirror's record of worktrees whose folders are gone (after
+# assemble() replaced a GIT_CHECKOUT=worktree checkout)
+def prune_worktrees(config):
+    mirror = mirror_path(cache_dir_for(config), config["REPO_URL"])
+    if not os.path.isdir(mirror):
+        return
+    with mirror_lock(mirror):
+        runner.run(["git", "-C", mirror, "worktree", "prune"], check=True, capture_output=True)
+
+
+# Check out REPO_URL (at GIT_REF) into dest and return the commit SHA
+def checkout(config, dest):
+    mode = config.get("GIT_CHECKOUT", "clone")
+    ref = config.get("GIT_REF") or None
+    repo_url = config["REPO_URL"]
+
+    if mode == "clone":
+        full_clone(repo_url, dest, ref)
+    elif mode in ("shallow", "worktree"):
+        mirror = update_mirror(repo_url, cache_dir_for(config))
+        if mode == "shallow":
+            shallow_checkout(mirror, repo_url, dest, ref)
+        else:
+            worktree_checkout(mirror, dest, ref)
+    else:
+        raise ValueError(f"Unknown GIT_CHECKOUT mode: {mode}")
+
+    result = runner.run(["git", "-C", dest, "rev-parse", "HEAD"], check=True, capture_output=True, text=True)
+    commit_sha = result.stdout.strip()
+    with open(os.path.join(dest, COMMIT_FILE), "w") as commit_file:
+        commit_file.write(commit_sha + "\n")
+    return commit_sha
+
+
+# Commit REPO_URL's GIT_REF points at, without cloning
+def remote_sha(config):
+    ref = config.get("GIT_REF") or "HEAD"
+    if re.fullmatch(r"[0-9a-f]{40}", ref):
+        return ref
+    result = runner.run(["git", "ls-remote", config["REPO_URL"], ref], check=True, capture_output=True, text=True)
+    lines = result.stdout.split()
+    if not lines:
+        raise ValueError(f"{ref} not found in {config['REPO_URL']}")
+    return lines[0]
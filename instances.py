@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# How an app runs under PM2 (PM2_MODE)
+#
+#   fork      one process: pm2 start npm -- start -- -p PORT (default)
+#   cluster   PM2 cluster mode, PM2_INSTANCES workers sharing PORT
+#   ports     PM2_INSTANCES fork processes on PORT, PORT+1, ...; nginx
+#             balances across them with least_conn
+#
+# PM2_INSTANCES="auto" (default) uses one instance per core, but no
+# more than the RAM allows at PM2_INSTANCE_MEMORY_MB (default 512) each.
+# In ports mode every instance is started in a PM2 namespace named after
+# the app, so `pm2 stop/restart/delete <name>` still acts on all of them.
+# A standalone build (NEXT_OUTPUT="standalone") runs `node server.js` in
+# every mode instead of npm / the next binary.
+#
+#   python3 instances.py start    start APP_NAME_PM2 from APP_ROOT (start.sh)
+# ----------------------------------------------------------------
+
+import os
+import sys
+
+import pm2
+import runner
+import standalone
+
+MODES = ("fork", "cluster", "ports")
+
+
+def mode_of(config):
+    mode = config.get("PM2_MODE", "fork")
+    if mode not in MODES:
+        raise ValueError(f"Unknown PM2_MODE '{mode}' (expected one of {', '.join(MODES)})")
+    return mode
+
+
+def memory_mb():
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def instance_count(config):
+    if mode_of(config) == "fork":
+        return 1
+    wanted = config.get("PM2_INSTANCES", "auto")
+    if wanted != "auto":
+        return max(1, int(wanted))
+    count = os.cpu_count() or 1
+    memory = memory_mb()
+    if memory is not None:
+        count = min(count, memory // int(config.get("PM2_INSTANCE_MEMORY_MB", "512")))
+    return max(1, count)
+
+
+# Ports served by an app whose first port is base_port
+def ports_for(config, base_port):
+    span = instance_count(config) if mode_of(config) == "ports" else 1
+    return [str(int(base_port) + offset) for offset in range(span)]
+
+
+# Start app_root under PM2 as `name` on base_port. Returns the ports
+# that will answer once it is up.
+def start(config, name, base_port, app_root):
+    try:
+        return _start(config, name, base_port, app_root)
+    finally:
+        pm2.changed()
+
+
+def _start(config, name, base_port, app_root):
+    mode = mode_of(config)
+    if standalone.is_standalone(app_root):
+        return _start_server(config, mode, name, base_port, app_root)
+
+    if mode == "fork":
+        runner.run(
+            ["pm2", "start", "npm", "--name", name, "--", "start", "--", "-p", str(base_port)],
+            cwd=app_root, check=True
+        )
+        return [str(base_port)]
+
+    count = instance_count(config)
+    if mode == "cluster":
+        # Cluster mode needs a Node script, not the npm wrapper
+        runner.run(
+            ["pm2", "start", "node_modules/next/dist/bin/next", "--name", name, "-i", str(count),
+             "--", "start", "-p", str(base_port)],
+            cwd=app_root, check=True
+        )
+        return [str(base_port)]
+
+    ports = ports_for(config, base_port)
+    for index, port in enumerate(ports):
+        runner.run(
+            ["pm2", "start", "npm", "--name", f"{name}-{index}", "--namespace", name,
+             "--", "start", "--", "-p", port],
+            cwd=app_root, check=True
+        )
+    return ports
+
+
+# A standalone build (standalone.py) runs `node server.js` directly,
+# which takes its port from the environment PM2 is started with
+def _start_server(config, mode, name, base_port, app_root):
+    if mode in ("fork", "cluster"):
+        cluster = ["-i", str(instance_count(config))] if mode == "cluster" else []
+        runner.run(
+            ["pm2", "start", "server.js", "--name", name] + cluster,
+            cwd=app_root, env=standalone.server_env(config, base_port), check=True
+        )
+        return [str(base_port)]
+
+    ports = ports_for(config, base_port)
+    for index, port in enumerate(ports):
+        runner.run(
+            ["pm2", "start", "server.js", "--name", f"{name}-{index}", "--namespace", name],
+            cwd=app_root, env=standalone.server_env(config, port), check=True
+        )
+    return ports
+
+
+# Body of an nginx upstream block for these ports
+def upstream_lines(ports, keepalive):
+    lines = ["least_conn;"] if len(ports) > 1 else []
+    lines += [f"server 127.0.0.1:{port};" for port in ports]
+    lines.append(f"keepalive {keepalive};")
+    return lines
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["start"]:
+        print("Usage: python3 instances.py start")
+        sys.exit(2)
+    import deploy
+
+    config = deploy.load_config(deploy.config_path)
+    ports = start(config, config["APP_NAME_PM2"], config["PORT"], config["APP_ROOT"])
+    print(f"PM2 '{config['APP_NAME_PM2']}' started in {mode_of(config)} mode"
+          f" with {instance_count(config)} instance(s) on port(s) {', '.join(ports)}.")
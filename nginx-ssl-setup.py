@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
 import subprocess
 import sys
@@ -7,6 +8,19 @@ import time
 from datetime import datetime
 import requests
 
+import deploy
+import events
+import nginx_profiles
+import nginx_sites
+import preflight
+
+parser = argparse.ArgumentParser(description="Create the Nginx SSL site config for SUBDOMAIN.DOMAIN.")
+parser.add_argument("--sites", help="File of '<subdomain> <port> [domain]' lines to configure in one batch")
+parser.add_argument("--yes", action="store_true", help="Batch mode: don't ask for confirmation")
+parser.add_argument("--overwrite-certbot", action="store_true",
+                    help="Overwrite site configs certbot has added SSL blocks to (run certbot again afterwards)")
+args = parser.parse_args()
+
 # Define paths
 config_path = "../conf/app.conf"
 logs_dir = "../logs"
@@ -14,34 +28,17 @@ timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
 log_file = f"{logs_dir}/nginx-ssl-{timestamp}.log"
 
 # Load configuration
-config = {}
-with open(config_path, "r") as conf_file:
-    for line in conf_file:
-        line = line.strip()
-        if line and not line.startswith("#"):
-            try:
-                key, value = line.split("=", 1)
-                config[key.strip()] = value.strip().strip('"')
-            except ValueError:
-                print(f"Invalid line in config file: {line}")
-                sys.exit(1)
+config = deploy.load_config(config_path)
 
-# Define important variables from configuration
-domain_full = f"{config['SUBDOMAIN']}.{config['DOMAIN']}"
 template_path = config.get("SSL_TEMPLATE_PATH", "../nginx-ssl.conf")
-nginx_available_path = os.path.join(config["NGINX_AVAILABLE_DIR"], domain_full)
-nginx_enabled_path = os.path.join(config["NGINX_ENABLED_DIR"], domain_full)
 
 # Initialize log file
 os.makedirs(logs_dir, exist_ok=True)
 with open(log_file, "w") as log:
     log.write(f"Nginx SSL Setup Log - {timestamp}\n\n")
 
-# Helper function for logging
-def log_message(message):
-    print(message)
-    with open(log_file, "a") as log:
-        log.write(f"{message}\n")
+event_log = events.for_log_file(log_file, app=config.get("APP_NAME_PM2"))
+log_message = event_log.message
 
 # Utility function for confirmation with proper handling
 def confirm_step(prompt):
@@ -62,9 +59,66 @@ def confirm_step(prompt):
             print("Invalid input. Please enter 'y' or 'n'.")
 
 # ----------------------------------------------------------------------------
-# Step 1: Confirm DNS setup
+# Batch mode: every site in --sites, one nginx -t and one reload
+# ----------------------------------------------------------------------------
+if args.sites:
+    try:
+        sites = nginx_sites.read_sites(args.sites, config["DOMAIN"])
+        template = nginx_profiles.template_for(config) or nginx_sites.load_template(template_path)
+    except FileNotFoundError as e:
+        log_message(f"Error: {e.filename} not found")
+        sys.exit(1)
+    except ValueError as e:
+        log_message(f"Error: {e}")
+        sys.exit(1)
+
+    log_message(f"Batch of {len(sites)} sites from {args.sites}:")
+    for site in sites:
+        log_message(f"  {site['domain_full']} -> port {site['port']}")
+    if not args.yes:
+        confirm_step(f"Write and enable these {len(sites)} Nginx configs, then validate and reload once? (y/n): ")
+
+    try:
+        rendered = {site["domain_full"]: template.render(nginx_sites.site_values(config, site)) for site in sites}
+    except ValueError as e:
+        log_message(f"Error: {e}")
+        sys.exit(1)
+    try:
+        outcome = nginx_sites.apply(
+            rendered, config["NGINX_AVAILABLE_DIR"], config["NGINX_ENABLED_DIR"], report=log_message,
+            overwrite_certbot=args.overwrite_certbot
+        )
+    except subprocess.SubprocessError as e:
+        log_message(f"Error: {' '.join(e.cmd)} failed, nothing was changed:\n{getattr(e, 'stderr', None) or e}")
+        sys.exit(1)
+    except OSError as e:
+        log_message(f"Error writing Nginx configs, nothing was changed: {e}")
+        sys.exit(1)
+
+    if outcome["written"]:
+        commands = "\n".join(f"sudo certbot --nginx -d {domain_full}" for domain_full in outcome["written"])
+        log_message(f"Batch complete. Obtain certificates for new or changed sites with:\n\n{commands}\n")
+    if outcome["kept"]:
+        log_message("Re-run with --overwrite-certbot to replace the kept sites, then run certbot for them again.")
+    sys.exit(0)
+
+# Define important variables from configuration
+domain_full = f"{config['SUBDOMAIN']}.{config['DOMAIN']}"
+nginx_available_path = os.path.join(config["NGINX_AVAILABLE_DIR"], domain_full)
+nginx_enabled_path = os.path.join(config["NGINX_ENABLED_DIR"], domain_full)
+
+# ----------------------------------------------------------------------------
+# Step 1: Preflight checks (A record points here, nginx -t passes, config)
 # ----------------------------------------------------------------------------
-confirm_step("Have you created the subdomain A record in Digital Ocean DNS? (y/n): ")
+if config.get("PREFLIGHT", "on") == "on":
+    preflight_started = time.monotonic()
+    preflight_results = preflight.run(config, "nginx")
+    log_message(preflight.report(preflight_results, time.monotonic() - preflight_started))
+    if preflight.failed(preflight_results):
+        log_message("Preflight failed; fix the checks above before setting up SSL (PREFLIGHT=off skips them).")
+        sys.exit(1)
+else:
+    confirm_step("Have you created the subdomain A record in Digital Ocean DNS? (y/n): ")
 
 # ----------------------------------------------------------------------------
 # Step 2: Configuration Verification
@@ -80,13 +134,16 @@ confirm_step("Is this configuration correct? (y/n): ")
 if confirm_step("Replace placeholders in SSL template and create Nginx config file? (y/n): "):
     try:
         log_message("Reading and replacing placeholders in the SSL template...")
-        with open(template_path, "r") as template_file:
-            template_content = template_file.read()
-        nginx_config_content = template_content.replace("SUBDOMAIN.DOMAIN", domain_full).replace("PORT", config["PORT"])
+        site = {"subdomain": config["SUBDOMAIN"], "domain": config["DOMAIN"], "domain_full": domain_full, "port": config["PORT"]}
+        template = nginx_profiles.template_for(config) or nginx_sites.load_template(template_path)
+        nginx_config_content = template.render(nginx_sites.site_values(config, site))
         log_message("Placeholders replaced successfully.")
     except FileNotFoundError:
         log_message(f"Error: SSL template file not found at {template_path}")
         sys.exit(1)
+    except ValueError as e:
+        log_message(f"Error: {e}")
+        sys.exit(1)
 else:
     log_message("User opted to skip replacing placeholders. Aborting SSL setup.")
     print("Aborted. SSL setup will not proceed.")
@@ -95,6 +152,20 @@ else:
 # ----------------------------------------------------------------------------
 # Step 4: Write config to Nginx sites-available
 # ----------------------------------------------------------------------------
+if nginx_sites.is_current(nginx_available_path, nginx_enabled_path, nginx_config_content):
+    if not os.path.exists(nginx_sites.rendered_hash_path(nginx_available_path)):
+        nginx_sites.record_rendered(nginx_available_path, nginx_config_content)
+    log_message(f"{nginx_available_path} is already up to date and enabled; nothing to write, no reload needed.")
+    sys.exit(0)
+
+# Rewriting a site certbot has edited would drop its SSL server blocks
+if nginx_sites.managed_by_certbot(nginx_available_path) and not args.overwrite_certbot:
+    log_message(
+        f"{nginx_available_path} has changed and certbot manages it; not overwriting it, which would drop HTTPS. "
+        "Re-run with --overwrite-certbot, then run certbot for it again."
+    )
+    sys.exit(1)
+
 if os.path.exists(nginx_available_path):
     overwrite_confirm = confirm_step(f"Configuration file {nginx_available_path} already exists. Overwrite? (y/n): ")
     if not overwrite_confirm:
@@ -106,8 +177,7 @@ if os.path.exists(nginx_available_path):
 if confirm_step(f"Write Nginx configuration to {nginx_available_path}? (y/n): "):
     try:
         log_message(f"Writing configuration to {nginx_available_path}...")
-        with open(nginx_available_path, "w") as nginx_conf:
-            nginx_conf.write(nginx_config_content)
+        nginx_sites.write_site(nginx_available_path, nginx_config_content)
         log_message(f"Configuration written to {nginx_available_path}.")
     except Exception as e:
         log_message(f"Error writing Nginx config: {e}")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Generated nginx site templates for Next.js (NGINX_PROFILE)
+#
+#   template       SSL_TEMPLATE_PATH as-is (default)
+#   nextjs         upstream with keepalive, immutable /_next/static,
+#                  gzip (and brotli with NGINX_BROTLI="on"), HTTP/2
+#                  where the installed nginx supports `http2 on;`
+#   nextjs-cache   nextjs plus a proxy_cache zone for ISR/SSR pages,
+#                  served stale while nginx revalidates in the background
+#
+# The result is an nginx_sites.Template, so per-site values (domain,
+# port, upstream name) are filled in the same way as for a hand-written
+# template. Everything else comes from app.conf when the profile is
+# generated.
+# ----------------------------------------------------------------
+
+import re
+import subprocess
+
+import nginx_sites
+import runner
+
+PROFILES = ("template", "nextjs", "nextjs-cache")
+
+COMPRESSIBLE = (
+    "text/plain text/css text/xml application/xml application/json application/javascript "
+    "application/rss+xml image/svg+xml font/ttf font/otf application/manifest+json"
+)
+
+
+# `http2 on;` is nginx 1.25.1+; stock Ubuntu LTS ships 1.18 / 1.24
+HTTP2_DIRECTIVE_SINCE = (1, 25, 1)
+
+
+# Installed nginx version as a tuple, or None when it can't be run
+def nginx_version():
+    try:
+        # nginx -v prints "nginx version: nginx/1.24.0 (Ubuntu)" to stderr
+        result = runner.run(["nginx", "-v"], capture_output=True, text=True)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"nginx/(\d+)\.(\d+)\.(\d+)", result.stderr + result.stdout)
+    return tuple(int(part) for part in match.groups()) if match else None
+
+
+# NGINX_HTTP2: auto (default) emits `http2 on;` only on nginx 1.25.1+,
+# on forces it, off leaves it out. Older nginx turns HTTP/2 on with
+# `listen 443 ssl http2;`, which belongs to the listen line certbot adds.
+def http2_enabled(config):
+    setting = config.get("NGINX_HTTP2", "auto")
+    if setting == "auto":
+        version = nginx_version()
+        return version is not None and version >= HTTP2_DIRECTIVE_SINCE
+    return setting == "on"
+
+
+def options(config):
+    return {
+        "profile": config.get("NGINX_PROFILE", "template"),
+        "static_max_age": int(config.get("NGINX_STATIC_MAX_AGE", "31536000")),
+        "gzip": config.get("NGINX_GZIP", "on") == "on",
+        "brotli": config.get("NGINX_BROTLI", "off") == "on",
+        "http2": http2_enabled(config),
+        "cache_dir": config.get("NGINX_CACHE_DIR", "/var/cache/nginx"),
+        "cache_max_size": config.get("NGINX_CACHE_MAX_SIZE", "1g"),
+        "cache_valid": config.get("NGINX_CACHE_VALID", "60s"),
+        # Release mode keeps its own upstream file (releases.py); proxy to
+        # that instead of defining one here
+        "release_upstream": config["APP_NAME_PM2"] if config.get("DEPLOY_MODE") == "release" else None,
+    }
+
+
+def _proxy_headers():
+    return [
+        "proxy_http_version 1.1;",
+        "proxy_set_header Host $host;",
+        "proxy_set_header X-Real-IP $remote_addr;",
+        "proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;",
+        "proxy_set_header X-Forwarded-Proto $scheme;",
+        # Empty Connection header keeps upstream connections alive; only
+        # websocket upgrades get "upgrade"
+        "proxy_set_header Upgrade $http_upgrade;",
+        "proxy_set_header Connection ${{ UPSTREAM }}_connection;",
+    ]
+
+
+def _compression(opts):
+    lines = []
+    if opts["gzip"]:
+        lines += [
+            "gzip on;",
+            "gzip_vary on;",
+            "gzip_proxied any;",
+            "gzip_comp_level 5;",
+            "gzip_min_length 256;",
+            f"gzip_types {COMPRESSIBLE};",
+        ]
+    if opts["brotli"]:
+        # Needs the ngx_brotli module
+        lines += [
+            "brotli on;",
+            "brotli_comp_level 5;",
+            "brotli_min_length 256;",
+            f"brotli_types {COMPRESSIBLE};",
+        ]
+    return lines
+
+
+# "header { ... }" with every line of the body indented one level;
+# entries may themselves be nested blocks
+def _block(header, lines):
+    body = "".join(
+        f"    {line}\n" if line else "\n"
+        for entry in lines for line in entry.rstrip("\n").split("\n")
+    )
+    return f"{header} {{\n{body}}}\n"
+
+
+# Template text for a generated profile
+def render_profile(config):
+    opts = options(config)
+    cache = opts["profile"] == "nextjs-cache"
+    upstream = opts["release_upstream"] or "{{ UPSTREAM }}"
+    out = []
+
+    if opts["release_upstream"] is None:
+        out.append(_block("upstream {{ UPSTREAM }}", ["{{ UPSTREAM_SERVERS }}"]))
+    out.append(_block("map $http_upgrade ${{ UPSTREAM }}_connection", [
+        "default upgrade;",
+        "'' '';",
+    ]))
+    if cache:
+        out.append(
+            f"proxy_cache_path {opts['cache_dir']}/{{{{ DOMAIN_FULL }}}} levels=1:2"
+            f" keys_zone={{{{ UPSTREAM }}}}_cache:10m max_size={opts['cache_max_size']}"
+            " inactive=60m use_temp_path=off;\n"
+        )
+
+    server = [
+        "listen 80;",
+        "listen [::]:80;",
+        "server_name {{ DOMAIN_FULL }};",
+    ]
+    if opts["http2"]:
+        # Applies to the `listen 443 ssl` certbot adds (nginx 1.25.1+)
+        server.append("http2 on;")
+    server += [""] + _compression(opts) + [""]
+
+    static = [f"proxy_pass http://{upstream};"] + _proxy_headers() + [
+        "proxy_hide_header Cache-Control;",
+        f'add_header Cache-Control "public, max-age={opts["static_max_age"]}, immutable" always;',
+        "access_log off;",
+    ]
+    if cache:
+        static += [
+            "proxy_cache {{ UPSTREAM }}_cache;",
+            f"proxy_cache_valid 200 {opts['static_max_age']}s;",
+        ]
+    server.append(_block("location /_next/static/", static))
+    server.append("")
+
+    pages = [f"proxy_pass http://{upstream};"] + _proxy_headers()
+    if cache:
+        # Next.js sends s-maxage/stale-while-revalidate for ISR pages and
+        # no-store for dynamic ones, so only cacheable pages land here
+        pages += [
+            "proxy_cache {{ UPSTREAM }}_cache;",
+            "proxy_cache_key $scheme$host$request_uri$http_rsc;",
+            f"proxy_cache_valid 200 {opts['cache_valid']};",
+            "proxy_cache_use_stale error timeout updating http_500 http_502 http_503 http_504;",
+            "proxy_cache_background_update on;",
+            "proxy_cache_lock on;",
+            "proxy_cache_bypass $cookie___prerender_bypass $cookie___next_preview_data;",
+            "proxy_no_cache $cookie___prerender_bypass $cookie___next_preview_data;",
+            "add_header X-Cache-Status $upstream_cache_status always;",
+        ]
+    server.append(_block("location /", pages))
+
+    out.append(_block("server", server))
+    return "\n".join(out)
+
+
+# Template for the configured profile, or None for a plain template file
+def template_for(config):
+    profile = config.get("NGINX_PROFILE", "template")
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown NGINX_PROFILE '{profile}' (expected one of {', '.join(PROFILES)})")
+    if profile == "template":
+        return None
+    return nginx_sites.Template(render_profile(config))
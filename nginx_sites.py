@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Nginx site generation for nginx-ssl-setup.py
+#
+# Templates use explicit {{ NAME }} placeholders and are parsed once per
+# run. The hash of what was last rendered for a site is kept next to it
+# (sites-available/.rendered/<site>.sha256) and compared with the new
+# rendering, so certbot's edits to the file itself don't count as a
+# change; only sites whose rendering changed are written (atomically)
+# and enabled. A site certbot manages is not overwritten (that would
+# drop its SSL server blocks) unless overwrite_certbot is set.
+# `nginx -t` runs once and nginx reloads once, and neither happens when
+# nothing changed. If nginx rejects the result, every file and symlink
+# is put back the way it was before the batch.
+# ----------------------------------------------------------------
+
+import hashlib
+import os
+import re
+import subprocess
+import threading
+
+import instances
+import runner
+
+PLACEHOLDER = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+# Old-style templates with bare SUBDOMAIN.DOMAIN / PORT tokens. PORT is
+# only replaced as a value: after a ':' (proxy_pass http://127.0.0.1:PORT)
+# or as a whole argument (listen PORT;), so X-Forwarded-PORT and
+# $http_x_forwarded_PORT are left alone.
+LEGACY_TOKENS = re.compile(r"\bSUBDOMAIN\.DOMAIN\b|(?<=[:\s])PORT(?=[\s;/]|$)")
+LEGACY_NAMES = {"SUBDOMAIN.DOMAIN": "DOMAIN_FULL", "PORT": "PORT"}
+
+
+class Template:
+    def __init__(self, text):
+        pattern = PLACEHOLDER if PLACEHOLDER.search(text) else LEGACY_TOKENS
+        self.legacy = pattern is LEGACY_TOKENS
+        # Alternating literal text and placeholder names
+        self.parts = []
+        position = 0
+        for match in pattern.finditer(text):
+            self.parts.append(text[position:match.start()])
+            self.parts.append(LEGACY_NAMES[match.group(0)] if self.legacy else match.group(1))
+            position = match.end()
+        self.parts.append(text[position:])
+        self.names = set(self.parts[1::2])
+
+    def render(self, values):
+        missing = sorted(name for name in self.names if name not in values)
+        if missing:
+            raise ValueError(f"Template placeholders with no value: {', '.join(missing)}")
+        return "".join(
+            part if index % 2 == 0 else str(values[part]) for index, part in enumerate(self.parts)
+        )
+
+
+_templates = {}
+
+
+# Parsed template for a path, cached until the file changes
+def load_template(path):
+    mtime = os.stat(path).st_mtime_ns
+    cached = _templates.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r") as template_file:
+            cached = (mtime, Template(template_file.read()))
+        _templates[path] = cached
+    return cached[1]
+
+
+# Placeholder values for one site: every app.conf key, plus the site's
+# own SUBDOMAIN, DOMAIN, DOMAIN_FULL, PORT, an UPSTREAM name that is
+# safe to use in nginx identifiers, and UPSTREAM_SERVERS, the body of an
+# upstream block covering every PM2 instance
+def site_values(config, site):
+    values = dict(config)
+    servers = instances.upstream_lines(
+        instances.ports_for(config, site["port"]), int(config.get("NGINX_KEEPALIVE", "32"))
+    )
+    values.update({
+        "SUBDOMAIN": site["subdomain"],
+        "DOMAIN": site["domain"],
+        "DOMAIN_FULL": site["domain_full"],
+        "PORT": site["port"],
+        "UPSTREAM": re.sub(r"[^A-Za-z0-9_]", "_", site["domain_full"]),
+        "UPSTREAM_SERVERS": "\n    ".join(servers),
+    })
+    return values
+
+
+# Sites file: one site per line, "<subdomain> <port> [domain]". The
+# domain defaults to DOMAIN from app.conf. Blank lines and # comments
+# are ignored.
+def read_sites(path, default_domain):
+    sites = []
+    with open(path, "r") as sites_file:
+        for number, line in enumerate(sites_file, start=1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            fields = line.split()
+            if len(fields) not in (2, 3) or not fields[1].isdigit():
+                raise ValueError(f"{path}:{number}: expected '<subdomain> <port> [domain]', got '{line}'")
+            domain = fields[2] if len(fields) == 3 else default_domain
+            sites.append({"subdomain": fields[0], "domain": domain, "domain_full": f"{fields[0]}.{domain}", "port": fields[1]})
+    return sites
+
+
+def _tmp_name(path):
+    return f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+
+
+def write_atomic(path, content):
+    tmp_path = _tmp_name(path)
+    with open(tmp_path, "w") as new_file:
+        new_file.write(content)
+    os.replace(tmp_path, path)
+
+
+def link_atomic(target, link_path):
+    tmp_path = _tmp_name(link_path)
+    os.symlink(target, tmp_path)
+    os.replace(tmp_path, link_path)
+
+
+CERTBOT_MARKER = "# managed by Certbot"
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Where the hash of a site's last rendering is kept
+def rendered_hash_path(available_path):
+    return os.path.join(os.path.dirname(available_path), ".rendered", f"{os.path.basename(available_path)}.sha256")
+
+
+def _read_text(path):
+    try:
+        with open(path, "r") as text_file:
+            return text_file.read()
+    except OSError:
+        return None
+
+
+def record_rendered(available_path, content):
+    hash_path = rendered_hash_path(available_path)
+    os.makedirs(os.path.dirname(hash_path), exist_ok=True)
+    write_atomic(hash_path, _digest(content.encode()) + "\n")
+
+
+# Write a site config and remember what it was rendered from
+def write_site(available_path, content):
+    write_atomic(available_path, content)
+    record_rendered(available_path, content)
+
+
+def managed_by_certbot(available_path):
+    current = _read_text(available_path)
+    return current is not None and CERTBOT_MARKER in current
+
+
+# True when this content was the last rendering written for the site,
+# the file is still there and it is enabled through a symlink to it.
+# Sites written before the hash was kept are compared by content.
+def is_current(available_path, enabled_path, content):
+    current = _read_text(available_path)
+    if current is None:
+        return False
+    recorded = _read_text(rendered_hash_path(available_path))
+    if recorded is not None:
+        if recorded.strip() != _digest(content.encode()):
+            return False
+    elif _digest(current.encode()) != _digest(content.encode()):
+        return False
+    try:
+        return os.readlink(enabled_path) == available_path
+    except OSError:
+        return False
+
+
+# What a path looks like now, so it can be put back exactly
+def _snapshot(path):
+    if os.path.islink(path):
+        return ("link", os.readlink(path))
+    if os.path.isfile(path):
+        with open(path, "r") as current_file:
+            return ("file", current_file.read())
+    return None
+
+
+def _restore(path, snapshot):
+    if snapshot is None:
+        if os.path.lexists(path):
+            os.remove(path)
+    elif snapshot[0] == "link":
+        link_atomic(snapshot[1], path)
+    else:
+        write_atomic(path, snapshot[1])
+
+
+# Write {domain_full: config text} into sites-available and enable each
+# site whose config changed, then validate once and reload once. Changed
+# sites certbot manages are kept as they are unless overwrite_certbot.
+# On a failed `nginx -t` all files are rolled back and the
+# CalledProcessError is raised again, with nginx's output in its stderr.
+# Returns {"written": [...], "unchanged": [...], "kept": [...]}.
+def apply(rendered, available_dir, enabled_dir, report=print, overwrite_certbot=False):
+    changed = {}
+    unchanged = []
+    kept = []
+    for domain_full, content in rendered.items():
+        available_path = os.path.join(available_dir, domain_full)
+        if is_current(available_path, os.path.join(enabled_dir, domain_full), content):
+            if not os.path.exists(rendered_hash_path(available_path)):
+                # Written before the hash was kept; from now on certbot's
+                # edits to it don't count as a change
+                record_rendered(available_path, content)
+            unchanged.append(domain_full)
+        elif managed_by_certbot(available_path) and not overwrite_certbot:
+            kept.append(domain_full)
+        else:
+            changed[domain_full] = content
+    if kept:
+        report(f"Not overwriting {len(kept)} changed site configs that certbot manages "
+               f"(their SSL blocks would be lost): {', '.join(kept)}")
+    if not changed:
+        report(f"All {len(unchanged)} other site configs are unchanged; nothing written, nginx not reloaded."
+               if kept else f"All {len(unchanged)} site configs are unchanged; nothing written, nginx not reloaded.")
+        return {"written": [], "unchanged": unchanged, "kept": kept}
+
+    snapshots = {}
+    for domain_full in changed:
+        available_path = os.path.join(available_dir, domain_full)
+        for path in (available_path, rendered_hash_path(available_path), os.path.join(enabled_dir, domain_full)):
+            snapshots[path] = _snapshot(path)
+
+    try:
+        for domain_full, content in changed.items():
+            available_path = os.path.join(available_dir, domain_full)
+            write_site(available_path, content)
+            link_atomic(available_path, os.path.join(enabled_dir, domain_full))
+        report(f"Wrote {len(changed)} site configs ({len(unchanged)} unchanged); validating with nginx -t...")
+        runner.run(["nginx", "-t"], check=True, capture_output=True, text=True)
+    except (OSError, subprocess.SubprocessError):
+        report("Rolling back every site config written by this batch...")
+        for path, snapshot in snapshots.items():
+            _restore(path, snapshot)
+        raise
+
+    runner.run(["systemctl", "reload", "nginx"], check=True)
+    report("nginx reloaded once for the whole batch.")
+    return {"written": list(changed), "unchanged": unchanged, "kept": kept}
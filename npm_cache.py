@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Lockfile-keyed node_modules store for Part 5 of deploy.py
+#
+# Entries live under NPM_STORE_DIR/<key>/node_modules where key is the
+# sha256 of package-lock.json plus the Node version. A hit is copied
+# into the new checkout as a reflink (copy-on-write, near instant on
+# btrfs/XFS) or a plain copy elsewhere; a miss runs `npm ci` and files a
+# copy of the result in the store. Trees never share inodes with the
+# store, so postinstall scripts, `npm rebuild` or node_modules/.cache
+# writes in one tree can't change the store or any other tree.
+# The store is kept under NPM_STORE_MAX_MB by evicting the least
+# recently used entries.
+# ----------------------------------------------------------------
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import runner
+
+
+def store_dir_for(config):
+    return config.get("NPM_STORE_DIR", os.path.join(config["DEPLOYMENT_ROOT"], ".npm-store"))
+
+
+def node_version():
+    result = runner.run(["node", "--version"], check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+# Store key for an app folder, or None when there is no lockfile to key on
+def store_key(app_root, node):
+    lockfile = os.path.join(app_root, "package-lock.json")
+    if not os.path.exists(lockfile):
+        return None
+    digest = hashlib.sha256()
+    with open(lockfile, "rb") as lock:
+        for block in iter(lambda: lock.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(node.encode())
+    return digest.hexdigest()
+
+
+# Copying from the store takes a shared lock; eviction takes it
+# exclusively so an entry never disappears halfway through a copy
+@contextmanager
+def store_lock(store_dir, exclusive):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def tree_size(path):
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+# Copy a tree as reflinks where the filesystem can, else as a plain
+# copy. Returns which one it was.
+def copy_tree(src, dest):
+    result = runner.run(["cp", "-a", "--reflink=always", src, dest], capture_output=True, text=True)
+    if result.returncode != 0:
+        shutil.rmtree(dest, ignore_errors=True)
+        runner.run(["cp", "-a", src, dest], check=True, capture_output=True, text=True)
+        return "copy"
+    return "reflink"
+
+
+def _meta_path(entry):
+    return os.path.join(entry, "meta.json")
+
+
+def read_meta(entry):
+    try:
+        with open(_meta_path(entry), "r") as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+# Written whole and renamed over, since readers only hold a shared lock
+def write_meta(entry, meta):
+    tmp_path = f"{_meta_path(entry)}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(tmp_path, _meta_path(entry))
+
+
+# Drop least recently used entries until the store fits in max_bytes
+def evict(store_dir, max_bytes, keep_key=None):
+    entries = []
+    for key in os.listdir(store_dir):
+        entry = os.path.join(store_dir, key)
+        meta = read_meta(entry)
+        if meta is None:
+            # Half-written or foreign folder; it holds no usable entry
+            if not key.startswith("."):
+                shutil.rmtree(entry, ignore_errors=True)
+            continue
+        entries.append((meta.get("last_used", 0), key, meta.get("size", 0)))
+
+    total = sum(size for _used, _key, size in entries)
+    evicted = []
+    for _used, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key == keep_key:
+            continue
+        shutil.rmtree(os.path.join(store_dir, key), ignore_errors=True)
+        total -= size
+        evicted.append(key)
+    return evicted
+
+
+# Populate app_root/node_modules from the store or with `npm ci`.
+# Returns a dict describing what happened, for the deploy log.
+def install(config, app_root):
+    store_dir = store_dir_for(config)
+    max_bytes = int(config.get("NPM_STORE_MAX_MB", "10240")) * 1024 * 1024
+    key = store_key(app_root, node_version())
+    target = os.path.join(app_root, "node_modules")
+
+    if key is None:
+        runner.run(["npm", "install"], cwd=app_root, check=True)
+        return {"result": "no-lockfile", "key": None}
+
+    entry = os.path.join(store_dir, key)
+    with store_lock(store_dir, exclusive=False):
+        meta = read_meta(entry)
+        if meta is not None:
+            shutil.rmtree(target, ignore_errors=True)
+            method = copy_tree(os.path.join(entry, "node_modules"), target)
+            meta["last_used"] = time.time()
+            write_meta(entry, meta)
+            return {"result": "hit", "key": key, "method": method}
+
+    runner.run(["npm", "ci"], cwd=app_root, check=True)
+
+    # File the fresh tree in the store; rename makes the entry appear
+    # atomically so a concurrent deploy never sees a partial one
+    os.makedirs(store_dir, exist_ok=True)
+    staging = os.path.join(store_dir, f".tmp-{key}-{os.getpid()}-{threading.get_ident()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    copy_tree(target, os.path.join(staging, "node_modules"))
+    now = time.time()
+    write_meta(staging, {"size": tree_size(staging), "created": now, "last_used": now})
+    try:
+        os.rename(staging, entry)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    with store_lock(store_dir, exclusive=True):
+        evicted = evict(store_dir, max_bytes, keep_key=key)
+    return {"result": "miss", "key": key, "evicted": evicted}
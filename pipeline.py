@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Small dependency-graph runner for deploy steps
+#
+# Each Step names the steps it depends on. Steps whose dependencies are
+# done run concurrently on a thread pool. When a step fails, nothing new
+# is started. Steps already running are allowed to finish, and the rest
+# are reported as "not run". Every step's wall-clock time is recorded.
+# ----------------------------------------------------------------
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class StepFailed(Exception):
+    pass
+
+
+class Step:
+    # prompt:   question asked up front in interactive mode
+    # required: declining the prompt aborts the whole run instead of
+    #           skipping just this step
+    # resource: "network" or "cpu"; run() can cap how many steps of a
+    #           kind run at once, across several graphs sharing limits
+    def __init__(self, name, run, deps=(), prompt=None, required=False, resource=None):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.prompt = prompt
+        self.required = required
+        self.resource = resource
+
+
+# Raise ValueError on unknown dependencies or cycles; return step names
+# in a dependency-respecting order
+def check_graph(steps):
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        for dep in step.deps:
+            if dep not in by_name:
+                raise ValueError(f"Step '{step.name}' depends on unknown step '{dep}'")
+    order, done, visiting = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through step '{name}'")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for step in steps:
+        visit(step.name)
+    return order
+
+
+# Run the graph. `skip` holds steps that count as done without running
+# (declined prompts or steps completed by an earlier, resumed run).
+# on_done(name, result) is called as each step settles. limits maps a
+# resource name to a semaphore that steps of that kind hold while they
+# run; the time spent waiting for it is not counted as step time. Returns
+# {name: {"status", "seconds", "error"}} with status one of ok, failed,
+# skipped, resumed or "not run".
+def run(steps, workers=4, skip=None, on_done=None, report=print, limits=None):
+    check_graph(steps)
+    skip = skip or {}
+    by_name = {step.name: step for step in steps}
+    results = {}
+    for name, status in skip.items():
+        if name in by_name:
+            results[name] = {"status": status, "seconds": 0.0, "error": None}
+
+    pending = [step for step in steps if step.name not in results]
+    running = {}
+    failed = False
+
+    def settled_ok(name):
+        return name in results and results[name]["status"] in ("ok", "skipped", "resumed")
+
+    def timed(step):
+        limit = (limits or {}).get(step.resource)
+        if limit is not None:
+            limit.acquire()
+        started = time.monotonic()
+        try:
+            step.run()
+            return {"status": "ok", "seconds": time.monotonic() - started, "error": None}
+        except Exception as e:
+            return {"status": "failed", "seconds": time.monotonic() - started, "error": str(e) or repr(e)}
+        finally:
+            if limit is not None:
+                limit.release()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while pending or running:
+            if not failed:
+                for step in [step for step in pending if all(settled_ok(dep) for dep in step.deps)]:
+                    pending.remove(step)
+                    report(f"\n>>> Starting step '{step.name}'")
+                    running[pool.submit(timed, step)] = step
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                results[step.name] = future.result()
+                if results[step.name]["status"] == "failed":
+                    failed = True
+                    report(f"<<< Step '{step.name}' failed: {results[step.name]['error']}")
+                else:
+                    report(f"<<< Step '{step.name}' done in {results[step.name]['seconds']:.1f}s")
+                if on_done:
+                    on_done(step.name, results[step.name])
+
+    for step in pending:
+        results[step.name] = {"status": "not run", "seconds": 0.0, "error": None}
+    return results
+
+
+# Table of per-step wall-clock timings, in graph order
+def format_timings(steps, results, total_seconds=None):
+    width = max(len(name) for name in results) if results else 4
+    lines = [f"{'STEP':<{width}}  {'STATUS':<8}  {'SECONDS':>8}"]
+    for name in check_graph(steps):
+        if name in results:
+            lines.append(f"{name:<{width}}  {results[name]['status']:<8}  {results[name]['seconds']:>8.1f}")
+    if total_seconds is not None:
+        lines.append(f"{'total':<{width}}  {'':<8}  {total_seconds:>8.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Incremental deploys from the git diff between releases
+# (PLAN="incremental" in app.conf; python3 deploy.py --plan for a dry run)
+#
+# Every successful deploy records the commit it put live, with the node
+# version, the .env.local hash and NEXT_OUTPUT, in
+# DEPLOYMENT_ROOT/APP_NAME_PM2/deployed.json. The next deploy diffs that
+# commit against the target:
+# - package-lock.json unchanged (same node version): npm install is
+#   skipped and the live node_modules is copied into the new tree;
+# - additionally only files matching PLAN_IGNORE changed and .env.local
+#   and NEXT_OUTPUT are the same: npm run build is skipped too and the
+#   live .next (without its cache) is copied over.
+# Anything the planner can't establish (no record, history not
+# reachable, a standalone or missing live tree) means a full deploy.
+# ----------------------------------------------------------------
+
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import git_cache
+import npm_cache
+import releases
+import runner
+
+DEFAULT_IGNORE = "*.md,docs/*,.github/*,LICENSE*,.gitignore,.vscode/*"
+
+
+def enabled(config):
+    return config.get("PLAN", "full") == "incremental"
+
+
+def record_path(config):
+    return os.path.join(releases.app_base(config), "deployed.json")
+
+
+def _sha256_file(path):
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_record(config):
+    try:
+        with open(record_path(config), "r") as record_file:
+            return json.load(record_file)
+    except (OSError, ValueError):
+        return None
+
+
+# Remember what was just put live
+def record(config, commit_sha, env_path, node):
+    path = record_path(config)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as record_file:
+        json.dump({
+            "commit": commit_sha, "node": node, "env": _sha256_file(env_path),
+            "next_output": config.get("NEXT_OUTPUT", "server"), "time": time.time(),
+        }, record_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+# After a rollback the live tree no longer matches the record
+def forget(config):
+    try:
+        os.remove(record_path(config))
+    except FileNotFoundError:
+        pass
+
+
+def _has_commit(repo_dir, sha):
+    return runner.run(["git", "-C", repo_dir, "cat-file", "-e", f"{sha}^{{commit}}"], capture_output=True).returncode == 0
+
+
+# Files that differ between two commits, fetching either one into
+# repo_dir if it isn't there (a shallow clone only has the target)
+def changed_files(repo_dir, repo_url, old, new):
+    for sha in (old, new):
+        if not _has_commit(repo_dir, sha):
+            shallow = runner.run(
+                ["git", "-C", repo_dir, "rev-parse", "--is-shallow-repository"], check=True, capture_output=True, text=True
+            ).stdout.strip() == "true"
+            runner.run(
+                ["git", "-C", repo_dir, "fetch", "--quiet"] + (["--depth=1"] if shallow else []) + [repo_url, sha],
+                check=True, capture_output=True
+            )
+    result = runner.run(["git", "-C", repo_dir, "diff", "--name-only", old, new], check=True, capture_output=True, text=True)
+    return [line for line in result.stdout.splitlines() if line]
+
+
+def ignore_patterns(config):
+    return [pattern.strip() for pattern in config.get("PLAN_IGNORE", DEFAULT_IGNORE).split(",") if pattern.strip()]
+
+
+# Decide what the deploy of target_sha can skip. repo_dir is any
+# checkout with git history (the new tree, or the live one for a dry
+# run); live_root is the tree currently serving.
+def plan(config, repo_dir, target_sha, live_root, env_path, node):
+    decision = {"old": None, "new": target_sha, "changed": [], "build_inputs": [],
+                "install": True, "build": True, "reasons": []}
+
+    def full(reason):
+        decision["reasons"].append(reason)
+        return decision
+
+    previous = load_record(config)
+    if previous is None:
+        return full("no record of the deployed commit: full deploy")
+    decision["old"] = previous["commit"]
+    if not live_root or not os.path.isdir(os.path.join(live_root, "node_modules")):
+        return full("the live tree has no node_modules to reuse: full deploy")
+    if os.path.isfile(os.path.join(live_root, "server.js")):
+        return full("the live tree is a standalone server without dev dependencies: full deploy")
+    if previous["node"] != node:
+        return full(f"node changed from {previous['node']} to {node}: full deploy")
+    try:
+        decision["changed"] = changed_files(repo_dir, config["REPO_URL"], previous["commit"], target_sha)
+    except (OSError, subprocess.SubprocessError) as e:
+        return full(f"can't diff {previous['commit'][:12]}..{target_sha[:12]} ({e}): full deploy")
+
+    if "package-lock.json" in decision["changed"]:
+        return full("package-lock.json changed: npm install and build")
+    decision["install"] = False
+    decision["reasons"].append("package-lock.json unchanged: reuse the live node_modules")
+
+    ignored = ignore_patterns(config)
+    decision["build_inputs"] = [
+        path for path in decision["changed"] if not any(fnmatch.fnmatch(path, pattern) for pattern in ignored)
+    ]
+    if decision["build_inputs"]:
+        shown = ", ".join(decision["build_inputs"][:5]) + (" ..." if len(decision["build_inputs"]) > 5 else "")
+        decision["reasons"].append(f"{len(decision['build_inputs'])} build inputs changed ({shown}): build")
+    elif _sha256_file(env_path) != previous["env"]:
+        decision["reasons"].append(".env.local changed (NEXT_PUBLIC_* values are built in): build")
+    elif config.get("NEXT_OUTPUT", "server") != previous["next_output"]:
+        decision["reasons"].append("NEXT_OUTPUT changed: build")
+    elif not os.path.isfile(os.path.join(live_root, ".next", "BUILD_ID")):
+        decision["reasons"].append("the live tree has no build output to reuse: build")
+    else:
+        decision["build"] = False
+        decision["reasons"].append(
+            f"only files matching PLAN_IGNORE changed ({len(decision['changed'])}): reuse the live .next"
+        )
+    return decision
+
+
+# Copy what the plan reuses from live_root into app_root (reflinks
+# where the filesystem has them). Not hardlinks: the live app writes
+# into .next (ISR pages) and tools write into node_modules, and a shared
+# inode would carry those writes into the other tree.
+def reuse(decision, live_root, app_root):
+    reused = []
+    if not decision["install"]:
+        target = os.path.join(app_root, "node_modules")
+        shutil.rmtree(target, ignore_errors=True)
+        npm_cache.copy_tree(os.path.join(live_root, "node_modules"), target)
+        reused.append("node_modules")
+    if not decision["build"]:
+        # .next/cache is left for BUILD_CACHE to carry over
+        os.makedirs(os.path.join(app_root, ".next"), exist_ok=True)
+        for name in os.listdir(os.path.join(live_root, ".next")):
+            if name != "cache":
+                npm_cache.copy_tree(os.path.join(live_root, ".next", name), os.path.join(app_root, ".next", name))
+        reused.append(".next")
+    return reused
+
+
+def report(decision):
+    old = decision["old"][:12] if decision["old"] else "(unknown)"
+    lines = [f"Deploy plan {old} -> {decision['new'][:12]}: {len(decision['changed'])} files changed"]
+    lines += [f"  - {reason}" for reason in decision["reasons"]]
+    lines.append(f"  npm install: {'run' if decision['install'] else 'skip'}")
+    lines.append(f"  npm build:   {'run' if decision['build'] else 'skip'}")
+    return "\n".join(lines)
+
+
+# --plan: what a deploy would do now, using the live tree's git history
+def dry_run(config, env_path):
+    app_root = os.path.join(config["DEPLOYMENT_ROOT"], config["APP_NAME_PM2"], config["APP_NAME_GITHUB"])
+    live_root = app_root
+    if config.get("DEPLOY_MODE", "inplace") == "release":
+        live_root = releases.load_state(config)["release"] or app_root
+    target_sha = git_cache.remote_sha(config)
+    if not os.path.exists(os.path.join(live_root, ".git")):
+        decision = {"old": (load_record(config) or {}).get("commit"), "new": target_sha, "changed": [],
+                    "install": True, "build": True,
+                    "reasons": [f"{live_root} has no git history to diff against: full deploy"]}
+        return report(decision)
+    return report(plan(config, live_root, target_sha, live_root, env_path, npm_cache.node_version()))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# PM2 process table, read once from `pm2 jlist`
+#
+# table() fetches the JSON process list and keeps it until something is
+# started, stopped or deleted through this module (or refresh() is
+# called), so any number of lookups cost one PM2 round-trip. Lookups
+# match names exactly; an app started in ports mode is found through
+# its namespace, which instances.py names after the app.
+#
+# stop(), restart() and delete() take many names and act on the ones
+# that exist in a single pm2 call.
+#
+#   python3 pm2.py status NAME...    online / stopped / errored / missing
+#   python3 pm2.py stop NAME...
+#   python3 pm2.py delete NAME...
+#   python3 pm2.py list
+# ----------------------------------------------------------------
+
+import json
+import subprocess
+import sys
+import threading
+
+import runner
+
+_lock = threading.Lock()
+_table = None
+
+
+def _parse(output):
+    # pm2 may print notices (update available, daemon spawned) before
+    # the JSON array, which is always the last line
+    for line in reversed(output.splitlines()):
+        line = line.strip()
+        if line.startswith("["):
+            return json.loads(line)
+    raise ValueError("pm2 jlist printed no process list")
+
+
+def _entry(process):
+    env = process.get("pm2_env", {})
+    monit = process.get("monit", {})
+    return {
+        "name": process.get("name"),
+        "namespace": env.get("namespace", "default"),
+        "pm_id": process.get("pm_id"),
+        "status": env.get("status"),
+        "pid": process.get("pid") or None,
+        "memory": monit.get("memory", 0),
+        "cpu": monit.get("cpu", 0),
+    }
+
+
+# Every PM2 process as a dict with name, namespace, pm_id, status, pid,
+# memory (bytes) and cpu (percent)
+def table(refresh=False):
+    global _table
+    with _lock:
+        if _table is None or refresh:
+            result = runner.run(["pm2", "jlist"], check=True, capture_output=True, text=True)
+            _table = [_entry(process) for process in _parse(result.stdout)]
+        return list(_table)
+
+
+def refresh():
+    return table(refresh=True)
+
+
+def _invalidate():
+    global _table
+    with _lock:
+        _table = None
+
+
+# Processes of the app `name`: the process called exactly that, or
+# every instance in the namespace of that name
+def find(name):
+    return [process for process in table() if process["name"] == name or process["namespace"] == name]
+
+
+def exists(name):
+    return bool(find(name))
+
+
+# "online" when every instance is, else the first other status; None
+# when there is no such process
+def status(name):
+    processes = find(name)
+    if not processes:
+        return None
+    for process in processes:
+        if process["status"] != "online":
+            return process["status"]
+    return "online"
+
+
+def pids(name):
+    return [process["pid"] for process in find(name) if process["pid"]]
+
+
+def memory(name):
+    return sum(process["memory"] for process in find(name))
+
+
+def cpu(name):
+    return sum(process["cpu"] for process in find(name))
+
+
+# Run `pm2 <action>` once for every name that exists. Returns the names
+# acted on; missing names are left out instead of failing the call.
+def _batch(action, names, check):
+    present = [name for name in dict.fromkeys(names) if exists(name)]
+    if present:
+        try:
+            runner.run(["pm2", action] + present, check=check, capture_output=True, text=True)
+        finally:
+            _invalidate()
+    return present
+
+
+def stop(names, check=False):
+    return _batch("stop", names, check)
+
+
+def restart(names, check=False):
+    return _batch("restart", names, check)
+
+
+def delete(names, check=False):
+    return _batch("delete", names, check)
+
+
+def save():
+    runner.run(["pm2", "save"], capture_output=True, text=True)
+
+
+# Called after anything this module didn't run changed PM2's table
+def changed():
+    _invalidate()
+
+
+if __name__ == "__main__":
+    action, names = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else (None, [])
+    if action == "status" and names:
+        for name in names:
+            print(f"{name} {status(name) or 'missing'}")
+    elif action in ("stop", "delete") and names:
+        try:
+            done = stop(names, check=True) if action == "stop" else delete(names, check=True)
+        except subprocess.CalledProcessError as e:
+            print(f"Error: pm2 {action} failed: {(e.stderr or '').strip() or e}")
+            sys.exit(1)
+        past = {"stop": "stopped", "delete": "deleted"}[action]
+        for name in names:
+            if name in done:
+                print(f"PM2 process '{name}' {past} successfully.")
+            else:
+                print(f"PM2 process '{name}' is not running.")
+    elif action == "list":
+        rows = table()
+        width = max([len("NAME")] + [len(process["name"]) for process in rows])
+        print(f"{'NAME':<{width}}  {'NAMESPACE':<12}  {'STATUS':<10}  {'PID':>7}  {'MEMORY':>8}  {'CPU':>4}")
+        for process in rows:
+            print(f"{process['name']:<{width}}  {process['namespace']:<12}  {process['status']:<10}"
+                  f"  {process['pid'] or '-':>7}  {process['memory'] / 1048576:>6.0f}MB  {process['cpu']:>3}%")
+    else:
+        print("Usage: python3 pm2.py status|stop|delete NAME... | list")
+        sys.exit(2)
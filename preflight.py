@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Preflight checks, all run at once before anything is changed
+#
+#   python3 preflight.py                  what deploy.py checks
+#   python3 preflight.py --for nginx      what nginx-ssl-setup.py checks
+#
+# Every check answers ok, warn or fail with one line of detail:
+#   config   required app.conf keys are set, numbers are numbers, modes
+#            are known
+#   env      the .env.local to copy (ENV_FILE) exists
+#   tools    pm2, git, npm and nginx are on the PATH
+#   port     the port(s) the new instance will listen on are free; in
+#            place, a port held by the app being redeployed (its PM2
+#            pids or their children) is fine
+#   disk     at least PREFLIGHT_MIN_FREE_MB (default 1024) free in
+#            DEPLOYMENT_ROOT and BACKUP_DIR
+#   nginx    `nginx -t` accepts the current configuration
+#   dns      SUBDOMAIN.DOMAIN has an A record pointing at this host
+#
+# Each check runs in its own thread and all of them share one deadline,
+# PREFLIGHT_TIMEOUT seconds (default 5), so the stage takes as long as
+# the slowest check: about a second. DNS is asked of DNS_RESOLVER
+# (host or host:port; default the first nameserver in /etc/resolv.conf)
+# directly, so /etc/hosts and local caches can't hide a missing record,
+# and a local stub resolver can stand in for the real one. This host's
+# addresses come from `hostname -I`; behind NAT, list the public ones in
+# PUBLIC_IPS. What deploy.py doesn't depend on (DNS, and nginx outside
+# release mode) only warns there.
+# ----------------------------------------------------------------
+
+import argparse
+import os
+import random
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import artifacts
+import instances
+import pm2
+import releases
+import runner
+
+PURPOSES = ("deploy", "nginx")
+
+REQUIRED_KEYS = {
+    "deploy": ["DEPLOYMENT_ROOT", "APP_NAME_PM2", "APP_NAME_GITHUB", "REPO_URL", "PORT", "BACKUP_DIR"],
+    "nginx": ["SUBDOMAIN", "DOMAIN", "PORT", "NGINX_AVAILABLE_DIR", "NGINX_ENABLED_DIR"],
+}
+PORT_KEYS = ["PORT", "ALT_PORT"]
+NUMBER_KEYS = [
+    "HEALTH_CHECK_TIMEOUT", "DEPLOY_WORKERS", "DEPLOY_STEP_TIMEOUT", "RELEASES_KEEP", "BACKUP_KEEP",
+    "ARTIFACT_KEEP", "PREFLIGHT_TIMEOUT", "PREFLIGHT_MIN_FREE_MB",
+]
+CHOICES = {
+    "DEPLOY_MODE": ("inplace", "release"),
+    "GIT_CHECKOUT": ("clone", "shallow", "worktree"),
+    "NPM_INSTALL": ("install", "store"),
+    "BACKUP_MODE": ("archive", "repository"),
+    "BUILD_CACHE": ("off", "keep"),
+    "NEXT_OUTPUT": ("server", "standalone"),
+    "PLAN": ("full", "incremental"),
+    "WARMUP": ("on", "off"),
+    "PROBE": ("on", "off"),
+}
+TOOLS = {"deploy": ["pm2", "git", "npm", "nginx"], "nginx": ["nginx"]}
+DEADLINE_GRACE = 0.5
+
+
+def _release_mode(config):
+    return config.get("DEPLOY_MODE", "inplace") == "release"
+
+
+def _timeout(config):
+    return float(config.get("PREFLIGHT_TIMEOUT", "5"))
+
+
+# ----------------------------------------------------------------
+# The checks: each takes (config, purpose) and returns (status, detail)
+# ----------------------------------------------------------------
+def check_config(config, purpose):
+    problems = [f"{key} is not set" for key in REQUIRED_KEYS[purpose] if not config.get(key)]
+    for key in PORT_KEYS:
+        value = config.get(key)
+        if value and not (value.isdigit() and 0 < int(value) < 65536):
+            problems.append(f"{key}={value} is not a port")
+    for key in NUMBER_KEYS + [key for key in config if key.startswith("STEP_TIMEOUT_")]:
+        value = config.get(key)
+        try:
+            if value is not None and float(value) < 0:
+                raise ValueError
+        except ValueError:
+            problems.append(f"{key}={value} is not a number")
+    for key, choices in CHOICES.items():
+        if key in config and config[key] not in choices:
+            problems.append(f"{key}={config[key]} (expected one of {', '.join(choices)})")
+    for mode_of in (instances.mode_of, artifacts.mode_of):
+        try:
+            mode_of(config)
+        except ValueError as e:
+            problems.append(str(e))
+    if problems:
+        return "fail", "; ".join(problems)
+    return "ok", f"{len(config)} keys"
+
+
+# env_path is the caller's resolved ENV_FILE (deploy.py's default lives there)
+def check_env(config, purpose, env_path=None):
+    path = env_path or config.get("ENV_FILE")
+    if not path:
+        return "fail", "no .env.local path given (set ENV_FILE)"
+    if not os.path.isfile(path):
+        return "fail", f"{path} not found"
+    return "ok", path
+
+
+def check_tools(config, purpose):
+    missing = [tool for tool in TOOLS[purpose] if shutil.which(tool) is None]
+    if not missing:
+        return "ok", ", ".join(TOOLS[purpose])
+    # Deploying in place never touches nginx
+    if missing == ["nginx"] and purpose == "deploy" and not _release_mode(config):
+        return "warn", "nginx not on the PATH (only needed for DEPLOY_MODE=release)"
+    return "fail", f"not on the PATH: {', '.join(missing)}"
+
+
+def port_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe_socket:
+        # Sockets in TIME_WAIT don't stop a new server from listening
+        probe_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            probe_socket.bind(("0.0.0.0", int(port)))
+        except OSError:
+            return False
+    return True
+
+
+# Inodes of the sockets listening on port, from /proc/net/tcp{,6}
+def _listening_inodes(port):
+    inodes = set()
+    for table_path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table_path) as table_file:
+                next(table_file)
+                for line in table_file:
+                    fields = line.split()
+                    # local_address is ADDR:PORT in hex; state 0A is LISTEN
+                    if fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == int(port):
+                        inodes.add(fields[9])
+        except OSError:
+            continue
+    return inodes
+
+
+# Pids holding any of those sockets. Other users' processes can't be
+# looked into without root, so an empty answer means "unknown".
+def _socket_owners(inodes):
+    owners = set()
+    targets = {f"socket:[{inode}]" for inode in inodes}
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            fds = os.listdir(f"/proc/{pid}/fd")
+            if any(os.readlink(f"/proc/{pid}/fd/{fd}") in targets for fd in fds):
+                owners.add(int(pid))
+        except OSError:
+            continue
+    return owners
+
+
+def _parent_pid(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            # The command name in (...) may itself hold spaces
+            return int(stat_file.read().rsplit(")", 1)[1].split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+# True when pid is one of roots or runs under one of them (npm start
+# under PM2 leaves next-server as the listening child)
+def _descends_from(pid, roots):
+    while pid > 1:
+        if pid in roots:
+            return True
+        pid = _parent_pid(pid)
+    return False
+
+
+def check_port(config, purpose):
+    if _release_mode(config):
+        base_port = releases.pick_port(config, releases.load_state(config))
+    else:
+        base_port = config["PORT"]
+    ports = instances.ports_for(config, base_port)
+    busy = [port for port in ports if not port_free(port)]
+    if not busy:
+        return "ok", f"{', '.join(ports)} free"
+    name = config["APP_NAME_PM2"]
+    app_pids = set(pm2.pids(name)) if not _release_mode(config) else set()
+    if not app_pids:
+        return "fail", f"{', '.join(busy)} already in use by another process"
+    # Only the app being redeployed may hold them: it is stopped first
+    unknown = []
+    for port in busy:
+        owners = _socket_owners(_listening_inodes(port))
+        if not owners:
+            unknown.append(port)
+        elif not all(_descends_from(owner, app_pids) for owner in owners):
+            return "fail", f"{port} already in use by another process (pid {', '.join(map(str, sorted(owners)))})"
+    if unknown:
+        return "warn", f"{', '.join(unknown)} in use; could not tell whether '{name}' holds them"
+    return "ok", f"{', '.join(busy)} held by the running '{name}', which is stopped before the new one starts"
+
+
+def _existing_parent(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def check_disk(config, purpose):
+    min_free_mb = float(config.get("PREFLIGHT_MIN_FREE_MB", "1024"))
+    low = []
+    free = []
+    for key in ("DEPLOYMENT_ROOT", "BACKUP_DIR"):
+        free_mb = shutil.disk_usage(_existing_parent(config[key])).free / 1048576
+        free.append(f"{key} {free_mb / 1024:.1f} GB free")
+        if free_mb < min_free_mb:
+            low.append(key)
+    if low:
+        return "fail", f"{', '.join(free)}; {' and '.join(low)} below PREFLIGHT_MIN_FREE_MB={min_free_mb:.0f}"
+    return "ok", ", ".join(free)
+
+
+def check_nginx(config, purpose):
+    required = purpose == "nginx" or _release_mode(config)
+    if shutil.which("nginx") is None:
+        return ("fail" if required else "warn"), "nginx not on the PATH"
+    try:
+        result = runner.run(["nginx", "-t"], capture_output=True, text=True, timeout=_timeout(config))
+    except subprocess.TimeoutExpired:
+        return ("fail" if required else "warn"), "nginx -t did not finish"
+    if result.returncode != 0:
+        # nginx -t reports on stderr; the first line names the bad directive
+        lines = (result.stderr or result.stdout).strip().splitlines()
+        return ("fail" if required else "warn"), f"nginx -t failed: {lines[0] if lines else result.returncode}"
+    return "ok", "nginx -t: configuration is valid"
+
+
+# host or host:port, else the first nameserver in /etc/resolv.conf
+def resolver_for(config):
+    value = config.get("DNS_RESOLVER")
+    if not value:
+        try:
+            with open("/etc/resolv.conf", "r") as resolv_file:
+                for line in resolv_file:
+                    fields = line.split()
+                    if len(fields) >= 2 and fields[0] == "nameserver":
+                        return fields[1], 53
+        except OSError:
+            pass
+        return None
+    if value.count(":") == 1:
+        host, _, port = value.partition(":")
+        return host, int(port)
+    return value, 53
+
+
+def _skip_name(message, offset):
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+        if length == 0:
+            return offset
+
+
+# IPv4 addresses in the A records for name, asked of resolver (host,
+# port) over UDP with recursion on. Following CNAMEs is left to the
+# resolver, which returns the whole chain in one answer.
+def query_a(name, resolver, timeout=2.0):
+    query_id = random.randrange(1 << 16)
+    question = b"".join(bytes([len(label)]) + label.encode("idna") for label in name.rstrip(".").split("."))
+    message = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0) + question + b"\x00" + struct.pack("!HH", 1, 1)
+    family = socket.AF_INET6 if ":" in resolver[0] else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as dns_socket:
+        dns_socket.settimeout(timeout)
+        dns_socket.sendto(message, resolver)
+        while True:
+            response, _ = dns_socket.recvfrom(4096)
+            if len(response) >= 12 and struct.unpack("!H", response[:2])[0] == query_id:
+                break
+
+    _, flags, question_count, answer_count, _, _ = struct.unpack("!HHHHHH", response[:12])
+    rcode = flags & 0x000F
+    if rcode == 3:
+        return []
+    if rcode != 0:
+        raise OSError(f"resolver {resolver[0]} answered with rcode {rcode}")
+    offset = 12
+    for _ in range(question_count):
+        offset = _skip_name(response, offset) + 4
+    addresses = []
+    for _ in range(answer_count):
+        offset = _skip_name(response, offset)
+        record_type, _, _, length = struct.unpack("!HHIH", response[offset:offset + 10])
+        offset += 10
+        if record_type == 1 and length == 4:
+            addresses.append(socket.inet_ntoa(response[offset:offset + 4]))
+        offset += length
+    return addresses
+
+
+# Addresses this host answers on: PUBLIC_IPS when set, else every
+# address `hostname -I` lists
+def host_addresses(config):
+    if config.get("PUBLIC_IPS"):
+        return [address.strip() for address in config["PUBLIC_IPS"].split(",") if address.strip()]
+    try:
+        result = runner.run(["hostname", "-I"], capture_output=True, text=True, timeout=2)
+        addresses = result.stdout.split()
+    except (OSError, subprocess.SubprocessError):
+        addresses = []
+    if not addresses:
+        addresses = sorted({info[4][0] for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)})
+    return addresses
+
+
+def check_dns(config, purpose):
+    severity = "fail" if purpose == "nginx" else "warn"
+    if not config.get("SUBDOMAIN") or not config.get("DOMAIN"):
+        return ("fail" if purpose == "nginx" else "ok"), "SUBDOMAIN / DOMAIN not set; no DNS record to check"
+    domain_full = f"{config['SUBDOMAIN']}.{config['DOMAIN']}"
+    resolver = resolver_for(config)
+    try:
+        if resolver:
+            records = query_a(domain_full, resolver, _timeout(config))
+        else:
+            records = sorted({info[4][0] for info in socket.getaddrinfo(domain_full, None, socket.AF_INET)})
+    except socket.gaierror:
+        records = []
+    except (OSError, ValueError, IndexError, struct.error) as e:
+        return severity, f"could not resolve {domain_full}: {e}"
+    if not records:
+        return severity, f"{domain_full} has no A record"
+    addresses = host_addresses(config)
+    if not set(records) & set(addresses):
+        return severity, (f"{domain_full} points at {', '.join(records)}, not at this host ({', '.join(addresses)});"
+                          " set PUBLIC_IPS if it is behind NAT")
+    return "ok", f"{domain_full} -> {', '.join(records)}"
+
+
+CHECKS = {
+    "config": check_config,
+    "env": check_env,
+    "tools": check_tools,
+    "port": check_port,
+    "disk": check_disk,
+    "nginx": check_nginx,
+    "dns": check_dns,
+}
+CHECKS_FOR = {
+    "deploy": ["config", "env", "tools", "port", "disk", "nginx", "dns"],
+    "nginx": ["config", "tools", "nginx", "dns"],
+}
+
+
+# Run every check for purpose at once. Returns {name: (status, detail,
+# seconds)} in CHECKS_FOR order; a check still running past the
+# deadline fails.
+def run(config, purpose="deploy", env_path=None):
+    timeout = _timeout(config)
+    results = {}
+    checks = dict(CHECKS, env=lambda config, purpose: check_env(config, purpose, env_path))
+
+    def call(name):
+        started = time.monotonic()
+        try:
+            status, detail = checks[name](config, purpose)
+        except (OSError, ValueError, KeyError, subprocess.SubprocessError) as e:
+            status, detail = "fail", f"{type(e).__name__}: {e}"
+        results[name] = (status, detail, time.monotonic() - started)
+
+    # Daemon threads, so a check stuck past the deadline can't hold up
+    # exit. Checks with their own timeout get a moment to report it.
+    threads = {name: threading.Thread(target=call, args=(name,), daemon=True) for name in CHECKS_FOR[purpose]}
+    deadline = time.monotonic() + timeout + DEADLINE_GRACE
+    for thread in threads.values():
+        thread.start()
+    for thread in threads.values():
+        thread.join(max(0.0, deadline - time.monotonic()))
+    return {
+        name: results.get(name, ("fail", f"no answer within {timeout:g}s", timeout))
+        for name in CHECKS_FOR[purpose]
+    }
+
+
+def failed(results):
+    return [name for name, (status, _, _) in results.items() if status == "fail"]
+
+
+def report(results, elapsed):
+    lines = [f"{'CHECK':<8}  {'STATUS':<6}  {'SECONDS':>7}  DETAIL"]
+    for name, (status, detail, seconds) in results.items():
+        lines.append(f"{name:<8}  {status.upper():<6}  {seconds:>7.2f}  {detail}")
+    bad = failed(results)
+    warned = [name for name, (status, _, _) in results.items() if status == "warn"]
+    if bad:
+        verdict = f"{len(bad)} failed ({', '.join(bad)})"
+    elif warned:
+        verdict = f"passed with {len(warned)} warnings ({', '.join(warned)})"
+    else:
+        verdict = "all passed"
+    lines.append(f"Preflight {verdict} in {elapsed:.2f}s.")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import deploy
+
+    parser = argparse.ArgumentParser(description="Check this host is ready before deploying or configuring nginx.")
+    parser.add_argument("--for", dest="purpose", choices=PURPOSES, default="deploy", help="Which script to check for")
+    parser.add_argument("--config", default=deploy.config_path, help="Path to app.conf")
+    args = parser.parse_args()
+
+    config = deploy.load_config(args.config)
+    started = time.monotonic()
+    results = run(config, args.purpose, config.get("ENV_FILE", deploy.env_path))
+    print(report(results, time.monotonic() - started))
+    sys.exit(1 if failed(results) else 0)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Post-deploy readiness probe and latency smoke test
+#
+# Polls PROBE_ROUTES on every local instance port (and on the public
+# https://SUBDOMAIN.DOMAIN vhost with PROBE_PUBLIC="on") until each
+# answers below 400 or PROBE_TIMEOUT runs out. Then sends a burst of
+# PROBE_REQUESTS requests, PROBE_CONCURRENCY at a time, and reports
+# p50/p95/p99 latency. PROBE_P50_MS / PROBE_P95_MS / PROBE_P99_MS turn
+# the percentiles into pass/fail thresholds.
+#
+# The HTTP client is a small keep-alive connection pool on asyncio
+# streams, so the probe needs nothing outside the standard library.
+# ----------------------------------------------------------------
+
+import asyncio
+import math
+import ssl
+import time
+import urllib.parse
+
+
+class ProbeError(Exception):
+    pass
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+# "HTTP/1.1 200 OK" -> 200; anything else raises ValueError, which the
+# callers count as a failed request
+def _parse_status(status_line):
+    parts = status_line.split()
+    if len(parts) < 2 or not parts[0].startswith(b"HTTP/") or not parts[1].isdigit():
+        raise ValueError(f"malformed status line {status_line[:80]!r}")
+    return int(parts[1])
+
+
+# HTTP/1.1 GETs over reused connections, at most `size` in flight
+class ConnectionPool:
+    def __init__(self, size=10, timeout=10.0):
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(size)
+        self._idle = {}
+        self._ssl = ssl.create_default_context()
+
+    async def _open(self, scheme, host, port):
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=self._ssl if scheme == "https" else None
+        )
+        return _Connection(reader, writer)
+
+    async def _exchange(self, connection, host, target):
+        connection.writer.write(
+            f"GET {target} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: deploy-probe\r\n"
+            "Accept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n".encode()
+        )
+        await connection.writer.drain()
+
+        status_line = await connection.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed before a response")
+        status = _parse_status(status_line)
+        headers = {}
+        while True:
+            line = await connection.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        reusable = headers.get("connection", "").lower() != "close"
+        chunks = []
+        if status in (204, 304) or 100 <= status < 200:
+            pass
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                chunk_size = int((await connection.reader.readline()).split(b";")[0], 16)
+                if chunk_size:
+                    chunks.append(await connection.reader.readexactly(chunk_size))
+                await connection.reader.readexactly(2)
+                if chunk_size == 0:
+                    break
+        elif "content-length" in headers:
+            chunks.append(await connection.reader.readexactly(int(headers["content-length"])))
+        else:
+            chunks.append(await connection.reader.read())
+            reusable = False
+        return status, b"".join(chunks), reusable
+
+    # GET url; returns {"url", "status", "seconds", "bytes"}, plus "body"
+    # when keep_body is set. Errors and timeouts raise.
+    async def get(self, url, keep_body=False):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme or "http"
+        host = parts.hostname
+        port = parts.port or (443 if scheme == "https" else 80)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        key = (scheme, host, port)
+
+        async with self._slots:
+            idle = self._idle.setdefault(key, [])
+            # A pooled connection may have been closed by the server in the
+            # meantime; that earns one retry on a fresh connection
+            for attempt in range(2):
+                reused = bool(idle)
+                connection = idle.pop() if reused else await asyncio.wait_for(self._open(*key), self.timeout)
+                started = time.monotonic()
+                try:
+                    status, body, reusable = await asyncio.wait_for(
+                        self._exchange(connection, parts.netloc, target), self.timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                except BaseException:
+                    connection.close()
+                    raise
+                seconds = time.monotonic() - started
+                if reusable:
+                    idle.append(connection)
+                else:
+                    connection.close()
+                result = {"url": url, "status": status, "seconds": seconds, "bytes": len(body)}
+                if keep_body:
+                    result["body"] = body
+                return result
+
+    def close(self):
+        for connections in self._idle.values():
+            for connection in connections:
+                connection.close()
+        self._idle.clear()
+
+
+# Poll every url until it answers below 400. Returns {url: detail} for
+# the urls that never became ready.
+async def wait_ready(pool, urls, timeout=60.0, interval=1.0):
+    deadline = time.monotonic() + timeout
+
+    async def poll(url):
+        detail = "not tried"
+        while time.monotonic() < deadline:
+            try:
+                result = await pool.get(url)
+                if result["status"] < 400:
+                    return None
+                detail = f"answered {result['status']}"
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                detail = f"not reachable: {e or type(e).__name__}"
+            await asyncio.sleep(interval)
+        return detail
+
+    details = await asyncio.gather(*(poll(url) for url in urls))
+    return {url: detail for url, detail in zip(urls, details) if detail is not None}
+
+
+# `total` requests spread round-robin over urls, as many at once as the
+# pool allows. Returns (latencies in seconds, error count).
+async def burst(pool, urls, total):
+    latencies = []
+    errors = 0
+
+    async def one(url):
+        nonlocal errors
+        try:
+            result = await pool.get(url)
+            if result["status"] >= 400:
+                errors += 1
+            else:
+                latencies.append(result["seconds"])
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            errors += 1
+
+    await asyncio.gather(*(one(urls[index % len(urls)]) for index in range(total)))
+    return latencies, errors
+
+
+# Nearest-rank percentiles, in milliseconds
+def percentiles(latencies, points=(50, 95, 99)):
+    ordered = sorted(latencies)
+    if not ordered:
+        return {point: None for point in points}
+    return {
+        point: ordered[max(0, math.ceil(point / 100 * len(ordered)) - 1)] * 1000
+        for point in points
+    }
+
+
+def routes_for(config):
+    routes = config.get("PROBE_ROUTES", config.get("HEALTH_CHECK_PATH", "/"))
+    return [route.strip() for route in routes.split(",") if route.strip()]
+
+
+# Base URLs to probe: every local instance port, plus the public vhost
+def targets_for(config, ports):
+    bases = [f"http://127.0.0.1:{port}" for port in ports]
+    if config.get("PROBE_PUBLIC", "off") == "on":
+        bases.append(f"https://{config['SUBDOMAIN']}.{config['DOMAIN']}")
+    return bases
+
+
+async def _probe(config, bases, report):
+    routes = routes_for(config)
+    urls = [base + route for base in bases for route in routes]
+    pool = ConnectionPool(
+        size=int(config.get("PROBE_CONCURRENCY", "10")),
+        timeout=float(config.get("PROBE_REQUEST_TIMEOUT", "10")),
+    )
+    try:
+        report(f"Waiting for {len(urls)} route(s) to answer...")
+        started = time.monotonic()
+        not_ready = await wait_ready(pool, urls, float(config.get("PROBE_TIMEOUT", "60")))
+        if not_ready:
+            raise ProbeError("Not ready: " + "; ".join(f"{url} {detail}" for url, detail in not_ready.items()))
+        report(f"All routes ready after {time.monotonic() - started:.1f}s.")
+
+        total = int(config.get("PROBE_REQUESTS", "50"))
+        latencies, errors = await burst(pool, urls, total)
+    finally:
+        pool.close()
+    return {"ready_seconds": time.monotonic() - started, "requests": total, "errors": errors,
+            "percentiles": percentiles(latencies)}
+
+
+# Run the probe against `ports` and return its result. Raises
+# ProbeError when a route never became ready, a burst request failed, or
+# a percentile is over its threshold.
+def run(config, ports, report=print):
+    result = asyncio.run(_probe(config, targets_for(config, ports), report))
+    p = result["percentiles"]
+    report(
+        f"Burst of {result['requests']} requests: {result['errors']} errors, "
+        + ", ".join(f"p{point} {value:.1f} ms" for point, value in p.items() if value is not None)
+    )
+    if result["errors"]:
+        raise ProbeError(f"{result['errors']} of {result['requests']} burst requests failed")
+    over = []
+    for point, value in p.items():
+        limit = config.get(f"PROBE_P{point}_MS")
+        if limit and value is not None and value > float(limit):
+            over.append(f"p{point} {value:.1f} ms > {limit} ms")
+    if over:
+        raise ProbeError("Latency over threshold: " + ", ".join(over))
+    return result
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Release helpers for DEPLOY_MODE=release (blue/green deploys)
+#
+# Layout under DEPLOYMENT_ROOT/APP_NAME_PM2:
+#   releases/<timestamp>/   one checkout per deploy
+#   current                 symlink to the live release
+#   release-state.json      live release, port and PM2 process name
+#
+#   python3 releases.py health    exit 0 once every live instance answers
+#                                 HEALTH_CHECK_PATH (rollout.py's gate)
+# ----------------------------------------------------------------
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import instances
+import pm2
+import runner
+import warmup
+
+
+# Root folder holding every release of an app
+def app_base(config):
+    return os.path.join(config["DEPLOYMENT_ROOT"], config["APP_NAME_PM2"])
+
+
+def releases_dir(config):
+    return os.path.join(app_base(config), "releases")
+
+
+def state_path(config):
+    return os.path.join(app_base(config), "release-state.json")
+
+
+# Fresh, timestamped release folder for this deploy
+def new_release_root(config):
+    return os.path.join(releases_dir(config), config["TIMESTAMP"])
+
+
+# Live release state. Before the first release-mode deploy the app runs
+# in place as APP_NAME_PM2 on PORT, so that is what we treat as live.
+def load_state(config):
+    if os.path.exists(state_path(config)):
+        with open(state_path(config), "r") as state_file:
+            return json.load(state_file)
+    return {
+        "release": None,
+        "port": config["PORT"],
+        "pm2_name": config["APP_NAME_PM2"],
+    }
+
+
+def save_state(config, state):
+    os.makedirs(app_base(config), exist_ok=True)
+    tmp_path = state_path(config) + ".tmp"
+    with open(tmp_path, "w") as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(tmp_path, state_path(config))
+
+
+# The new release goes on whichever of PORT / ALT_PORT is not live. In
+# PM2_MODE=ports a release takes a range of ports, so ALT_PORT defaults
+# to just past PORT's range.
+def pick_port(config, state):
+    alt_port = config.get("ALT_PORT", str(int(config["PORT"]) + len(instances.ports_for(config, config["PORT"]))))
+    return alt_port if str(state["port"]) == config["PORT"] else config["PORT"]
+
+
+def pm2_name_for(config, port):
+    return f"{config['APP_NAME_PM2']}-{port}"
+
+
+# Poll the new process until it answers with a non-error status
+def wait_until_healthy(port, path="/", timeout=60, interval=1.0):
+    url = f"http://127.0.0.1:{port}{path}"
+    deadline = time.monotonic() + timeout
+    last_error = None
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                if response.status < 400:
+                    return True, f"{url} answered {response.status}"
+                last_error = f"{url} answered {response.status}"
+        except urllib.error.HTTPError as e:
+            last_error = f"{url} answered {e.code}"
+        except (urllib.error.URLError, OSError) as e:
+            last_error = f"{url} not reachable: {e}"
+        time.sleep(interval)
+    return False, last_error
+
+
+# Every instance has to pass; the first failure is reported
+def wait_until_all_healthy(ports, path="/", timeout=60):
+    details = []
+    for port in ports:
+        healthy, detail = wait_until_healthy(port, path, timeout)
+        if not healthy:
+            return False, detail
+        details.append(detail)
+    return True, "; ".join(details)
+
+
+def upstream_file(config):
+    return config.get(
+        "NGINX_UPSTREAM_FILE",
+        f"/etc/nginx/conf.d/{config['APP_NAME_PM2']}-upstream.conf",
+    )
+
+
+def render_upstream(name, ports, keepalive=32):
+    body = "".join(f"    {line}\n" for line in instances.upstream_lines(ports, keepalive))
+    return f"upstream {name} {{\n{body}}}\n"
+
+
+# Point the nginx upstream at the new port and reload. The previous file
+# is put back if `nginx -t` rejects the new one, so the old release keeps
+# serving.
+def switch_upstream(config, port):
+    path = upstream_file(config)
+    previous = None
+    if os.path.exists(path):
+        with open(path, "r") as current_file:
+            previous = current_file.read()
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as new_file:
+        new_file.write(render_upstream(
+            config["APP_NAME_PM2"], instances.ports_for(config, port), int(config.get("NGINX_KEEPALIVE", "32"))
+        ))
+    os.replace(tmp_path, path)
+
+    try:
+        runner.run(["nginx", "-t"], check=True, capture_output=True, text=True)
+    except subprocess.SubprocessError:
+        if previous is None:
+            os.remove(path)
+        else:
+            with open(path, "w") as restore_file:
+                restore_file.write(previous)
+        raise
+
+    runner.run(["systemctl", "reload", "nginx"], check=True)
+
+
+# Move the `current` symlink atomically to the new release
+def point_current(config, release_root):
+    link_path = os.path.join(app_base(config), "current")
+    tmp_link = link_path + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(release_root, tmp_link)
+    os.replace(tmp_link, link_path)
+
+
+# Keep the newest RELEASES_KEEP releases, never touching the live one
+def prune_releases(config, keep_release):
+    keep = int(config.get("RELEASES_KEEP", "5"))
+    if not os.path.isdir(releases_dir(config)):
+        return []
+    names = sorted(os.listdir(releases_dir(config)), reverse=True)
+    removed = []
+    for name in names[keep:]:
+        path = os.path.join(releases_dir(config), name)
+        if os.path.realpath(path) == os.path.realpath(keep_release):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(path)
+    return removed
+
+
+class ReleaseError(Exception):
+    pass
+
+
+# Blue/green switch-over: start release_root on the idle port,
+# health-check it, switch nginx, then retire the old process. Any
+# failure before the switch leaves the old release serving untouched.
+# Returns the new live state.
+def activate(config, state, release_root, report=print):
+    new_port = pick_port(config, state)
+    new_name = pm2_name_for(config, new_port)
+
+    pm2.delete([new_name])
+    ports = instances.start(config, new_name, new_port, release_root)
+    report(f"Started '{new_name}' on port(s) {', '.join(ports)}. Waiting for it to become healthy...")
+
+    healthy, detail = wait_until_all_healthy(
+        ports,
+        config.get("HEALTH_CHECK_PATH", "/"),
+        int(config.get("HEALTH_CHECK_TIMEOUT", "60")),
+    )
+    report(f"Health check for '{new_name}': {detail}")
+    if not healthy:
+        pm2.delete([new_name])
+        raise ReleaseError(f"New release failed its health check ({detail}); previous release left serving.")
+
+    if config.get("WARMUP", "off") == "on":
+        # Pay for cold renders before any user can reach the release
+        warmup.run(config, ports, report)
+
+    try:
+        switch_upstream(config, new_port)
+    except subprocess.SubprocessError:
+        pm2.delete([new_name])
+        raise
+    report(f"Nginx upstream switched to port {new_port}.")
+
+    old_name = state["pm2_name"]
+    if old_name != new_name:
+        pm2.delete([old_name])
+        report(f"Previous PM2 process '{old_name}' retired.")
+    pm2.save()
+
+    new_state = {"release": release_root, "port": new_port, "pm2_name": new_name}
+    point_current(config, release_root)
+    save_state(config, new_state)
+    for removed in prune_releases(config, release_root):
+        report(f"Pruned old release {removed}.")
+    return new_state
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["health"]:
+        print("Usage: python3 releases.py health")
+        sys.exit(2)
+    import deploy
+
+    config = deploy.load_config(deploy.config_path)
+    port = load_state(config)["port"] if config.get("DEPLOY_MODE", "inplace") == "release" else config["PORT"]
+    healthy, detail = wait_until_all_healthy(
+        instances.ports_for(config, port),
+        config.get("HEALTH_CHECK_PATH", "/"),
+        int(config.get("HEALTH_CHECK_TIMEOUT", "60")),
+    )
+    print(f"{'Healthy' if healthy else 'Unhealthy'}: {detail}")
+    sys.exit(0 if healthy else 1)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Roll back to a previous release or backup in seconds
+#
+#   python3 rollback.py            list candidates and pick one
+#   python3 rollback.py --list     list candidates only
+#   python3 rollback.py 2          roll back to candidate #2
+#   python3 rollback.py --current  print what is live, as a --to target
+#   python3 rollback.py --to release:20260101-120000
+#   python3 rollback.py --to backup:20260101-120000
+#                                  roll back to that exact release, or to
+#                                  the backup the deploy run with that
+#                                  timestamp made of the tree it replaced
+#
+# Retained releases (DEPLOY_MODE=release) already hold their build
+# output and node_modules, so they start straight away. Backups hold
+# .next but not node_modules; those come from the node_modules store
+# when it has the lockfile (NPM_INSTALL=store), otherwise from `npm ci`.
+# A rebuild only happens when the backup has no build output.
+# ----------------------------------------------------------------
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import archiver
+import backup_store
+import deploy
+import events
+import instances
+import pm2
+import npm_cache
+import planner
+import releases
+import runner
+
+# Define paths
+config_path = "../conf/app.conf"
+logs_dir = "../logs"
+timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+log_file = f"{logs_dir}/rollback-{timestamp}.log"
+
+parser = argparse.ArgumentParser(description="Roll back to a previous release or backup.")
+parser.add_argument("choice", nargs="?", type=int, help="Number of the candidate to restore")
+parser.add_argument("--list", action="store_true", help="Only list rollback candidates")
+parser.add_argument("--current", action="store_true", help="Print what is live now and exit")
+parser.add_argument("--to", help="Roll back to release:<name> or backup:<deploy timestamp>")
+args = parser.parse_args()
+
+# Load configuration
+config = deploy.load_config(config_path)
+
+config["TIMESTAMP"] = timestamp
+config["APP_ROOT"] = os.path.join(config["DEPLOYMENT_ROOT"], config["APP_NAME_PM2"], config["APP_NAME_GITHUB"])
+release_mode = config.get("DEPLOY_MODE", "inplace") == "release"
+
+
+# What is live, as rollout.py records it before and after a deploy:
+# release:<name> for a retained release, inplace:<inode> for a tree run
+# in place (a deploy swaps in a new folder, so the inode changes), none
+# when nothing is deployed. An in-place tree whose PM2 process is missing
+# or not online gets ":stopped" appended, so a deploy that stopped the
+# app but never swapped the folder still shows up as a change.
+def live_target():
+    if release_mode:
+        live = releases.load_state(config)["release"]
+        if live and os.path.isdir(live):
+            return f"release:{os.path.basename(os.path.realpath(live))}"
+    if os.path.isdir(config["APP_ROOT"]):
+        target = f"inplace:{os.stat(config['APP_ROOT']).st_ino}"
+        if pm2.status(config["APP_NAME_PM2"]) != "online":
+            target += ":stopped"
+        return target
+    return "none"
+
+
+if args.current:
+    print(live_target())
+    sys.exit(0)
+
+os.makedirs(logs_dir, exist_ok=True)
+with open(log_file, "w") as log:
+    log.write(f"Rollback log - {timestamp}\n")
+
+event_log = events.for_log_file(log_file, app=config.get("APP_NAME_PM2"))
+log_message = event_log.message
+
+# ----------------------------------------------------------------
+# Step 1: Collect rollback candidates, newest first
+# ----------------------------------------------------------------
+candidates = []
+live_release = None
+
+if release_mode:
+    release_state = releases.load_state(config)
+    live_release = release_state["release"]
+    if os.path.isdir(releases.releases_dir(config)):
+        for name in sorted(os.listdir(releases.releases_dir(config)), reverse=True):
+            path = os.path.join(releases.releases_dir(config), name)
+            if live_release and os.path.realpath(path) == os.path.realpath(live_release):
+                continue
+            candidates.append(("release", path, f"release {name} (retained build, instant)"))
+
+if os.path.isdir(config["BACKUP_DIR"]):
+    # BK-<app>-<date>-<time>.tar...; matching the whole app name keeps
+    # 'shop-admin' archives out of 'shop'
+    archive_name = re.compile(rf"BK-{re.escape(config['APP_NAME_GITHUB'])}-\d{{8}}-\d{{6}}\.tar")
+    for name in sorted(os.listdir(config["BACKUP_DIR"]), reverse=True):
+        if archive_name.match(name) and not name.endswith(".part"):
+            candidates.append(("archive", os.path.join(config["BACKUP_DIR"], name), f"backup archive {name}"))
+
+backup_repo = backup_store.repo_dir_for(config)
+for name in reversed(backup_store.list_backups(backup_repo, config["APP_NAME_GITHUB"])):
+    candidates.append(("repository", name, f"backup repository {name}"))
+
+if not candidates:
+    log_message("No previous releases or backups found to roll back to.")
+    sys.exit(1)
+
+# --to names one candidate exactly instead of a position in the list
+def matches(candidate, target):
+    kind, source, _label = candidate
+    target_kind, _, target_name = target.partition(":")
+    if target_kind == "release":
+        return kind == "release" and os.path.basename(source) == target_name
+    if target_kind == "backup":
+        if kind == "archive":
+            name = os.path.basename(source)
+            stem = f"BK-{config['APP_NAME_GITHUB']}-{target_name}"
+            return name == stem or name.startswith(f"{stem}.")
+        return kind == "repository" and source == f"{config['APP_NAME_GITHUB']}-{target_name}"
+    return False
+
+
+if args.to:
+    chosen = [candidate for candidate in candidates if matches(candidate, args.to)]
+    if not chosen:
+        log_message(f"No rollback candidate matches '{args.to}'.")
+        sys.exit(1)
+    candidates = chosen[:1]
+    args.choice = 1
+
+print("\nRollback candidates:")
+for number, (_kind, _source, label) in enumerate(candidates, start=1):
+    print(f"  {number:>2}. {label}")
+if args.list:
+    sys.exit(0)
+
+choice = args.choice
+if choice is None:
+    answer = input("\nRoll back to which number? (blank to abort): ").strip()
+    if not answer:
+        print("Rollback aborted by user.")
+        sys.exit(0)
+    choice = int(answer) if answer.isdigit() else 0
+if not 1 <= choice <= len(candidates):
+    log_message(f"Invalid choice: {choice}")
+    sys.exit(1)
+
+kind, source, label = candidates[choice - 1]
+log_message(f"Rolling back {config['APP_NAME_PM2']} to {label}.")
+rollback_started = time.monotonic()
+
+# ----------------------------------------------------------------
+# Step 2: Materialize the chosen tree
+# ----------------------------------------------------------------
+if kind == "release":
+    target_root = source
+else:
+    # Restore next to where it will run so the final move is a rename
+    if release_mode:
+        target_root = os.path.join(releases.releases_dir(config), f"{timestamp}-rollback")
+    else:
+        target_root = f"{config['APP_ROOT']}.rollback-{timestamp}"
+    try:
+        if kind == "archive":
+            unpack_dir = f"{target_root}.unpack"
+            codec = archiver.extract_archive(source, unpack_dir)
+            # Archives from older deploy.py runs were rooted at backup_staging/;
+            # anything else must hold exactly one top-level folder
+            unpacked = os.listdir(unpack_dir)
+            if config["APP_NAME_GITHUB"] in unpacked:
+                top_dir = config["APP_NAME_GITHUB"]
+            elif len(unpacked) == 1 and os.path.isdir(os.path.join(unpack_dir, unpacked[0])):
+                top_dir = unpacked[0]
+            else:
+                shutil.rmtree(unpack_dir, ignore_errors=True)
+                log_message(
+                    f"Error restoring backup: {source} should hold one top-level folder,"
+                    f" found {', '.join(sorted(unpacked)) or 'nothing'}."
+                )
+                sys.exit(1)
+            os.rename(os.path.join(unpack_dir, top_dir), target_root)
+            shutil.rmtree(unpack_dir, ignore_errors=True)
+            log_message(f"Unpacked {source} ({codec}) in {time.monotonic() - rollback_started:.1f}s.")
+        else:
+            backup_store.restore(backup_repo, source, target_root)
+            log_message(f"Restored {source} from {backup_repo} in {time.monotonic() - rollback_started:.1f}s.")
+    except (OSError, subprocess.SubprocessError) as e:
+        log_message(f"Error restoring backup: {e}")
+        sys.exit(1)
+
+# Dependencies and build output: reuse whatever is already there
+try:
+    if not os.path.isdir(os.path.join(target_root, "node_modules")):
+        step_started = time.monotonic()
+        if config.get("NPM_INSTALL", "install") == "store":
+            store_result = npm_cache.install(config, target_root)
+            log_message(f"node_modules from store ({store_result['result']}) in {time.monotonic() - step_started:.1f}s.")
+        else:
+            runner.run(["npm", "ci"], cwd=target_root, check=True)
+            log_message(f"node_modules installed with npm ci in {time.monotonic() - step_started:.1f}s.")
+    if not os.path.exists(os.path.join(target_root, ".next", "BUILD_ID")):
+        step_started = time.monotonic()
+        log_message("No build output in this backup; running npm run build.")
+        runner.run(["npm", "run", "build"], cwd=target_root, check=True)
+        log_message(f"npm build completed in {time.monotonic() - step_started:.1f}s.")
+except subprocess.SubprocessError as e:
+    log_message(f"Error preparing rollback tree: {e}")
+    sys.exit(1)
+
+# ----------------------------------------------------------------
+# Step 3: Put the tree live
+# ----------------------------------------------------------------
+# In place, a rollback that fails once the old process is stopped puts
+# the tree it replaced back and restarts it, rather than leave the
+# broken one live (or nothing at all)
+def restore_replaced(replaced_root):
+    failed_root = f"{config['APP_ROOT']}.failed-rollback-{timestamp}"
+    try:
+        pm2.delete([config["APP_NAME_PM2"]])
+        if os.path.exists(replaced_root):
+            if os.path.exists(config["APP_ROOT"]):
+                os.rename(config["APP_ROOT"], failed_root)
+            os.rename(replaced_root, config["APP_ROOT"])
+        if not os.path.isdir(config["APP_ROOT"]):
+            return
+        instances.start(config, config["APP_NAME_PM2"], config["PORT"], config["APP_ROOT"])
+        pm2.save()
+        kept = f"; the rolled-back one is kept at {failed_root}" if os.path.exists(failed_root) else ""
+        log_message(f"The replaced tree is live again{kept}.")
+    except (OSError, subprocess.SubprocessError) as e:
+        log_message(f"Error putting the replaced tree back: {e}")
+
+
+# The deployed-commit record stops describing the live tree here, so
+# the next deploy plans a full install and build
+planner.forget(config)
+replaced_root = None
+try:
+    if release_mode:
+        new_state = releases.activate(config, release_state, target_root, log_message)
+        log_message(f"Rolled back: {new_state['release']} live as '{new_state['pm2_name']}' on port {new_state['port']}.")
+    else:
+        # In place: swap folders, then restart the single PM2 process
+        replaced_root = f"{config['APP_ROOT']}.replaced-{timestamp}"
+        pm2.delete([config["APP_NAME_PM2"]])
+        if os.path.exists(config["APP_ROOT"]):
+            os.rename(config["APP_ROOT"], replaced_root)
+        os.rename(target_root, config["APP_ROOT"])
+        ports = instances.start(config, config["APP_NAME_PM2"], config["PORT"], config["APP_ROOT"])
+        pm2.save()
+        healthy, detail = releases.wait_until_all_healthy(
+            ports,
+            config.get("HEALTH_CHECK_PATH", "/"),
+            int(config.get("HEALTH_CHECK_TIMEOUT", "60")),
+        )
+        log_message(f"Health check for '{config['APP_NAME_PM2']}': {detail}")
+        if not healthy:
+            log_message("Rolled-back app is not healthy; putting the replaced tree back.")
+            restore_replaced(replaced_root)
+            sys.exit(1)
+        shutil.rmtree(replaced_root, ignore_errors=True)
+except (releases.ReleaseError, OSError, subprocess.SubprocessError) as e:
+    log_message(f"Error switching to the rollback: {e}")
+    if replaced_root:
+        restore_replaced(replaced_root)
+    sys.exit(1)
+
+log_message(f"Rollback completed in {time.monotonic() - rollback_started:.1f}s.")
+print(f"\nRollback logged to: {log_file}")
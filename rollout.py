@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Rolling deploy across hosts, in waves
+#
+#   python3 rollout.py ../conf/hosts.conf                  1 host, 25%, then the rest
+#   python3 rollout.py ../conf/hosts.conf --waves 2,50%,rest --pause 60 --yes
+#
+# hosts.conf names one host per line, with a transport and its target:
+#   web1  ssh    deploy@10.0.0.11:/srv/next/scripts
+#   web2  local  /srv/fake-hosts/web2/scripts
+# ssh runs each command in the host's scripts folder over ssh (BatchMode,
+# so keys must be set up). local runs it in a folder on this machine,
+# which is how a rollout can be tried against several fake hosts.
+#
+# Every host of a wave records what it has live (`rollback.py --current`)
+# and runs `python3 deploy.py --yes --timestamp <rollout timestamp>` at
+# the same time. Then `python3 releases.py health` is the gate: the next
+# wave only starts once every host of this one passes. Otherwise the
+# rollout stops and every host whose live tree changed, or whose in-place
+# app was stopped and not started again, rolls back to exactly what it
+# replaced: the recorded release, or the backup its deploy run made
+# (`rollback.py --to ...`). Hosts that never switched are left alone.
+# Each host's output goes to ../logs/rollout-<timestamp>/<host>.log.
+# ----------------------------------------------------------------
+
+import argparse
+import math
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import events
+import runner
+
+DEPLOY = ["python3", "deploy.py", "--yes"]
+HEALTH = ["python3", "releases.py", "health"]
+CURRENT = ["python3", "rollback.py", "--current"]
+ROLLBACK = ["python3", "rollback.py", "--to"]
+
+
+# A host that is a scripts folder on this machine
+class LocalTransport:
+    def __init__(self, target):
+        self.scripts_dir = target
+
+    def run(self, argv, timeout=None, **kwargs):
+        return runner.run(argv, cwd=self.scripts_dir, timeout=timeout, **kwargs)
+
+
+# user@host:/path/to/scripts
+class SshTransport:
+    def __init__(self, target):
+        self.destination, _, self.scripts_dir = target.partition(":")
+        if not self.destination or not self.scripts_dir:
+            raise ValueError(f"ssh target '{target}' should look like user@host:/path/to/scripts")
+
+    def run(self, argv, timeout=None, **kwargs):
+        command = f"cd {shlex.quote(self.scripts_dir)} && {shlex.join(argv)}"
+        return runner.run(["ssh", "-o", "BatchMode=yes", self.destination, command], timeout=timeout, **kwargs)
+
+
+TRANSPORTS = {"local": LocalTransport, "ssh": SshTransport}
+
+
+def read_hosts(path):
+    hosts = []
+    with open(path, "r") as hosts_file:
+        for line in hosts_file:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            fields = line.split()
+            if len(fields) != 3 or fields[1] not in TRANSPORTS:
+                raise ValueError(f"Invalid line in {path}: {line} (expected: name {'|'.join(TRANSPORTS)} target)")
+            if any(host["name"] == fields[0] for host in hosts):
+                raise ValueError(f"Host '{fields[0]}' is listed twice in {path}")
+            hosts.append({"name": fields[0], "transport": TRANSPORTS[fields[1]](fields[2])})
+    return hosts
+
+
+# "1,25%,rest": 1 host, then 25% of all hosts (rounded up), then the
+# rest. Hosts the spec doesn't reach go in one last wave.
+def plan_waves(hosts, spec):
+    waves = []
+    remaining = list(hosts)
+    for item in (item.strip() for item in spec.split(",")):
+        if not remaining:
+            break
+        if item == "rest":
+            size = len(remaining)
+        elif item.endswith("%"):
+            size = max(1, math.ceil(len(hosts) * float(item[:-1]) / 100))
+        else:
+            size = int(item)
+        if size < 1:
+            raise ValueError(f"Wave '{item}' has no hosts")
+        waves.append(remaining[:size])
+        remaining = remaining[size:]
+    if remaining:
+        waves.append(remaining)
+    return waves
+
+
+# Where a host goes back to if this rollout has to undo it: the release
+# that was live before, or (for a tree run in place) the backup the
+# deploy run stamped `timestamp` made of it. None when nothing was live.
+def rollback_target(live_before, timestamp):
+    if live_before.startswith("release:"):
+        return live_before
+    if live_before.startswith("inplace:"):
+        return f"backup:{timestamp}"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll a release out to many hosts in waves, with health gates.")
+    parser.add_argument("hosts", help="Hosts file: name, transport (local|ssh) and target per line")
+    parser.add_argument("--waves", default="1,25%,rest", help="Wave sizes: host counts, percentages or 'rest'")
+    parser.add_argument("--pause", type=float, default=0, help="Seconds to wait between healthy waves")
+    parser.add_argument("--host-timeout", type=float, default=None, help="Seconds a host's deploy may take")
+    parser.add_argument("--yes", action="store_true", help="Don't ask for confirmation")
+    args = parser.parse_args()
+
+    try:
+        hosts = read_hosts(args.hosts)
+        waves = plan_waves(hosts, args.waves)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if not hosts:
+        print(f"No hosts in {args.hosts}.")
+        sys.exit(1)
+
+    print(f"Rolling out to {len(hosts)} hosts in {len(waves)} waves:")
+    for number, wave in enumerate(waves, start=1):
+        print(f"  wave {number}: {' '.join(host['name'] for host in wave)}")
+    if not args.yes and input("\nProceed with rollout? (y/n): ").lower() != "y":
+        print("Rollout aborted by user.")
+        sys.exit(0)
+
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    rollout_dir = os.path.join("..", "logs", f"rollout-{timestamp}")
+    os.makedirs(rollout_dir, exist_ok=True)
+    for host in hosts:
+        host.update(wave=None, deploy="-", health="-", rollback="-", live_before=None, switched=False)
+        host_log = os.path.join(rollout_dir, f"{host['name']}.log")
+        host["log"] = events.EventLog(
+            events.events_path_for(host_log), text_path=host_log, run=f"rollout-{timestamp}", app=host["name"], echo=False
+        )
+
+    # Run argv on a host with its output streamed into the host's log
+    def on_host(host, phase, argv, timeout=None):
+        with events.bind(host["log"], phase), host["log"].phase(phase):
+            try:
+                ok = host["transport"].run(argv, timeout=timeout).returncode == 0
+            except (OSError, subprocess.SubprocessError) as e:
+                host["log"].message(f"{phase} failed: {e}")
+                ok = False
+        host["log"].flush()
+        return ok
+
+    # `rollback.py --current` on the host; None if it can't be read
+    def read_live(host):
+        try:
+            result = host["transport"].run(CURRENT, capture_output=True, text=True)
+        except (OSError, subprocess.SubprocessError) as e:
+            host["log"].message(f"Could not read the live release: {e}")
+            return None
+        if result.returncode != 0 or not result.stdout.strip():
+            host["log"].message(f"Could not read the live release: {result.stderr.strip() or 'no output'}")
+            return None
+        return result.stdout.strip().splitlines()[-1]
+
+    def deploy_host(host):
+        host["live_before"] = read_live(host)
+        if host["live_before"] is None:
+            # Without it there is nothing exact to roll back to
+            host["log"].message("Not deploying: the live release is unknown.")
+            host["log"].flush()
+            host["deploy"] = "failed"
+            return
+        ok = on_host(host, "deploy", DEPLOY + ["--timestamp", timestamp], args.host_timeout)
+        host["deploy"] = "ok" if ok else "failed"
+        # A failed deploy may still have swapped the tree, or stopped the
+        # in-place app without swapping it (--current then reports it as
+        # stopped); unreadable counts as changed
+        live_after = read_live(host)
+        host["switched"] = live_after is None or live_after != host["live_before"]
+
+    def check_host(host):
+        host["health"] = "ok" if on_host(host, "health", HEALTH) else "failed"
+
+    def roll_back(host):
+        target = rollback_target(host["live_before"], timestamp)
+        if target is None:
+            host["log"].message("Nothing was live before this rollout; there is nothing to roll back to.")
+            host["log"].flush()
+            host["rollback"] = "none"
+            return
+        host["rollback"] = "ok" if on_host(host, "rollback", ROLLBACK + [target], args.host_timeout) else "failed"
+        check_host(host)
+
+    def each(function, wave):
+        with ThreadPoolExecutor(max_workers=len(wave)) as pool:
+            list(pool.map(function, wave))
+
+    started = time.monotonic()
+    done = []
+    to_roll_back = []
+    failed_wave = None
+    runner.handle_interrupts()
+    try:
+        for number, wave in enumerate(waves, start=1):
+            wave_started = time.monotonic()
+            print(f"\nWave {number}/{len(waves)}: deploying {' '.join(host['name'] for host in wave)}...")
+            for host in wave:
+                host["wave"] = number
+            each(deploy_host, wave)
+            each(check_host, wave)
+            done.extend(wave)
+
+            bad = [host["name"] for host in wave if host["deploy"] != "ok" or host["health"] != "ok"]
+            if bad:
+                print(f"Wave {number} failed on {', '.join(bad)} after {time.monotonic() - wave_started:.1f}s.")
+                failed_wave = number
+                break
+            print(f"Wave {number} healthy in {time.monotonic() - wave_started:.1f}s.")
+            if args.pause and number < len(waves):
+                print(f"Pausing {args.pause:.0f}s before the next wave...")
+                time.sleep(args.pause)
+
+        if failed_wave is not None:
+            # Only hosts whose live tree changed go back; one whose deploy
+            # failed before switching still serves what it had
+            to_roll_back = [host for host in done if host["switched"]]
+            if to_roll_back:
+                print(f"Rolling back {' '.join(host['name'] for host in to_roll_back)}...")
+                each(roll_back, to_roll_back)
+    except KeyboardInterrupt:
+        print("\nRollout interrupted; running commands were stopped. Nothing was rolled back.")
+        sys.exit(130)
+
+    print(f"\n{'HOST':<16}  {'WAVE':>4}  {'DEPLOY':<7}  {'HEALTH':<7}  {'ROLLBACK':<8}")
+    for host in hosts:
+        print(f"{host['name']:<16}  {host['wave'] or '-':>4}  {host['deploy']:<7}"
+              f"  {host['health']:<7}  {host['rollback']:<8}")
+    print(f"\nLogs: {rollout_dir}")
+
+    if failed_wave is None:
+        print(f"Rollout finished: {len(hosts)} hosts healthy in {time.monotonic() - started:.1f}s.")
+        return
+    if any(host["rollback"] in ("failed", "none") or host["health"] != "ok" for host in done):
+        print("Rollout stopped and rollback did NOT bring every host back. Check the host logs.")
+    elif to_roll_back:
+        print(f"Rollout stopped at wave {failed_wave}; {len(to_roll_back)} hosts were rolled back and are healthy.")
+    else:
+        print(f"Rollout stopped at wave {failed_wave}; the failed hosts kept serving their old release.")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
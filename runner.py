@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Shared subprocess runner for the deploy scripts
+#
+# run() takes the same arguments as the subprocess.run calls it
+# replaces (check, cwd, env, capture_output, text) and returns a
+# CompletedProcess.
+#
+# Without capture_output, stdout and stderr are streamed line by line:
+# to the bound events.EventLog, which prints them and writes them to the
+# deploy log, or straight to the console when no log is bound. Only the
+# last TAIL_LINES lines are kept, for the error report.
+#
+# Every child runs in its own process group, so a timeout (the timeout
+# argument or a step_timeout() around the caller) or cancel_all() stops
+# the whole tree: SIGTERM first, then SIGKILL after GRACE_SECONDS.
+#
+# The child is reaped with os.wait4, so its own CPU time and peak RSS
+# are known even when several steps run at once. When the calling thread
+# is bound to an EventLog, a "process" record is filed under the current
+# phase.
+# ----------------------------------------------------------------
+
+import atexit
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import events
+
+TAIL_LINES = 200
+GRACE_SECONDS = 10
+
+_context = threading.local()
+_running = {}
+_running_lock = threading.Lock()
+_cancelled = threading.Event()
+
+
+def _with_tail(message, output):
+    if isinstance(output, str) and output:
+        message += "\nLast output:\n" + "\n".join(f"  {line}" for line in output.splitlines()[-20:])
+    return message
+
+
+# The last lines of output make the deploy log's error useful
+class ProcessFailed(subprocess.CalledProcessError):
+    def __str__(self):
+        return _with_tail(super().__str__(), self.output)
+
+
+class Cancelled(subprocess.SubprocessError):
+    def __init__(self, cmd):
+        super().__init__(f"Command '{shlex.join(cmd)}' not started: the run was interrupted")
+        self.cmd = cmd
+
+
+class ProcessTimedOut(subprocess.TimeoutExpired):
+    def __str__(self):
+        return _with_tail(
+            f"Command '{shlex.join(self.cmd)}' timed out after {self.timeout:.0f} seconds and was stopped",
+            self.output,
+        )
+
+
+# Limit every run() in this thread to `seconds` in total (None = no limit)
+@contextmanager
+def step_timeout(seconds):
+    previous = getattr(_context, "deadline", None)
+    _context.deadline = None if seconds is None else time.monotonic() + seconds
+    try:
+        yield
+    finally:
+        _context.deadline = previous
+
+
+def _kill_group(process, exited):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    exited.wait(GRACE_SECONDS)
+    # Children the leader left behind go too
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+# The caller's wait was interrupted (Ctrl-C): stop the group and reap the
+# leader here, before it leaves _running, so nothing is left behind
+def _stop_and_reap(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    deadline = time.monotonic() + GRACE_SECONDS
+    reaped = False
+    while not reaped and time.monotonic() < deadline:
+        reaped = os.waitpid(process.pid, os.WNOHANG)[0] != 0
+        if not reaped:
+            time.sleep(0.1)
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    if not reaped:
+        os.waitpid(process.pid, 0)
+
+
+# Stop every process group still running, e.g. on Ctrl-C
+def cancel_all():
+    with _running_lock:
+        running = list(_running.values())
+    killers = [threading.Thread(target=_kill_group, args=entry) for entry in running]
+    for killer in killers:
+        killer.start()
+    for killer in killers:
+        killer.join()
+
+
+atexit.register(cancel_all)
+
+
+# On Ctrl-C, refuse new commands and stop the running ones, then let
+# KeyboardInterrupt unwind the caller. The children have their own
+# process groups, so the terminal's SIGINT never reaches them.
+def handle_interrupts():
+    def interrupted(signum, frame):
+        _cancelled.set()
+        threading.Thread(target=cancel_all, daemon=True).start()
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGINT, interrupted)
+
+
+def _pump(stream, keep, sink, tail):
+    for line in stream:
+        if keep is not None:
+            keep.append(line)
+        else:
+            line = line.rstrip("\n")
+            tail.append(line)
+            sink(line)
+    stream.close()
+
+
+def _sink():
+    event_log = events.current()
+    if event_log is not None:
+        return event_log.message
+    return print
+
+
+def run(cmd, check=False, cwd=None, env=None, capture_output=False, text=False, timeout=None):
+    deadline = getattr(_context, "deadline", None)
+    if deadline is not None:
+        remaining = max(0.0, deadline - time.monotonic())
+        timeout = remaining if timeout is None else min(timeout, remaining)
+
+    if _cancelled.is_set():
+        raise Cancelled(cmd)
+
+    stream = not capture_output
+    start = time.time()
+    process = subprocess.Popen(
+        cmd, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=text or stream, errors="replace" if (text or stream) else None, start_new_session=True
+    )
+    exited = threading.Event()
+    with _running_lock:
+        _running[process.pid] = (process, exited)
+    if _cancelled.is_set():
+        threading.Thread(target=_kill_group, args=(process, exited), daemon=True).start()
+
+    tail = deque(maxlen=TAIL_LINES)
+    sink = _sink()
+    outputs = {"stdout": None if stream else [], "stderr": None if stream else []}
+    readers = [
+        threading.Thread(target=_pump, args=(getattr(process, name), outputs[name], sink, tail), daemon=True)
+        for name in ("stdout", "stderr")
+    ]
+    for reader in readers:
+        reader.start()
+
+    timer = None
+    timed_out = threading.Event()
+    if timeout is not None:
+        def expire():
+            timed_out.set()
+            _kill_group(process, exited)
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+
+    try:
+        try:
+            _pid, status, usage = os.wait4(process.pid, 0)
+        except BaseException:
+            _stop_and_reap(process)
+            raise
+    finally:
+        exited.set()
+        if timer is not None:
+            timer.cancel()
+        with _running_lock:
+            _running.pop(process.pid, None)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    end = time.time()
+    # A daemon the command left running (pm2 start) may still hold the
+    # pipes open; don't wait on it forever
+    for reader in readers:
+        reader.join(5)
+
+    event_log = events.current()
+    if event_log is not None:
+        event_log.record(
+            "process", phase=events.current_phase(), cmd=shlex.join(cmd), cwd=cwd,
+            start=round(start, 3), end=round(end, 3), duration=round(end - start, 3),
+            exit_code=process.returncode, cpu_user=round(usage.ru_utime, 3),
+            cpu_sys=round(usage.ru_stime, 3), max_rss_kb=usage.ru_maxrss,
+            timed_out=timed_out.is_set(),
+        )
+
+    if stream:
+        stdout, stderr = None, None
+        output = "\n".join(tail)
+    else:
+        empty = "" if text else b""
+        stdout = empty.join(outputs["stdout"])
+        stderr = empty.join(outputs["stderr"])
+        output = stdout
+    if timed_out.is_set():
+        raise ProcessTimedOut(cmd, timeout, output if stream else stdout, None if stream else stderr)
+    if check and process.returncode != 0:
+        raise ProcessFailed(process.returncode, cmd, output, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
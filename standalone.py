@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Next.js standalone output (NEXT_OUTPUT="standalone")
+#
+# With `output: "standalone"` in next.config, `next build` also writes
+# .next/standalone: a server.js plus only the node_modules the server
+# traces as needed. assemble() turns the built checkout into that:
+#
+#   server.js, package.json, package-lock.json, .env.local,
+#   .deploy-commit (the SHA head_commit() reads once .git is gone)
+#   node_modules/        traced production dependencies only
+#   .next/               server output, plus .next/static copied in
+#   .next/cache          moved over so BUILD_CACHE=keep still works
+#   public/
+#
+# The full checkout (sources, dev dependencies, .git) is deleted, so the
+# live folder, its backups and its artifacts hold only what runs. PM2
+# then starts `node server.js` directly (see instances.py); any folder
+# with a server.js at its root is started that way, so rollbacks to
+# older, non-standalone releases still use npm start.
+# ----------------------------------------------------------------
+
+import os
+import shutil
+
+import git_cache
+import npm_cache
+
+# Files the standalone server does not get from next build itself
+CARRIED_FILES = ["package-lock.json", ".env.local", git_cache.COMMIT_FILE]
+
+
+class StandaloneError(Exception):
+    pass
+
+
+def enabled(config):
+    return config.get("NEXT_OUTPUT", "server") == "standalone"
+
+
+def is_standalone(app_root):
+    return os.path.isfile(os.path.join(app_root, "server.js")) and os.path.isdir(os.path.join(app_root, ".next"))
+
+
+# Environment for `node server.js`: it reads PORT and HOSTNAME. HOSTNAME
+# is set explicitly because login shells often export the machine name.
+def server_env(config, port):
+    return dict(os.environ, PORT=str(port), HOSTNAME=config.get("NEXT_HOSTNAME", "0.0.0.0"))
+
+
+# Replace the built checkout at app_root with its standalone server.
+# Returns the folder sizes before and after, in bytes.
+def assemble(app_root):
+    build_dir = os.path.join(app_root, ".next")
+    output_dir = os.path.join(build_dir, "standalone")
+    if not os.path.isfile(os.path.join(output_dir, "server.js")):
+        raise StandaloneError(
+            f"{output_dir}/server.js not found: set output: \"standalone\" in next.config"
+            " (a monorepo with outputFileTracingRoot above the app is not supported)"
+        )
+    size_before = npm_cache.tree_size(app_root)
+
+    shutil.copytree(os.path.join(build_dir, "static"), os.path.join(output_dir, ".next", "static"), dirs_exist_ok=True)
+    if os.path.isdir(os.path.join(app_root, "public")):
+        shutil.copytree(os.path.join(app_root, "public"), os.path.join(output_dir, "public"), dirs_exist_ok=True)
+    if os.path.isdir(os.path.join(build_dir, "cache")):
+        os.rename(os.path.join(build_dir, "cache"), os.path.join(output_dir, ".next", "cache"))
+    for name in CARRIED_FILES:
+        if os.path.isfile(os.path.join(app_root, name)):
+            shutil.copy2(os.path.join(app_root, name), os.path.join(output_dir, name))
+
+    # Move the server out, then swap it in for the checkout
+    assembled = f"{app_root}.standalone"
+    checkout = f"{app_root}.checkout"
+    for leftover in (assembled, checkout):
+        shutil.rmtree(leftover, ignore_errors=True)
+    os.rename(output_dir, assembled)
+    os.rename(app_root, checkout)
+    os.rename(assembled, app_root)
+    shutil.rmtree(checkout, ignore_errors=True)
+    return {"before": size_before, "after": npm_cache.tree_size(app_root)}
@@ -7,22 +7,27 @@ echo $APP_ROOT
 echo $APP_NAME_PM2
 echo $PORT
 
-# Check if PM2 process with the specified name exists
-if pm2 list | grep -q $APP_NAME_PM2; then
-  # Check if the process is in "online" status
-  if pm2 list | grep $APP_NAME_PM2 | grep -q "online"; then
-    echo "PM2 process '$APP_NAME_PM2' is already running."
-  elif pm2 list | grep "$APP_NAME_PM2" | grep -q "stopped"; then
-    # If the process exists but is "stopped," restart it
-    pm2 restart $APP_NAME_PM2
-    echo "PM2 process '$APP_NAME_PM2' was stopped. Restarting it."
-  else
-    echo "Unexpected status for PM2 process '$APP_NAME_PM2'. Check PM2 logs for details."
-  fi
+# One `pm2 jlist`, matched on the exact name (see pm2.py)
+status=$(python3 pm2.py status "$APP_NAME_PM2") || exit 1
+status=${status##* }
+
+if [ "$status" = "online" ]; then
+  echo "PM2 process '$APP_NAME_PM2' is already running."
+elif [ "$status" = "stopped" ]; then
+  # If the process exists but is "stopped," restart it
+  pm2 restart $APP_NAME_PM2
+  echo "PM2 process '$APP_NAME_PM2' was stopped. Restarting it."
+elif [ "$status" != "missing" ]; then
+  echo "Unexpected status '$status' for PM2 process '$APP_NAME_PM2'. Check PM2 logs for details."
 else
   # If the process doesn't exist, start it in the correct directory
-  cd $APP_ROOT || exit 1  # Ensure we're in the correct directory before starting
-  pm2 start npm --name $APP_NAME_PM2 -- start -- -p $PORT
+  if [ "${PM2_MODE:-fork}" = "fork" ] && [ ! -f "$APP_ROOT/server.js" ]; then
+    cd $APP_ROOT || exit 1  # Ensure we're in the correct directory before starting
+    pm2 start npm --name $APP_NAME_PM2 -- start -- -p $PORT
+  else
+    # cluster / ports / standalone server.js: worked out by instances.py
+    python3 instances.py start || exit 1
+  fi
   pm2 save
   echo "PM2 process '$APP_NAME_PM2' started successfully."
 fi
@@ -3,11 +3,10 @@
 # Load configuration
 source ../conf/app.conf
 
-# Check if PM2 process with the specified name is running
-if pm2 list | grep -q "$APP_NAME_PM2"; then
-  # Stop the app if it's running
-  pm2 stop "$APP_NAME_PM2"
-  echo "PM2 process '$APP_NAME_PM2' stopped successfully."
-else
-  echo "PM2 process '$APP_NAME_PM2' is not running."
+# Stops the process only if one has exactly this name. With no arguments
+# that is APP_NAME_PM2; pass names to stop several apps in one pm2 call:
+#   ./stop.sh shop shop-admin
+if [ "$#" -eq 0 ]; then
+  set -- "$APP_NAME_PM2"
 fi
+python3 pm2.py stop "$@"
@@ -0,0 +1,55 @@
+import os
+
+import backup_store
+
+
+def test_list_backups_matches_the_whole_app_name(tmp_path):
+    source = tmp_path / "app"
+    source.mkdir()
+    (source / "page.js").write_text("v1")
+    repo = str(tmp_path / "repo")
+    backup_store.backup(repo, "shop", str(source), timestamp="20260101-000001")
+    backup_store.backup(repo, "shop-admin", str(source), timestamp="20260101-000002")
+    backup_store.backup(repo, "shop", str(source), timestamp="20260102-000001")
+
+    assert backup_store.list_backups(repo, "shop") == ["shop-20260101-000001", "shop-20260102-000001"]
+    assert backup_store.list_backups(repo, "shop-admin") == ["shop-admin-20260101-000002"]
+
+
+def test_gc_keeps_newest_per_app_and_restores(tmp_path):
+    source = tmp_path / "app"
+    source.mkdir()
+    repo = str(tmp_path / "repo")
+    for day in ("01", "02", "03"):
+        (source / "page.js").write_text(f"v{day}")
+        # Same size every time; a distinct mtime keeps this from leaning
+        # on ctime ticking between fast rewrites
+        os.utime(source / "page.js", ns=(int(day) * 10**9, int(day) * 10**9))
+        backup_store.backup(repo, "shop", str(source), timestamp=f"202601{day}-000000")
+    backup_store.backup(repo, "shop-admin", str(source), timestamp="20260101-000000")
+
+    removed = backup_store.gc(repo, keep=2)
+    assert removed["manifests"] == ["shop-20260101-000000"]
+    assert backup_store.list_backups(repo, "shop-admin") == ["shop-admin-20260101-000000"]
+
+    backup_store.restore(repo, "shop-20260102-000000", str(tmp_path / "restored"))
+    assert (tmp_path / "restored" / "page.js").read_text() == "v02"
+
+
+def test_same_size_edit_with_the_old_mtime_is_backed_up(tmp_path):
+    source = tmp_path / "app"
+    source.mkdir()
+    repo = str(tmp_path / "repo")
+    (source / "page.js").write_text("v1")
+    os.utime(source / "page.js", ns=(10**9, 10**9))
+    backup_store.backup(repo, "shop", str(source), timestamp="20260101-000000")
+
+    # Written elsewhere and renamed over it, mtime carried over
+    (tmp_path / "page.js").write_text("v2")
+    os.utime(tmp_path / "page.js", ns=(10**9, 10**9))
+    os.rename(tmp_path / "page.js", source / "page.js")
+    _, stats = backup_store.backup(repo, "shop", str(source), timestamp="20260102-000000")
+    assert stats["reused_files"] == 0
+
+    backup_store.restore(repo, "shop-20260102-000000", str(tmp_path / "restored"))
+    assert (tmp_path / "restored" / "page.js").read_text() == "v2"
@@ -0,0 +1,106 @@
+import shutil
+import subprocess
+from datetime import datetime, timezone
+
+import pytest
+
+import certs
+
+pytestmark = pytest.mark.skipif(shutil.which("openssl") is None, reason="needs openssl")
+
+
+def openssl(*args, cwd):
+    subprocess.run(["openssl", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def ec_key_args(key):
+    return ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes", "-keyout", key]
+
+
+# live/<lineage>/fullchain.pem for each (lineage, SANs, days valid),
+# signed by a throwaway CA
+@pytest.fixture(scope="module")
+def live_dir(tmp_path_factory):
+    root = tmp_path_factory.mktemp("letsencrypt")
+    openssl("req", "-x509", *ec_key_args("ca.key"), "-subj", "/CN=Test CA", "-days", "2", "-out", "ca.pem", cwd=root)
+    live = root / "live"
+    for lineage, sans, days in [
+        ("shop.example.com", ["shop.example.com", "www.shop.example.com"], 10),
+        ("blog.example.com", ["blog.example.com"], 45),
+        ("wild.example.org", ["*.example.org"], 200),
+    ]:
+        folder = live / lineage
+        folder.mkdir(parents=True)
+        (root / "san.ext").write_text("subjectAltName=" + ",".join(f"DNS:{name}" for name in sans) + "\n")
+        openssl("req", "-new", *ec_key_args(f"{lineage}.key"), "-subj", f"/CN={sans[0]}", "-out", f"{lineage}.csr",
+                cwd=root)
+        openssl("x509", "-req", "-in", f"{lineage}.csr", "-CA", "ca.pem", "-CAkey", "ca.key", "-CAcreateserial",
+                "-days", str(days), "-extfile", "san.ext", "-out", str(folder / "fullchain.pem"), cwd=root)
+    broken = live / "broken.example.com"
+    broken.mkdir()
+    (broken / "fullchain.pem").write_text("not a certificate\n")
+    return live
+
+
+@pytest.fixture
+def enabled_dir(tmp_path, live_dir):
+    enabled = tmp_path / "sites-enabled"
+    enabled.mkdir()
+    (enabled / "shop").write_text(
+        "server {\n"
+        "    server_name shop.example.com www.shop.example.com;\n"
+        f"    ssl_certificate {live_dir}/shop.example.com/fullchain.pem; # managed by Certbot\n"
+        "}\n"
+    )
+    (enabled / "api").write_text("server {\n    server_name api.example.org;  # covered by the wildcard\n}\n")
+    (enabled / "new").write_text(
+        "server {\n    server_name a.example.net b.example.net c.example.net _;\n    # server_name commented.example.net;\n}\n"
+    )
+    return enabled
+
+
+def test_read_cert(live_dir):
+    cert = certs.read_cert(str(live_dir / "shop.example.com" / "fullchain.pem"))
+    assert cert["subject"] == "shop.example.com"
+    assert cert["sans"] == ["shop.example.com", "www.shop.example.com"]
+    assert cert["not_after"].tzinfo is timezone.utc
+
+
+def test_scan_reports_unreadable_certificates(live_dir):
+    by_lineage = {cert["lineage"]: cert for cert in certs.scan(str(live_dir), workers=4)}
+    assert set(by_lineage) == {"shop.example.com", "blog.example.com", "wild.example.org", "broken.example.com"}
+    assert by_lineage["broken.example.com"]["error"]
+    assert by_lineage["shop.example.com"]["error"] is None
+
+
+def test_covers_wildcards_one_level_only():
+    assert certs.covers(["*.example.org"], "api.example.org")
+    assert not certs.covers(["*.example.org"], "example.org")
+    assert not certs.covers(["*.example.org"], "a.b.example.org")
+
+
+def test_inventory(live_dir, enabled_dir):
+    config = {"CERT_LIVE_DIR": str(live_dir), "NGINX_ENABLED_DIR": str(enabled_dir)}
+    inventory, uncovered = certs.inventory(config, now=datetime.now(timezone.utc))
+    by_lineage = {cert["lineage"]: cert for cert in inventory}
+    assert 9 < by_lineage["shop.example.com"]["days_left"] <= 10
+    assert by_lineage["shop.example.com"]["vhosts"] == ["shop"]
+    assert by_lineage["blog.example.com"]["vhosts"] == []
+    assert uncovered == ["a.example.net", "b.example.net", "c.example.net"]
+
+
+def test_renewal_plan(live_dir, enabled_dir):
+    config = {"CERT_LIVE_DIR": str(live_dir), "NGINX_ENABLED_DIR": str(enabled_dir)}
+    inventory, uncovered = certs.inventory(config)
+    plan = certs.renewal_plan(inventory, uncovered, renew_days=60, batch_size=2)
+    assert plan == [
+        ["certbot", "renew", "--no-random-sleep-on-renew"],
+        # Due by our 60 days but not by certbot's own 30
+        ["certbot", "renew", "--cert-name", "blog.example.com", "--force-renewal"],
+        ["certbot", "--nginx", "--cert-name", "a.example.net", "-d", "a.example.net", "-d", "b.example.net"],
+        ["certbot", "--nginx", "--cert-name", "c.example.net", "-d", "c.example.net"],
+    ]
+
+
+def test_nothing_due():
+    assert certs.renewal_plan([{"lineage": "x", "days_left": 80}], [], renew_days=30) == []
@@ -0,0 +1,110 @@
+import os
+import subprocess
+
+import pytest
+
+import git_cache
+
+
+def git(*args, cwd=None):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit(repo, name, content):
+    (repo / name).write_text(content)
+    git("add", name, cwd=repo)
+    git("commit", "--quiet", "-m", f"update {name}", cwd=repo)
+    return git("rev-parse", "HEAD", cwd=repo)
+
+
+@pytest.fixture
+def origin(tmp_path, monkeypatch):
+    for key, value in {
+        "GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@example.com",
+        "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@example.com",
+        "GIT_CONFIG_GLOBAL": os.devnull, "GIT_CONFIG_NOSYSTEM": "1",
+    }.items():
+        monkeypatch.setenv(key, value)
+    repo = tmp_path / "origin"
+    repo.mkdir()
+    git("init", "--quiet", "--initial-branch", "main", cwd=repo)
+    commit(repo, "page.js", "v1")
+    return repo
+
+
+def config_for(tmp_path, origin, mode, ref=None):
+    config = {"REPO_URL": f"file://{origin}", "DEPLOYMENT_ROOT": str(tmp_path / "deploy"), "GIT_CHECKOUT": mode}
+    if ref:
+        config["GIT_REF"] = ref
+    return config
+
+
+def test_mirror_path_is_readable_and_unique():
+    first = git_cache.mirror_path("/cache", "git@github.com:me/shop.git")
+    second = git_cache.mirror_path("/cache", "https://github.com/other/shop.git")
+    assert os.path.basename(first).startswith("shop-") and first.endswith(".git")
+    assert first != second
+
+
+@pytest.mark.parametrize("mode", ["clone", "shallow", "worktree"])
+def test_checkout_modes_check_out_head(tmp_path, origin, mode):
+    head = git("rev-parse", "HEAD", cwd=origin)
+    dest = tmp_path / "app"
+    assert git_cache.checkout(config_for(tmp_path, origin, mode), str(dest)) == head
+    assert (dest / "page.js").read_text() == "v1"
+
+
+def test_mirror_fetches_new_commits_incrementally(tmp_path, origin):
+    config = config_for(tmp_path, origin, "shallow")
+    git_cache.checkout(config, str(tmp_path / "first"))
+    mirror = git_cache.mirror_path(git_cache.cache_dir_for(config), config["REPO_URL"])
+    inode = os.stat(mirror).st_ino
+
+    head = commit(origin, "page.js", "v2")
+    assert git_cache.checkout(config, str(tmp_path / "second")) == head
+    assert (tmp_path / "second" / "page.js").read_text() == "v2"
+    # Same mirror, updated in place rather than cloned again
+    assert os.stat(mirror).st_ino == inode
+
+
+def test_shallow_checkout_is_depth_one(tmp_path, origin):
+    commit(origin, "page.js", "v2")
+    dest = tmp_path / "app"
+    git_cache.checkout(config_for(tmp_path, origin, "shallow"), str(dest))
+    assert git("rev-list", "--count", "HEAD", cwd=dest) == "1"
+    assert git("remote", "get-url", "origin", cwd=dest) == f"file://{origin}"
+
+
+@pytest.mark.parametrize("mode", ["clone", "shallow", "worktree"])
+def test_git_ref_pins_a_commit(tmp_path, origin, mode):
+    pinned = git("rev-parse", "HEAD", cwd=origin)
+    commit(origin, "page.js", "v2")
+    dest = tmp_path / "app"
+    assert git_cache.checkout(config_for(tmp_path, origin, mode, ref=pinned), str(dest)) == pinned
+    assert (dest / "page.js").read_text() == "v1"
+
+
+def test_remote_sha_without_cloning(tmp_path, origin):
+    head = git("rev-parse", "HEAD", cwd=origin)
+    assert git_cache.remote_sha(config_for(tmp_path, origin, "clone", ref="main")) == head
+    with pytest.raises(ValueError):
+        git_cache.remote_sha(config_for(tmp_path, origin, "clone", ref="no-such-branch"))
+
+
+def test_unknown_mode_is_rejected(tmp_path, origin):
+    with pytest.raises(ValueError):
+        git_cache.checkout(config_for(tmp_path, origin, "rsync"), str(tmp_path / "app"))
+
+
+def test_commit_survives_git_removal_and_worktrees_are_pruned(tmp_path, origin):
+    config = config_for(tmp_path, origin, "worktree")
+    dest = tmp_path / "app"
+    head = git_cache.checkout(config, str(dest))
+    mirror = git_cache.mirror_path(git_cache.cache_dir_for(config), config["REPO_URL"])
+    assert str(dest) in git("worktree", "list", cwd=mirror)
+    # What standalone.assemble() leaves behind: the tree without .git
+    (dest / ".git").unlink()
+    assert git_cache.read_commit(str(dest)) == head
+
+    git_cache.prune_worktrees(config)
+    assert str(dest) not in git("worktree", "list", cwd=mirror)
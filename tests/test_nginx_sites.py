@@ -0,0 +1,24 @@
+import nginx_sites
+
+
+def test_legacy_port_is_only_replaced_as_a_value():
+    template = nginx_sites.Template(
+        "server {\n"
+        "    listen PORT;\n"
+        "    server_name SUBDOMAIN.DOMAIN;\n"
+        "    proxy_set_header X-Forwarded-PORT $http_x_forwarded_PORT;\n"
+        "    proxy_pass http://127.0.0.1:PORT/;\n"
+        "}\n"
+    )
+    assert template.legacy
+    rendered = template.render({"PORT": 3000, "DOMAIN_FULL": "shop.example.com"})
+    assert "listen 3000;" in rendered
+    assert "server_name shop.example.com;" in rendered
+    assert "X-Forwarded-PORT $http_x_forwarded_PORT;" in rendered
+    assert "proxy_pass http://127.0.0.1:3000/;" in rendered
+
+
+def test_placeholders_win_over_legacy_tokens():
+    template = nginx_sites.Template("proxy_pass http://127.0.0.1:{{ PORT }}; # PORT")
+    assert not template.legacy
+    assert template.render({"PORT": 3001}) == "proxy_pass http://127.0.0.1:3001; # PORT"
@@ -0,0 +1,119 @@
+import json
+import os
+import sys
+import textwrap
+
+import pytest
+
+import pm2
+
+# Stand-in pm2: `jlist` prints processes.json (after a notice line, as
+# real pm2 sometimes does), stop/delete edit it, every call is logged
+FAKE_PM2 = textwrap.dedent("""\
+    #!{python}
+    import json
+    import os
+    import sys
+
+    state = os.environ["FAKE_PM2_STATE"]
+    with open(state + ".calls", "a") as calls:
+        calls.write(" ".join(sys.argv[1:]) + "\\n")
+    with open(state) as f:
+        processes = json.load(f)
+    action, names = sys.argv[1], sys.argv[2:]
+    if action == "jlist":
+        print(">>>> In-memory PM2 is out-of-date, do:")
+        print(json.dumps(processes))
+    elif action in ("stop", "delete"):
+        if action == "delete":
+            processes = [p for p in processes if p["name"] not in names and p["pm2_env"]["namespace"] not in names]
+        else:
+            for p in processes:
+                if p["name"] in names or p["pm2_env"]["namespace"] in names:
+                    p["pm2_env"]["status"] = "stopped"
+        with open(state, "w") as f:
+            json.dump(processes, f)
+""")
+
+
+def process(name, status="online", namespace="default", pid=100, memory=50 * 1048576, cpu=3):
+    return {"name": name, "pm_id": 0, "pid": pid, "pm2_env": {"status": status, "namespace": namespace},
+            "monit": {"memory": memory, "cpu": cpu}}
+
+
+@pytest.fixture
+def fake_pm2(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "pm2"
+    script.write_text(FAKE_PM2.format(python=sys.executable))
+    script.chmod(0o755)
+    state = tmp_path / "processes.json"
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_PM2_STATE", str(state))
+
+    def install(processes):
+        state.write_text(json.dumps(processes))
+        pm2.changed()
+
+    def calls():
+        path = tmp_path / "processes.json.calls"
+        return path.read_text().splitlines() if path.exists() else []
+
+    install.calls = calls
+    yield install
+    pm2.changed()
+
+
+def test_lookups_share_one_jlist(fake_pm2):
+    fake_pm2([process("shop"), process("shop-admin", status="errored", pid=0)])
+    assert pm2.exists("shop")
+    assert pm2.status("shop") == "online"
+    assert pm2.status("shop-admin") == "errored"
+    assert pm2.pids("shop-admin") == []
+    assert pm2.memory("shop") == 50 * 1048576
+    assert fake_pm2.calls() == ["jlist"]
+
+
+def test_names_match_exactly(fake_pm2):
+    fake_pm2([process("shop-admin")])
+    assert not pm2.exists("shop")
+    assert pm2.status("shop") is None
+
+
+def test_ports_mode_instances_are_found_by_namespace(fake_pm2):
+    fake_pm2([
+        process("shop-3000", namespace="shop", pid=11, cpu=5),
+        process("shop-3001", namespace="shop", pid=12, status="stopped", cpu=7),
+    ])
+    assert pm2.pids("shop") == [11, 12]
+    assert pm2.cpu("shop") == 12
+    assert pm2.status("shop") == "stopped"
+
+
+def test_batch_acts_on_present_names_in_one_call(fake_pm2):
+    fake_pm2([process("shop"), process("blog")])
+    assert pm2.delete(["shop", "missing", "blog", "shop"]) == ["shop", "blog"]
+    assert fake_pm2.calls() == ["jlist", "delete shop blog"]
+    # The table is read again after a change
+    assert not pm2.exists("shop")
+    assert fake_pm2.calls()[-1] == "jlist"
+
+
+def test_nothing_to_do_skips_pm2(fake_pm2):
+    fake_pm2([process("blog")])
+    assert pm2.stop(["shop"]) == []
+    assert fake_pm2.calls() == ["jlist"]
+
+
+def test_stop_then_status(fake_pm2):
+    fake_pm2([process("shop")])
+    assert pm2.stop(["shop"]) == ["shop"]
+    assert pm2.status("shop") == "stopped"
+
+
+def test_jlist_without_a_process_list_is_an_error(fake_pm2, tmp_path):
+    (tmp_path / "processes.json").write_text("{}")
+    pm2.changed()
+    with pytest.raises(ValueError):
+        pm2.table()
@@ -0,0 +1,151 @@
+import os
+import socket
+import struct
+import threading
+
+import pytest
+
+import preflight
+
+
+def encode_name(name):
+    return b"".join(bytes([len(label)]) + label.encode() for label in name.split(".")) + b"\x00"
+
+
+def record(name_bytes, record_type, data):
+    return name_bytes + struct.pack("!HHIH", record_type, 1, 300, len(data)) + data
+
+
+# Stub DNS resolver on a local UDP port. zones maps a name to
+# (rcode, [(type, data)]); answers point back at the question with a
+# compression pointer, as real resolvers do.
+class StubResolver:
+    def __init__(self, zones, stray_first=False):
+        self.zones = zones
+        self.stray_first = stray_first
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.address = self.socket.getsockname()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                query, client = self.socket.recvfrom(512)
+            except OSError:
+                return
+            query_id = struct.unpack("!H", query[:2])[0]
+            end = preflight._skip_name(query, 12)
+            question = query[12:end + 4]
+            labels, offset = [], 12
+            while query[offset]:
+                labels.append(query[offset + 1:offset + 1 + query[offset]].decode())
+                offset += 1 + query[offset]
+            name = ".".join(labels)
+            if name not in self.zones:
+                continue
+            rcode, answers = self.zones[name]
+            body = b"".join(record(b"\xc0\x0c" if index == 0 else data_name, record_type, data)
+                            for index, (record_type, data, data_name) in enumerate(answers))
+            header = struct.pack("!HHHHHH", query_id, 0x8180 | rcode, 1, len(answers), 0, 0)
+            if self.stray_first:
+                self.socket.sendto(struct.pack("!HHHHHH", query_id ^ 1, 0x8180, 1, 0, 0, 0) + question, client)
+            self.socket.sendto(header + question + body, client)
+
+    def close(self):
+        self.socket.close()
+
+
+def a(address, name=None):
+    return (1, socket.inet_aton(address), encode_name(name) if name else None)
+
+
+def cname(target):
+    return (5, encode_name(target), None)
+
+
+@pytest.fixture
+def resolver():
+    servers = []
+
+    def start(zones, **kwargs):
+        server = StubResolver(zones, **kwargs)
+        servers.append(server)
+        return server.address
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_a_records(resolver):
+    address = resolver({"shop.example.com": (0, [a("203.0.113.7"), a("203.0.113.8", "shop.example.com")])})
+    assert preflight.query_a("shop.example.com", address) == ["203.0.113.7", "203.0.113.8"]
+
+
+def test_cname_chain_answer(resolver):
+    address = resolver({"www.example.com": (0, [cname("edge.example.net"), a("198.51.100.1", "edge.example.net")])})
+    assert preflight.query_a("www.example.com.", address) == ["198.51.100.1"]
+
+
+def test_nxdomain_is_no_records(resolver):
+    address = resolver({"gone.example.com": (3, [])})
+    assert preflight.query_a("gone.example.com", address) == []
+
+
+def test_server_failure_raises(resolver):
+    address = resolver({"broken.example.com": (2, [])})
+    with pytest.raises(OSError, match="rcode 2"):
+        preflight.query_a("broken.example.com", address)
+
+
+def test_reply_with_another_id_is_ignored(resolver):
+    address = resolver({"shop.example.com": (0, [a("203.0.113.7")])}, stray_first=True)
+    assert preflight.query_a("shop.example.com", address) == ["203.0.113.7"]
+
+
+def test_silent_resolver_times_out(resolver):
+    address = resolver({})
+    with pytest.raises(OSError):
+        preflight.query_a("shop.example.com", address, timeout=0.2)
+
+
+def test_check_dns_compares_with_this_host(resolver):
+    address = resolver({"shop.example.com": (0, [a("203.0.113.7")])})
+    config = {"SUBDOMAIN": "shop", "DOMAIN": "example.com", "DNS_RESOLVER": f"{address[0]}:{address[1]}"}
+    assert preflight.check_dns(dict(config, PUBLIC_IPS="203.0.113.7"), "nginx")[0] == "ok"
+    status, detail = preflight.check_dns(dict(config, PUBLIC_IPS="192.0.2.1"), "nginx")
+    assert status == "fail" and "not at this host" in detail
+    assert preflight.check_dns(dict(config, PUBLIC_IPS="192.0.2.1"), "deploy")[0] == "warn"
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    yield str(server.getsockname()[1])
+    server.close()
+
+
+def test_busy_port_is_fine_only_when_the_app_holds_it(listener, monkeypatch):
+    config = {"PORT": listener, "APP_NAME_PM2": "shop"}
+    monkeypatch.setattr(preflight.pm2, "pids", lambda name: [os.getpid()])
+    assert preflight.check_port(config, "deploy")[0] == "ok"
+
+    # 'shop' is running, but something else is on its port
+    monkeypatch.setattr(preflight.pm2, "pids", lambda name: [4194305])
+    status, detail = preflight.check_port(config, "deploy")
+    assert status == "fail" and str(os.getpid()) in detail
+
+    monkeypatch.setattr(preflight.pm2, "pids", lambda name: [])
+    assert preflight.check_port(config, "deploy")[0] == "fail"
+
+
+def test_env_path_comes_from_the_caller(tmp_path):
+    env_file = tmp_path / ".env.local"
+    assert preflight.check_env({}, "deploy", str(env_file))[0] == "fail"
+    env_file.write_text("KEY=value\n")
+    assert preflight.check_env({}, "deploy", str(env_file)) == ("ok", str(env_file))
+    assert preflight.check_env({}, "deploy")[0] == "fail"
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import probe
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        if self.path == "/warming" and server.requests <= 3:
+            self._send(503, b"warming up")
+        elif self.path == "/missing":
+            self._send(404, b"not found")
+        elif self.path == "/chunked":
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for part in (b"hello ", b"world"):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(part), part))
+            self.wfile.write(b"0\r\n\r\n")
+        elif self.path == "/garbled":
+            self.wfile.write(b"HTTP/1.1\r\n\r\n")
+            self.close_connection = True
+        else:
+            self._send(200, b"ok")
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    httpd.requests = 0
+    httpd.connections = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def port_of(server):
+    return str(server.server_address[1])
+
+
+def quiet(message):
+    pass
+
+
+def test_percentiles_nearest_rank():
+    latencies = [index / 1000 for index in range(1, 101)]
+    assert probe.percentiles(latencies) == {50: 50.0, 95: 95.0, 99: 99.0}
+    assert probe.percentiles([]) == {50: None, 95: None, 99: None}
+
+
+def test_burst_reuses_connections(server):
+    config = {"PROBE_ROUTES": "/", "PROBE_REQUESTS": "40", "PROBE_CONCURRENCY": "4", "PROBE_TIMEOUT": "5"}
+    result = probe.run(config, [port_of(server)], report=quiet)
+    assert result["errors"] == 0
+    assert result["requests"] == 40
+    assert all(value is not None for value in result["percentiles"].values())
+    # 41 requests (readiness + burst) over at most PROBE_CONCURRENCY connections
+    assert server.connections <= 4
+
+
+def test_waits_until_route_is_ready(server):
+    config = {"PROBE_ROUTES": "/warming", "PROBE_REQUESTS": "5", "PROBE_TIMEOUT": "10"}
+
+    async def ready():
+        pool = probe.ConnectionPool(size=2, timeout=5)
+        try:
+            return await probe.wait_ready(pool, [f"http://127.0.0.1:{port_of(server)}/warming"], 10, interval=0.05)
+        finally:
+            pool.close()
+
+    assert asyncio.run(ready()) == {}
+    assert probe.run(config, [port_of(server)], report=quiet)["errors"] == 0
+
+
+def test_route_that_never_becomes_ready_fails(server):
+    config = {"PROBE_ROUTES": "/missing", "PROBE_TIMEOUT": "0.5"}
+    with pytest.raises(probe.ProbeError, match="answered 404"):
+        probe.run(config, [port_of(server)], report=quiet)
+
+
+def test_unreachable_port_fails():
+    config = {"PROBE_ROUTES": "/", "PROBE_TIMEOUT": "0.5"}
+    with pytest.raises(probe.ProbeError, match="not reachable"):
+        probe.run(config, ["1"], report=quiet)
+
+
+def test_malformed_status_line_fails_cleanly(server):
+    config = {"PROBE_ROUTES": "/garbled", "PROBE_TIMEOUT": "0.5"}
+    with pytest.raises(probe.ProbeError, match="malformed status line"):
+        probe.run(config, [port_of(server)], report=quiet)
+
+
+def test_latency_threshold(server):
+    config = {"PROBE_ROUTES": "/", "PROBE_REQUESTS": "10", "PROBE_TIMEOUT": "5", "PROBE_P50_MS": "0.000001"}
+    with pytest.raises(probe.ProbeError, match="p50"):
+        probe.run(config, [port_of(server)], report=quiet)
+
+
+def test_chunked_body(server):
+    async def fetch():
+        pool = probe.ConnectionPool(size=1, timeout=5)
+        try:
+            return await pool.get(f"http://127.0.0.1:{port_of(server)}/chunked", keep_body=True)
+        finally:
+            pool.close()
+
+    result = asyncio.run(fetch())
+    assert result["status"] == 200
+    assert result["body"] == b"hello world"
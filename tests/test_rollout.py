@@ -0,0 +1,148 @@
+import os
+import sys
+import textwrap
+
+import pytest
+
+import rollout
+import runner
+
+# One stand-in for deploy.py, releases.py and rollback.py. A host's
+# state is two files: `live` (what rollback.py --current prints) and
+# `healthy`. `behaviour` says what its deploy does.
+FAKE_SCRIPT = textwrap.dedent("""\
+    import os
+    import sys
+
+    script = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+
+    def read(name, default=""):
+        try:
+            with open(name) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return default
+
+    def write(name, value):
+        with open(name, "w") as f:
+            f.write(value)
+
+    with open("calls", "a") as f:
+        f.write(" ".join([script] + args) + "\\n")
+
+    if script == "deploy.py":
+        behaviour = read("behaviour", "ok")
+        if behaviour == "fail-before":
+            sys.exit(1)
+        if behaviour == "stop-then-fail":
+            # In place: the app was stopped, then the swap failed
+            write("live", read("live") + ":stopped")
+            write("healthy", "no")
+            sys.exit(1)
+        write("live", "release:" + args[args.index("--timestamp") + 1])
+        write("healthy", "no" if behaviour == "unhealthy" else "yes")
+        sys.exit(1 if behaviour == "fail-after" else 0)
+    if script == "releases.py":
+        sys.exit(0 if read("healthy", "yes") == "yes" else 1)
+    if script == "rollback.py":
+        if args == ["--current"]:
+            print(read("live", "none"))
+            sys.exit(0)
+        write("live", args[1])
+        write("healthy", "yes")
+""")
+
+
+def make_host(root, name, live, behaviour="ok"):
+    scripts = root / name
+    scripts.mkdir()
+    for script in ("deploy.py", "releases.py", "rollback.py"):
+        (scripts / script).write_text(FAKE_SCRIPT)
+    (scripts / "live").write_text(live)
+    (scripts / "behaviour").write_text(behaviour)
+    return scripts
+
+
+def calls(scripts, script):
+    return [line for line in (scripts / "calls").read_text().splitlines() if line.startswith(script)]
+
+
+@pytest.fixture
+def fleet(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "python3").symlink_to(sys.executable)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    work = tmp_path / "scripts"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    monkeypatch.setattr(runner, "handle_interrupts", lambda: None)
+    return tmp_path
+
+
+def run_rollout(fleet, hosts, waves):
+    hosts_file = fleet / "hosts.conf"
+    hosts_file.write_text("".join(f"{name}  local  {path}\n" for name, path in hosts))
+    argv = ["rollout.py", str(hosts_file), "--waves", waves, "--yes"]
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(sys, "argv", argv)
+        try:
+            rollout.main()
+        except SystemExit as e:
+            return e.code
+    return 0
+
+
+def test_plan_waves_percentages_and_rest():
+    waves = rollout.plan_waves(list("abcdefgh"), "1,25%,rest")
+    assert waves == [["a"], ["b", "c"], ["d", "e", "f", "g", "h"]]
+
+
+def test_rollback_target():
+    assert rollout.rollback_target("release:20260101-000000", "20260202-000000") == "release:20260101-000000"
+    assert rollout.rollback_target("inplace:1234", "20260202-000000") == "backup:20260202-000000"
+    assert rollout.rollback_target("none", "20260202-000000") is None
+
+
+def test_healthy_rollout_deploys_every_wave(fleet):
+    web1 = make_host(fleet, "web1", "release:old1")
+    web2 = make_host(fleet, "web2", "release:old2")
+    assert run_rollout(fleet, [("web1", web1), ("web2", web2)], "1,rest") == 0
+    assert (web1 / "live").read_text().startswith("release:2")
+    assert calls(web2, "deploy.py")
+    assert not calls(web1, "rollback.py --to")
+
+
+def test_unhealthy_wave_rolls_back_to_the_recorded_release(fleet):
+    web1 = make_host(fleet, "web1", "release:old1")
+    web2 = make_host(fleet, "web2", "release:old2", behaviour="unhealthy")
+    web3 = make_host(fleet, "web3", "release:old3")
+    assert run_rollout(fleet, [("web1", web1), ("web2", web2), ("web3", web3)], "2,rest") == 1
+    assert calls(web1, "rollback.py --to") == ["rollback.py --to release:old1"]
+    assert calls(web2, "rollback.py --to") == ["rollback.py --to release:old2"]
+    assert (web2 / "live").read_text() == "release:old2"
+    assert not (web3 / "calls").exists()
+
+
+def test_host_that_never_switched_is_not_rolled_back(fleet):
+    web1 = make_host(fleet, "web1", "release:old1", behaviour="fail-before")
+    web2 = make_host(fleet, "web2", "release:old2", behaviour="fail-after")
+    assert run_rollout(fleet, [("web1", web1), ("web2", web2)], "rest") == 1
+    assert not calls(web1, "rollback.py --to")
+    assert calls(web2, "rollback.py --to") == ["rollback.py --to release:old2"]
+
+
+def test_in_place_host_rolls_back_to_its_deploy_backup(fleet):
+    web1 = make_host(fleet, "web1", "inplace:42", behaviour="unhealthy")
+    assert run_rollout(fleet, [("web1", web1)], "rest") == 1
+    timestamp = calls(web1, "deploy.py")[0].split("--timestamp ")[1]
+    assert calls(web1, "rollback.py --to") == [f"rollback.py --to backup:{timestamp}"]
+
+
+def test_in_place_host_stopped_without_a_swap_is_restored(fleet):
+    web1 = make_host(fleet, "web1", "inplace:42", behaviour="stop-then-fail")
+    assert run_rollout(fleet, [("web1", web1)], "rest") == 1
+    timestamp = calls(web1, "deploy.py")[0].split("--timestamp ")[1]
+    assert calls(web1, "rollback.py --to") == [f"rollback.py --to backup:{timestamp}"]
+    assert (web1 / "healthy").read_text() == "yes"
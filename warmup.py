@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# ----------------------------------------------------------------
+# Cache warm-up crawl for a freshly started app (WARMUP="on")
+#
+# Routes come from WARMUP_ROUTES (comma-separated) or else from the
+# app's own sitemap (WARMUP_SITEMAP, default /sitemap.xml; sitemap
+# indexes are followed one level). Every route is requested on every
+# local instance port, WARMUP_CONCURRENCY at a time, until the list is
+# done or WARMUP_BUDGET seconds (sitemap fetches included) are up.
+# Warm-up never fails a deploy; failures and slow routes are reported.
+# ----------------------------------------------------------------
+
+import asyncio
+import time
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+
+import probe
+
+SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+
+def _locs(xml_bytes, tag):
+    root = ElementTree.fromstring(xml_bytes)
+    return [
+        element.findtext(f"{SITEMAP_NS}loc") or element.findtext("loc")
+        for element in root.iter()
+        if element.tag in (f"{SITEMAP_NS}{tag}", tag)
+    ]
+
+
+# Path (plus query) of a sitemap URL, so it can be requested locally
+def _path_of(url):
+    parts = urllib.parse.urlsplit(url.strip())
+    return (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+
+async def sitemap_routes(pool, base, sitemap_path, limit):
+    result = await pool.get(base + sitemap_path, keep_body=True)
+    if result["status"] >= 400:
+        raise probe.ProbeError(f"{sitemap_path} answered {result['status']}")
+    nested = _locs(result["body"], "sitemap")
+    routes = _locs(result["body"], "url")
+    for sitemap_url in nested:
+        if len(routes) >= limit:
+            break
+        child = await pool.get(base + _path_of(sitemap_url), keep_body=True)
+        if child["status"] < 400:
+            routes += _locs(child["body"], "url")
+    unique = list(dict.fromkeys(_path_of(url) for url in routes if url))
+    return unique[:limit]
+
+
+async def _warm(config, ports, report):
+    budget = float(config.get("WARMUP_BUDGET", "30"))
+    deadline = time.monotonic() + budget
+    pool = probe.ConnectionPool(
+        size=int(config.get("WARMUP_CONCURRENCY", "4")),
+        timeout=float(config.get("WARMUP_REQUEST_TIMEOUT", "15")),
+    )
+    bases = [f"http://127.0.0.1:{port}" for port in ports]
+    try:
+        if config.get("WARMUP_ROUTES"):
+            routes = [route.strip() for route in config["WARMUP_ROUTES"].split(",") if route.strip()]
+        else:
+            sitemap = config.get("WARMUP_SITEMAP", "/sitemap.xml")
+            try:
+                # The sitemap (and any nested ones) count against the budget too
+                routes = await asyncio.wait_for(
+                    sitemap_routes(pool, bases[0], sitemap, int(config.get("WARMUP_MAX_ROUTES", "500"))),
+                    max(0.1, deadline - time.monotonic()),
+                )
+            except (probe.ProbeError, ElementTree.ParseError, OSError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError, ValueError) as e:
+                report(f"Warm-up: no usable sitemap at {sitemap} ({str(e) or type(e).__name__}); warming / only.")
+                routes = ["/"]
+
+        queue = asyncio.Queue()
+        for route in routes:
+            for base in bases:
+                queue.put_nowait((base, route))
+        total = queue.qsize()
+        timings = []
+        failures = []
+        step = max(1, total // 10)
+        report(f"Warm-up: {len(routes)} routes x {len(bases)} instance(s), budget {budget:.0f}s...")
+
+        async def worker():
+            while not queue.empty() and time.monotonic() < deadline:
+                base, route = queue.get_nowait()
+                try:
+                    result = await asyncio.wait_for(pool.get(base + route), max(0.1, deadline - time.monotonic()))
+                    if result["status"] >= 400:
+                        failures.append((route, f"answered {result['status']}"))
+                    else:
+                        timings.append((result["seconds"], route))
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                    failures.append((route, str(e) or type(e).__name__))
+                done = len(timings) + len(failures)
+                if done % step == 0 or done == total:
+                    report(f"Warm-up: {done}/{total} done, {len(failures)} failed")
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(int(config.get("WARMUP_CONCURRENCY", "4")))))
+    finally:
+        pool.close()
+
+    return {
+        "total": total,
+        "warmed": len(timings),
+        "failures": failures,
+        "skipped": queue.qsize(),
+        "seconds": time.monotonic() - started,
+        "timings": sorted(timings, reverse=True),
+    }
+
+
+# Warm every route on `ports` and return a summary dict; report() gets
+# progress, per-route timings for the slowest routes, and failures
+def run(config, ports, report=print):
+    result = asyncio.run(_warm(config, ports, report))
+    report(
+        f"Warm-up finished in {result['seconds']:.1f}s: {result['warmed']} warmed,"
+        f" {len(result['failures'])} failed, {result['skipped']} skipped (budget)."
+    )
+    for seconds, route in result["timings"][:int(config.get("WARMUP_REPORT_SLOWEST", "10"))]:
+        report(f"  {seconds * 1000:8.1f} ms  {route}")
+    for route, detail in result["failures"]:
+        report(f"  FAILED       {route}: {detail}")
+    return result